@@ -0,0 +1,19 @@
+import z5py
+from heimdall import view, to_source
+from heimdall.server import SourceServer, connect
+
+
+# runs server and client in the same process;
+# usually the server is started with `serve_container` and
+# several viewer processes connect to it
+def example():
+    path = '/home/pape/Work/data/cremi/example/sampleA.n5'
+    with z5py.File(path) as f:
+        raw = to_source(f['volumes/raw'], name='raw')
+        seg = to_source(f['volumes/segmentation/groundtruth'], name='seg')
+        with SourceServer([raw, seg], n_threads=4) as server:
+            view(*connect(server.address))
+
+
+if __name__ == '__main__':
+    example()
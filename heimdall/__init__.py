@@ -1 +1,10 @@
-from .viewer import view, view_arrays, view_container, to_source
+# the viewer functions are imported on first access, so that importing a heimdall module,
+# e.g. in the worker processes of heimdall.process_pool, does not import napari and qt
+_viewer_functions = ('view', 'view_arrays', 'view_container', 'to_source')
+
+
+def __getattr__(name):
+    if name in _viewer_functions:
+        from . import viewer
+        return getattr(viewer, name)
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
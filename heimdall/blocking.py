@@ -0,0 +1,98 @@
+import itertools
+from concurrent import futures
+import numpy as np
+
+
+def infer_chunks(data, default_chunk_size=64):
+    """ Infer the chunk shape of an array-like.
+
+    Falls back to a cubic chunk shape of `default_chunk_size` (clipped to the data shape)
+    if the data does not expose chunks, e.g. for numpy arrays or contiguous hdf5 datasets.
+    """
+    shape = data.shape
+    chunks = getattr(data, 'chunks', None)
+    if chunks is None or len(chunks) != len(shape):
+        chunks = tuple(min(default_chunk_size, sh) for sh in shape)
+    return tuple(max(int(ch), 1) for ch in chunks)
+
+
+def blocks_in_bounding_box(bb, chunks):
+    """ Iterate over the ids of all blocks that overlap with the bounding box.
+
+    Arguments:
+        bb [tuple[slice]] - normalized bounding box, start and stop must be set
+        chunks [tuple[int]] - the block shape
+    """
+    ranges = [range(b.start // ch, (b.stop + ch - 1) // ch) for b, ch in zip(bb, chunks)]
+    return itertools.product(*ranges)
+
+
+def block_bounding_box(block_id, chunks, shape):
+    """ Bounding box of the block with the given id.
+    """
+    return tuple(slice(bid * ch, min((bid + 1) * ch, sh))
+                 for bid, ch, sh in zip(block_id, chunks, shape))
+
+
+def n_blocks(shape, chunks):
+    """ Number of blocks along each axis.
+    """
+    return tuple((sh + ch - 1) // ch for sh, ch in zip(shape, chunks))
+
+
+def read_cost(bb, chunks):
+    """ Number of values in the chunks that need to be read for the bounding box.
+    """
+    cost = 1
+    for b, ch in zip(bb, chunks):
+        cost *= ((b.stop + ch - 1) // ch - b.start // ch) * ch
+    return cost
+
+
+def overlap_bounding_boxes(bb, block_bb):
+    """ Overlap of bounding box and block bounding box, local to both of them.
+
+    Returns None if the two do not overlap.
+    """
+    overlap = tuple(slice(max(b.start, bl.start), min(b.stop, bl.stop))
+                    for b, bl in zip(bb, block_bb))
+    if any(ov.start >= ov.stop for ov in overlap):
+        return None
+    in_bb = tuple(slice(ov.start - b.start, ov.stop - b.start)
+                  for ov, b in zip(overlap, bb))
+    in_block = tuple(slice(ov.start - bl.start, ov.stop - bl.start)
+                     for ov, bl in zip(overlap, block_bb))
+    return in_bb, in_block
+
+
+def read_blockwise(bb, shape, chunks, dtype, read_block, n_threads=1, out=None):
+    """ Assemble the data in a bounding box from individual blocks.
+
+    Arguments:
+        bb [tuple[slice]] - normalized bounding box
+        shape [tuple[int]] - shape of the full data
+        chunks [tuple[int]] - the block shape
+        dtype [str or np.dtype] - data type of the output
+        read_block [callable] - function that returns the data for a block id
+        n_threads [int] - number of threads used to read the blocks (default: 1)
+        out [np.ndarray] - output array, will be allocated if not given (default: None)
+    """
+    if out is None:
+        out = np.empty(tuple(b.stop - b.start for b in bb), dtype=dtype)
+
+    def _read(block_id):
+        block_bb = block_bounding_box(block_id, chunks, shape)
+        overlap = overlap_bounding_boxes(bb, block_bb)
+        if overlap is None:
+            return
+        in_bb, in_block = overlap
+        out[in_bb] = read_block(block_id)[in_block]
+
+    block_ids = list(blocks_in_bounding_box(bb, chunks))
+    if n_threads > 1 and len(block_ids) > 1:
+        with futures.ThreadPoolExecutor(n_threads) as tp:
+            list(tp.map(_read, block_ids))
+    else:
+        for block_id in block_ids:
+            _read(block_id)
+    return out
@@ -0,0 +1,199 @@
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent import futures
+import numpy as np
+
+
+def nbytes(value):
+    """ Size of a cached value in bytes.
+    """
+    return getattr(value, 'nbytes', 0)
+
+
+class CompressedChunk:
+    """ Chunk that is held compressed in memory.
+    """
+    def __init__(self, data, level=1):
+        data = np.ascontiguousarray(data)
+        self._shape = data.shape
+        self._dtype = data.dtype
+        self._buffer = zlib.compress(data.tobytes(), level)
+
+    @property
+    def nbytes(self):
+        return len(self._buffer)
+
+    def decompress(self):
+        return np.frombuffer(zlib.decompress(self._buffer), dtype=self._dtype).reshape(self._shape)
+
+
+class QuantizedChunk:
+    """ Chunk of float data that is held in memory quantized to the display precision.
+
+    The values are mapped linearly from the contrast limits to the range of the quantized dtype,
+    values outside of the contrast limits are clipped and nans are mapped to the lower limit.
+
+    Arguments:
+        data [np.ndarray] - the data
+        min_val [float] - lower contrast limit
+        max_val [float] - upper contrast limit
+        dtype [str] - the quantized dtype, 'uint8' or 'uint16' (default: 'uint8')
+    """
+    def __init__(self, data, min_val, max_val, dtype='uint8'):
+        self._dtype = np.dtype(data.dtype)
+        self._contrast_limits = (min_val, max_val)
+        max_quantized = np.iinfo(dtype).max
+        self._scale = max_quantized / max(float(max_val) - float(min_val), np.finfo('float32').eps)
+        data = (np.asarray(data, dtype='float32') - min_val) * self._scale
+        data = np.clip(np.nan_to_num(data, nan=0.), 0, max_quantized)
+        self._data = np.round(data).astype(dtype)
+
+    @property
+    def nbytes(self):
+        return self._data.nbytes
+
+    @property
+    def contrast_limits(self):
+        return self._contrast_limits
+
+    @property
+    def data(self):
+        return self._data
+
+    def dequantize(self):
+        return (self._data / self._scale + self._contrast_limits[0]).astype(self._dtype)
+
+
+class ChunkCache:
+    """ Thread-safe least-recently-used cache for chunks.
+
+    The size of the cache is measured in bytes. A single cache can be shared
+    between several sources by including an identifier of the source in the keys,
+    e.g. `(source_name, level, chunk_id)`.
+
+    Arguments:
+        max_cache_size [int] - maximal size of the cache in bytes
+        update_on_access [bool] - whether accessing a chunk marks it as recently used.
+            If False, the cache evicts chunks in first-in-first-out order (default: True)
+    """
+    def __init__(self, max_cache_size, update_on_access=True):
+        if max_cache_size < 0:
+            raise ValueError("Invalid cache size %i" % max_cache_size)
+        self._max_cache_size = max_cache_size
+        self._update_on_access = update_on_access
+        self._current_cache_size = 0
+        self._cache = OrderedDict()
+        self._lock = threading.RLock()
+        # futures of the values that are being loaded by get_or_load
+        self._loading = {}
+
+    @property
+    def max_cache_size(self):
+        return self._max_cache_size
+
+    @max_cache_size.setter
+    def max_cache_size(self, max_cache_size):
+        if max_cache_size < 0:
+            raise ValueError("Invalid cache size %i" % max_cache_size)
+        with self._lock:
+            self._max_cache_size = max_cache_size
+            self._evict()
+
+    @property
+    def current_cache_size(self):
+        return self._current_cache_size
+
+    def __len__(self):
+        return len(self._cache)
+
+    def __contains__(self, key):
+        return key in self._cache
+
+    def keys(self):
+        with self._lock:
+            return list(self._cache.keys())
+
+    def _evict(self):
+        while self._current_cache_size > self._max_cache_size and self._cache:
+            _, value = self._cache.popitem(last=False)
+            self._current_cache_size -= nbytes(value)
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._cache:
+                return default
+            if self._update_on_access:
+                self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def peek(self, key, default=None):
+        """ Return the cached value without marking it as recently used.
+        """
+        with self._lock:
+            return self._cache.get(key, default)
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        size = nbytes(value)
+        with self._lock:
+            self.invalidate(key)
+            # values that don't fit into the cache are not stored at all
+            if size > self._max_cache_size:
+                return
+            self._cache[key] = value
+            self._current_cache_size += size
+            self._evict()
+
+    def get_or_load(self, key, load):
+        """ Return the cached value for `key` or load, cache and return it.
+
+        Concurrent calls for the same key load the value only once, the other calls wait for it.
+        """
+        with self._lock:
+            value = self.get(key)
+            if value is not None:
+                return value
+            future = self._loading.get(key)
+            is_loader = future is None
+            if is_loader:
+                future = self._loading[key] = futures.Future()
+        if not is_loader:
+            return future.result()
+
+        try:
+            value = load()
+            self[key] = value
+            future.set_result(value)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+        return value
+
+    def invalidate(self, key):
+        """ Remove a single key from the cache.
+        """
+        with self._lock:
+            value = self._cache.pop(key, None)
+            if value is not None:
+                self._current_cache_size -= nbytes(value)
+
+    def invalidate_where(self, predicate):
+        """ Remove all keys for which `predicate(key)` is True.
+        """
+        with self._lock:
+            for key in [key for key in self._cache if predicate(key)]:
+                self.invalidate(key)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._current_cache_size = 0
@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import numpy as np
+
+from .blocking import blocks_in_bounding_box, n_blocks
+
+# the indices are cached per dataset, so that the directory is only listed once
+_indices = {}
+_lock = threading.Lock()
+
+
+def get_chunk_index(path, key):
+    """ Get the chunk index for a n5 or zarr dataset, it is built on the first call.
+    """
+    index_key = (os.path.abspath(path), key)
+    with _lock:
+        if index_key not in _indices:
+            _indices[index_key] = ChunkIndex(path, key)
+        return _indices[index_key]
+
+
+class ChunkIndex:
+    """ Index of the chunks of a n5 or zarr dataset that exist on disk.
+
+    Missing chunks contain only the fill value. The index is built by listing the dataset directory once,
+    call `refresh` to update it after chunks were written.
+
+    Arguments:
+        path [str] - path to the container
+        key [str] - name of the dataset in the container
+    """
+    def __init__(self, path, key):
+        self._ds_path = os.path.join(path, key)
+        self._chunk_ids = frozenset()
+        self.refresh()
+
+    def _read_metadata(self):
+        attributes = os.path.join(self._ds_path, 'attributes.json')
+        zarray = os.path.join(self._ds_path, '.zarray')
+        if os.path.exists(attributes):
+            with open(attributes) as f:
+                attrs = json.load(f)
+            # n5 stores the shape, chunks and chunk paths in reversed axis order
+            self._shape = tuple(attrs['dimensions'][::-1])
+            self._chunks = tuple(attrs['blockSize'][::-1])
+            self._fill_value = 0
+            self._is_n5 = True
+            self._separator = '/'
+        elif os.path.exists(zarray):
+            with open(zarray) as f:
+                attrs = json.load(f)
+            self._shape = tuple(attrs['shape'])
+            self._chunks = tuple(attrs['chunks'])
+            self._fill_value = 0 if attrs.get('fill_value') is None else attrs['fill_value']
+            self._is_n5 = False
+            self._separator = attrs.get('dimension_separator', '.')
+        else:
+            raise ValueError("Can only build a chunk index for n5 or zarr datasets, not %s" % self._ds_path)
+
+    def _parse_chunk_id(self, rel_path):
+        parts = rel_path.split(os.sep)
+        if self._separator == '.' and len(parts) == 1:
+            parts = parts[0].split('.')
+        if len(parts) != len(self._shape) or not all(part.isdigit() for part in parts):
+            return None
+        chunk_id = tuple(int(part) for part in parts)
+        return chunk_id[::-1] if self._is_n5 else chunk_id
+
+    def refresh(self):
+        """ Read the dataset metadata and list the dataset directory to find the existing chunks.
+        """
+        self._read_metadata()
+        chunk_ids = set()
+        for root, dirs, files in os.walk(self._ds_path):
+            for name in files:
+                chunk_id = self._parse_chunk_id(os.path.relpath(os.path.join(root, name), self._ds_path))
+                if chunk_id is not None:
+                    chunk_ids.add(chunk_id)
+        self._chunk_ids = frozenset(chunk_ids)
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def fill_value(self):
+        return self._fill_value
+
+    @property
+    def chunk_ids(self):
+        return self._chunk_ids
+
+    @property
+    def n_chunks(self):
+        """ Total number of chunks of the dataset, including the missing ones.
+        """
+        return int(np.prod(n_blocks(self._shape, self._chunks)))
+
+    def __len__(self):
+        return len(self._chunk_ids)
+
+    def exists(self, chunk_id):
+        return tuple(chunk_id) in self._chunk_ids
+
+    def _iter_existing_chunks(self, bb):
+        chunk_ids = self._chunk_ids
+        # for large bounding boxes it is cheaper to filter the existing chunks
+        if len(chunk_ids) < np.prod([(b.stop - b.start) / ch + 1 for b, ch in zip(bb, self._chunks)]):
+            starts = [b.start // ch for b, ch in zip(bb, self._chunks)]
+            stops = [(b.stop + ch - 1) // ch for b, ch in zip(bb, self._chunks)]
+            return (chunk_id for chunk_id in chunk_ids
+                    if all(sta <= cid < sto for cid, sta, sto in zip(chunk_id, starts, stops)))
+        return (chunk_id for chunk_id in blocks_in_bounding_box(bb, self._chunks) if chunk_id in chunk_ids)
+
+    def existing_chunks(self, bb):
+        """ Ids of the existing chunks that overlap with the bounding box.
+        """
+        return list(self._iter_existing_chunks(bb))
+
+    def mark_written(self, bb):
+        """ Mark the chunks overlapping with the bounding box as existing, call this after writing data.
+        """
+        written = set(blocks_in_bounding_box(bb, self._chunks))
+        with _lock:
+            self._chunk_ids = self._chunk_ids | written
+
+    def is_empty(self, bb):
+        """ Whether the bounding box only contains missing chunks.
+        """
+        return not any(True for _ in self._iter_existing_chunks(bb))
+
+    def fill(self, shape, dtype):
+        """ Read-only array of the given shape filled with the fill value, without allocating it.
+        """
+        return np.broadcast_to(np.array(self._fill_value, dtype=dtype), tuple(shape))
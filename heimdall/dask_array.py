@@ -0,0 +1,94 @@
+import numpy as np
+from elf.util import normalize_index, squeeze_singletons
+try:
+    import dask
+    import dask.array as da
+except ImportError:
+    dask, da = None, None
+
+from .blocking import block_bounding_box, blocks_in_bounding_box, read_blockwise
+from .cache import ChunkCache
+
+
+def is_dask_array(data):
+    return da is not None and isinstance(data, da.Array)
+
+
+class DaskDataset:
+    """ Array-like for a dask array that only computes the blocks covering a request.
+
+    The blocks of a request that are not cached yet are computed together in one call
+    to the dask threaded scheduler with at most `n_threads` workers, so that tasks shared
+    between the blocks are only computed once. The computed blocks are kept in a bounded
+    LRU cache. The cache can be shared between the levels of a pyramid by passing the same
+    `cache` with different `cache_key`s.
+
+    Arguments:
+        array [dask.array.Array] - the dask array
+        max_cache_size [int] - maximal size of the block cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used by the dask scheduler (default: 4)
+        chunks [tuple[int]] - shape of the computed blocks, by default the chunk size
+            of the dask array is used (default: None)
+        cache [heimdall.cache.ChunkCache] - cache for the blocks, by default a new cache
+            of size `max_cache_size` is created (default: None)
+        cache_key [hashable] - identifier of the array in a shared cache (default: None)
+    """
+    def __init__(self, array, max_cache_size=1024**3, n_threads=4, chunks=None,
+                 cache=None, cache_key=None):
+        if not is_dask_array(array):
+            raise ValueError("DaskDataset expects a dask array, not %s" % type(array))
+        self._array = array
+        self._shape = tuple(int(sh) for sh in array.shape)
+        self._dtype = np.dtype(array.dtype)
+        self._chunks = tuple(int(ch) for ch in array.chunksize) if chunks is None else tuple(chunks)
+        self._n_threads = n_threads
+        self._cache = ChunkCache(max_cache_size) if cache is None else cache
+        self._cache_key = cache_key
+
+    @property
+    def array(self):
+        return self._array
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _compute_blocks(self, block_ids):
+        block_bbs = [block_bounding_box(block_id, self.chunks, self.shape) for block_id in block_ids]
+        blocks = dask.compute(*[self._array[block_bb] for block_bb in block_bbs],
+                              scheduler='threads', num_workers=self._n_threads)
+        computed = {}
+        for block_id, block in zip(block_ids, blocks):
+            block = np.asarray(block)
+            self._cache[(self._cache_key, block_id)] = block
+            computed[block_id] = block
+        return computed
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        blocks = {block_id: self._cache.get((self._cache_key, block_id))
+                  for block_id in blocks_in_bounding_box(bb, self.chunks)}
+        missing = [block_id for block_id, block in blocks.items() if block is None]
+        if missing:
+            blocks.update(self._compute_blocks(missing))
+        out = read_blockwise(bb, self.shape, self.chunks, self.dtype, blocks.__getitem__)
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        raise NotImplementedError("Dask arrays are read-only")
@@ -0,0 +1,288 @@
+import threading
+from concurrent import futures
+import numpy as np
+from elf.util import normalize_index, squeeze_singletons
+
+from .blocking import block_bounding_box, blocks_in_bounding_box, infer_chunks, n_blocks
+
+# downsampling mode for the layer types
+default_modes = {'raw': 'mean', 'labels': 'mode'}
+modes = ('mean', 'mode', 'nearest')
+
+
+def downsample(data, factor, mode='mean'):
+    """ Downsample the data by an integer factor per axis.
+
+    The input is padded with its border values if the shape is not divisible by the factor.
+
+    Arguments:
+        data [np.ndarray] - the data to downsample
+        factor [tuple[int]] - downsampling factor per axis
+        mode [str] - the downsampling mode: 'mean' (for raw data),
+            'mode' (most frequent value, for labels) or 'nearest' (default: 'mean')
+    """
+    if mode not in modes:
+        raise ValueError("Invalid downsampling mode %s, expected one of %s" % (mode, str(modes)))
+    factor = tuple(int(f) for f in factor)
+    if all(f == 1 for f in factor):
+        return data
+    if mode == 'nearest':
+        return data[tuple(slice(None, None, f) for f in factor)]
+
+    pad_width = [(0, (-sh) % f) for sh, f in zip(data.shape, factor)]
+    if any(pw[1] > 0 for pw in pad_width):
+        data = np.pad(data, pad_width, mode='edge')
+    ndim = data.ndim
+    out_shape = tuple(sh // f for sh, f in zip(data.shape, factor))
+
+    # bring the data into shape (*out_shape, window_size)
+    windows = data.reshape(sum(((sh, f) for sh, f in zip(out_shape, factor)), ()))
+    windows = windows.transpose(list(range(0, 2 * ndim, 2)) + list(range(1, 2 * ndim, 2)))
+    windows = windows.reshape(out_shape + (-1,))
+
+    if mode == 'mean':
+        out = windows.mean(axis=-1)
+        if np.issubdtype(data.dtype, np.integer):
+            out = np.round(out)
+        return out.astype(data.dtype)
+
+    # sort the windows, so that equal values form runs, and select the value of the longest run;
+    # this is O(w log(w)) in the window size w, ties are resolved to the smallest value
+    windows = np.sort(windows, axis=-1)
+    positions = np.arange(windows.shape[-1])
+    run_starts = np.ones(windows.shape, dtype=bool)
+    run_starts[..., 1:] = windows[..., 1:] != windows[..., :-1]
+    run_lengths = positions - np.maximum.accumulate(np.where(run_starts, positions, 0), axis=-1) + 1
+    index = run_lengths.argmax(axis=-1)
+    return np.take_along_axis(windows, index[..., None], axis=-1)[..., 0]
+
+
+def _default_block_shape(ndim):
+    # blocks of about 64k output values, so that the windows of a block fit into the cpu caches
+    return (int(round(2 ** (16 / ndim))),) * ndim
+
+
+def downsample_blockwise(data, factor, mode='mean', block_shape=None, n_threads=1):
+    """ Downsample the data by an integer factor per axis, block by block.
+
+    The blocks are downsampled in parallel and written to the output, so that the extra memory
+    is bounded by the block size times the number of threads, in addition to the output.
+
+    Arguments:
+        data [array-like] - the data to downsample
+        factor [tuple[int]] - downsampling factor per axis
+        mode [str] - the downsampling mode, see `downsample` (default: 'mean')
+        block_shape [tuple[int]] - shape of the output blocks, by default blocks
+            of about 64k values are used (default: None)
+        n_threads [int] - number of threads (default: 1)
+    """
+    factor = tuple(int(f) for f in factor)
+    shape = tuple(data.shape)
+    out_shape = tuple((sh + f - 1) // f for sh, f in zip(shape, factor))
+    block_shape = _default_block_shape(len(shape)) if block_shape is None else tuple(block_shape)
+    out = np.empty(out_shape, dtype=data.dtype)
+
+    def _downsample_block(block_id):
+        out_bb = block_bounding_box(block_id, block_shape, out_shape)
+        in_bb = tuple(slice(b.start * f, min(b.stop * f, sh)) for b, f, sh in zip(out_bb, factor, shape))
+        out[out_bb] = downsample(np.asarray(data[in_bb]), factor, mode)
+
+    block_ids = list(np.ndindex(*n_blocks(out_shape, block_shape)))
+    with futures.ThreadPoolExecutor(n_threads) as tp:
+        list(tp.map(_downsample_block, block_ids))
+    return out
+
+
+class DownsampledDataset:
+    """ Array-like that downsamples the requested region of the data on the fly.
+
+    Gives the same values as `downsample_blockwise`, because the downsampling windows
+    are aligned with the output. Used to recompute pyramid levels whose in-memory copy was released.
+
+    Arguments:
+        data [array-like] - the data to downsample
+        factor [tuple[int]] - downsampling factor per axis
+        mode [str] - the downsampling mode, see `downsample` (default: 'mean')
+    """
+    def __init__(self, data, factor, mode='mean'):
+        self._data = data
+        self._factor = tuple(int(f) for f in factor)
+        self._mode = mode
+        self._shape = tuple((sh + f - 1) // f for sh, f in zip(data.shape, self._factor))
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        in_bb = tuple(slice(b.start * f, min(b.stop * f, sh))
+                      for b, f, sh in zip(bb, self._factor, self._data.shape))
+        out = downsample(np.asarray(self._data[in_bb]), self._factor, self._mode)
+        return squeeze_singletons(out, to_squeeze)
+
+
+def build_pyramid(data, mode='mean', n_scales=None, factor=2, min_shape=64,
+                  block_shape=None, n_threads=1):
+    """ Build an in-memory pyramid by downsampling the data repeatedly.
+
+    Each level is computed from the previous one with `downsample_blockwise`.
+    Axes that are not larger than `min_shape` are not downsampled further.
+
+    Returns the list of levels, starting with the data, and the scale factors of the levels.
+
+    Arguments:
+        data [np.ndarray] - the data
+        mode [str] - the downsampling mode, see `downsample` (default: 'mean')
+        n_scales [int] - maximal number of levels, by default levels are added
+            until all axes are not larger than `min_shape` (default: None)
+        factor [int] - downsampling factor between levels (default: 2)
+        min_shape [int] - axes up to this size are not downsampled (default: 64)
+        block_shape [tuple[int]] - shape of the blocks for downsampling (default: None)
+        n_threads [int] - number of threads (default: 1)
+    """
+    levels = [data]
+    scales = [(1,) * data.ndim]
+    while n_scales is None or len(levels) < n_scales:
+        level_factor = tuple(factor if sh > min_shape else 1 for sh in levels[-1].shape)
+        if all(f == 1 for f in level_factor):
+            break
+        levels.append(downsample_blockwise(levels[-1], level_factor, mode, block_shape, n_threads))
+        scales.append(tuple(sc * f for sc, f in zip(scales[-1], level_factor)))
+    return levels, scales
+
+
+class PyramidUpdater:
+    """ Update the coarser levels of a pyramid after level 0 has been edited.
+
+    Only the blocks at the coarser levels that overlap with the edited regions are recomputed,
+    level by level from the next finer level. Edited regions are collected with `mark_dirty`
+    and the update is computed in a background thread every `interval` seconds, so that many
+    small edits are batched together. The pyramid must be opened in a writable mode.
+
+    Cached blocks of the updated levels are invalidated and the in-memory copy of the coarsest
+    level is updated. `on_update` is called after each update, in the background thread.
+
+    To keep the pyramid consistent while painting, combine it with a `WriteBackWrapper`
+    and refresh the layer in the gui thread:
+    ```
+    updater = PyramidUpdater(pyramid_source, on_update=gui_thread_refresh(layer))
+    labels = WriteBackWrapper(BigDataSource(pyramid_source.get_level(0)),
+                              on_flush=updater.mark_dirty)
+    ```
+
+    Arguments:
+        source [heimdall.PyramidSource] - the pyramid source
+        mode [str] - the downsampling mode, by default 'mean' for raw data
+            and 'mode' for labels (default: None)
+        n_threads [int] - number of threads used to compute the blocks of a level (default: 4)
+        interval [float] - interval for updating in a background thread in seconds.
+            If None, the pyramid is only updated when calling `update` (default: 1.)
+        on_update [callable] - called without arguments after the pyramid was updated (default: None)
+    """
+    def __init__(self, source, mode=None, n_threads=4, interval=1., on_update=None):
+        self._source = source
+        self.on_update = on_update
+        self._mode = default_modes[source.layer_type] if mode is None else mode
+        if self._mode not in modes:
+            raise ValueError("Invalid downsampling mode %s" % self._mode)
+        self._n_threads = n_threads
+
+        self._lock = threading.Lock()
+        self._dirty = []
+
+        self._stop = threading.Event()
+        self._thread = None
+        if interval is not None:
+            self._thread = threading.Thread(target=self._update_periodically, args=(interval,),
+                                            daemon=True)
+            self._thread.start()
+
+    @property
+    def source(self):
+        return self._source
+
+    def mark_dirty(self, bounding_boxes):
+        """ Mark regions of level 0 as edited.
+
+        Arguments:
+            bounding_boxes [list[tuple[slice]]] - the edited bounding boxes
+        """
+        with self._lock:
+            self._dirty.extend(bounding_boxes)
+
+    def _update_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.update()
+
+    def _map_to_level(self, bb, level):
+        metadata = self.source.metadata
+        scale, shape = metadata.level_scales[level], metadata.level_shapes[level]
+        return tuple(slice(b.start // sc, min((b.stop + sc - 1) // sc, sh))
+                     for b, sc, sh in zip(bb, scale, shape))
+
+    def _update_block(self, level, block_bb):
+        metadata = self.source.metadata
+        factor = tuple(sl // sp for sl, sp in zip(metadata.level_scales[level],
+                                                  metadata.level_scales[level - 1]))
+        prev_ds = self.source.get_level(level - 1)
+        prev_bb = tuple(slice(b.start * f, min(b.stop * f, sh))
+                        for b, f, sh in zip(block_bb, factor, metadata.level_shapes[level - 1]))
+        data = downsample(np.asarray(prev_ds[prev_bb]), factor, self._mode)
+
+        # the shape of the level may not match the downsampled shape at the border
+        block_shape = tuple(b.stop - b.start for b in block_bb)
+        data = data[tuple(slice(0, bsh) for bsh in block_shape)]
+        pad_width = [(0, bsh - sh) for bsh, sh in zip(block_shape, data.shape)]
+        if any(pw[1] > 0 for pw in pad_width):
+            data = np.pad(data, pad_width, mode='edge')
+        self.source.get_level(level)[block_bb] = data
+        if level == self.source.n_scales - 1:
+            self.source.update_in_memory_level(level, block_bb, data)
+
+    def _invalidate(self, level, bbs):
+        # cache wrappers created by the wrapper factory of the source
+        ds = self.source.get_level(level)
+        if hasattr(ds, 'invalidate_bounding_box'):
+            for bb in bbs:
+                ds.invalidate_bounding_box(bb)
+
+    def update(self):
+        """ Recompute the blocks of the coarser levels that overlap with the edited regions.
+        """
+        with self._lock:
+            dirty, self._dirty = self._dirty, []
+        if not dirty:
+            return
+
+        # level 0 may have been edited without going through its cache
+        self._invalidate(0, dirty)
+        metadata = self.source.metadata
+        with futures.ThreadPoolExecutor(self._n_threads) as tp:
+            for level in range(1, metadata.n_scales):
+                shape = metadata.level_shapes[level]
+                chunks = infer_chunks(self.source.get_level(level))
+                block_ids = set(block_id for bb in dirty
+                                for block_id in blocks_in_bounding_box(self._map_to_level(bb, level), chunks))
+                block_bbs = [block_bounding_box(block_id, chunks, shape) for block_id in block_ids]
+                list(tp.map(lambda block_bb: self._update_block(level, block_bb), block_bbs))
+                self._invalidate(level, block_bbs)
+        if self.on_update is not None:
+            self.on_update()
+
+    def close(self):
+        """ Stop the background thread and apply the remaining updates.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.update()
@@ -0,0 +1,155 @@
+import os
+from concurrent import futures
+
+import numpy as np
+
+from .frames import imageio, tifffile, write_frame, read_and_write_frame
+from .overview import read_strided
+from .process_pool import get_process_pool, ProcessPoolDataset
+from .sources import Source, BigDataSource, NumpySource, PyramidSource
+from .source_wrappers import SourceWrapper
+
+file_formats = ('png', 'tif')
+
+
+def get_levels(source):
+    """ Get the resolution levels of a source and their scale factors w.r.t. level 0.
+    """
+    if isinstance(source, PyramidSource):
+        return [(source.get_level(level), tuple(scale)) for level, scale in enumerate(source.scales)]
+    elif isinstance(source, NumpySource) and source.is_pyramid:
+        return list(zip(source.get_pyramid(), source.scales))
+    return [(source, (1,) * source.ndim)]
+
+
+def dataset_location(data):
+    """ Path of the file and name of the dataset, so that the dataset can be opened in another process.
+
+    Supports hdf5 datasets, zarr arrays in a directory store and `ProcessPoolDataset`s,
+    also as data of a `BigDataSource`. Returns None for all other data.
+    """
+    if isinstance(data, BigDataSource):
+        data = data.data
+    if isinstance(data, ProcessPoolDataset):
+        return data.path, data.key
+    # hdf5 datasets
+    filename = getattr(getattr(data, 'file', None), 'filename', None)
+    if isinstance(filename, str) and isinstance(getattr(data, 'name', None), str):
+        return filename, data.name
+    # zarr arrays
+    store_path = getattr(getattr(data, 'store', None), 'path', None)
+    if isinstance(store_path, str) and isinstance(getattr(data, 'path', None), str):
+        return store_path, data.path
+    return None
+
+
+def select_level(scales, axes, downscale):
+    """ Select the coarsest level that has at least the target resolution along the given axes.
+
+    Arguments:
+        scales [list[tuple[int]]] - the scale factors of the levels
+        axes [tuple[int]] - the axes that need the target resolution
+        downscale [float] - the target downscaling factor w.r.t. level 0
+    """
+    level = 0
+    for ii, scale in enumerate(scales):
+        if all(scale[axis] <= downscale for axis in axes):
+            level = ii
+    return level
+
+
+def export_frames(source, output_folder, axis=0, positions=None, roi_start=None, roi_stop=None,
+                  max_size=None, contrast_limits=None, file_format='png', n_processes=4, prefix='frame'):
+    """ Export 2d frames of a 3d source without the viewer, e.g. sections or a fly-through of a roi.
+
+    The frames are read from the coarsest pyramid level that has the output resolution,
+    and rendered and written in a process pool. If the level is a dataset in a file, see `dataset_location`,
+    the frames are also read in the process pool, otherwise they are read in the current process.
+    Frames are read and written in a streaming fashion, at most two frames per process are held in memory.
+
+    Returns the paths of the written frames.
+
+    Arguments:
+        source [heimdall.Source or heimdall.SourceWrapper] - the source
+        output_folder [str] - folder for the frames, they are named `<prefix>_<index>.<file_format>`
+        axis [int] - the axis along which frames are exported (default: 0)
+        positions [list[int]] - positions of the frames along `axis` in level 0 coordinates,
+            by default all positions in the roi are exported (default: None)
+        roi_start [tuple[int]] - start of the exported region (default: None)
+        roi_stop [tuple[int]] - stop of the exported region (default: None)
+        max_size [int] - maximal size of the frames along each axis in pixels,
+            by default the frames are exported at full resolution (default: None)
+        contrast_limits [tuple[float]] - contrast limits for raw data,
+            by default the min and max value of the source are used (default: None)
+        file_format [str] - 'png' or 'tif' (default: 'png')
+        n_processes [int] - number of processes for rendering and writing the frames (default: 4)
+        prefix [str] - prefix of the frame file names (default: 'frame')
+    """
+    if not isinstance(source, (Source, SourceWrapper)):
+        raise ValueError("Can only export a heimdall.Source or source wrapper, not %s" % type(source))
+    if file_format not in file_formats:
+        raise ValueError("Invalid file format %s, expected one of %s" % (file_format, str(file_formats)))
+    if (file_format == 'png' and imageio is None) or (file_format == 'tif' and tifffile is None):
+        raise RuntimeError("Need %s to export %s files" % ('imageio' if file_format == 'png' else 'tifffile',
+                                                          file_format))
+    if source.channel_axis is not None:
+        raise NotImplementedError("Exporting sources with channels is not supported")
+    shape = tuple(source.shape)
+    if len(shape) != 3:
+        raise ValueError("Can only export frames of 3d sources, got shape %s" % str(shape))
+
+    roi_start = (0,) * 3 if roi_start is None else tuple(roi_start)
+    roi_stop = shape if roi_stop is None else tuple(roi_stop)
+    if not all(0 <= sta < sto <= sh for sta, sto, sh in zip(roi_start, roi_stop, shape)):
+        raise ValueError("Invalid roi %s, %s for shape %s" % (str(roi_start), str(roi_stop), str(shape)))
+    positions = range(roi_start[axis], roi_stop[axis]) if positions is None else positions
+
+    # select the level and the shape of the output frames
+    in_plane = tuple(ax for ax in range(3) if ax != axis)
+    extent = [roi_stop[ax] - roi_start[ax] for ax in in_plane]
+    downscale = 1. if max_size is None else max(1., max(extent) / max_size)
+    frame_shape = tuple(int(np.ceil(ext / downscale)) for ext in extent)
+    levels = get_levels(source)
+    data, scale = levels[select_level([scale for _, scale in levels], in_plane, downscale)]
+
+    is_labels = source.layer_type == 'labels'
+    if contrast_limits is None and not is_labels:
+        min_val, max_val = getattr(source, 'min_val', None), getattr(source, 'max_val', None)
+        if min_val is None or max_val is None or isinstance(source, NumpySource):
+            # estimate the limits from a strided sample, so that large datasets are not read completely
+            sample = read_strided(levels[-1][0])
+            min_val, max_val = sample.min(), sample.max()
+        contrast_limits = (min_val, max_val)
+
+    def frame_bounding_box(position):
+        return tuple(slice(position // sc, position // sc + 1) if ax == axis else
+                     slice(sta // sc, max(sta // sc + 1, (sto + sc - 1) // sc))
+                     for ax, (sta, sto, sc) in enumerate(zip(roi_start, roi_stop, scale)))
+
+    # the workers read the frames themselves if they can open the data
+    location = dataset_location(data)
+
+    os.makedirs(output_folder, exist_ok=True)
+    pool = get_process_pool(n_processes)
+    paths, pending = [], set()
+    for ii, position in enumerate(positions):
+        if not roi_start[axis] <= position < roi_stop[axis]:
+            raise ValueError("Position %i is outside of the roi" % position)
+        # bound the number of frames in memory
+        if len(pending) >= 2 * n_processes:
+            done, pending = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        path = os.path.join(output_folder, '%s_%05i.%s' % (prefix, ii, file_format))
+        bb = frame_bounding_box(position)
+        if location is None:
+            job = pool.submit(write_frame, np.asarray(data[bb]).squeeze(axis), path, file_format,
+                              frame_shape, contrast_limits, is_labels)
+        else:
+            job = pool.submit(read_and_write_frame, location, bb, axis, path, file_format,
+                              frame_shape, contrast_limits, is_labels)
+        pending.add(job)
+        paths.append(path)
+    for future in futures.as_completed(pending):
+        future.result()
+    return paths
@@ -0,0 +1,72 @@
+import numpy as np
+try:
+    import imageio
+except ImportError:
+    imageio = None
+try:
+    import tifffile
+except ImportError:
+    tifffile = None
+
+from .process_pool import open_dataset
+
+# the frames are read, rendered and written in the worker processes of heimdall.export,
+# so this module only imports what is needed for that
+
+
+def _resize_nearest(frame, shape):
+    if tuple(frame.shape) == tuple(shape):
+        return frame
+    index = np.ix_(*[(np.arange(sh) * fsh // sh) for sh, fsh in zip(shape, frame.shape)])
+    return frame[index]
+
+
+def _apply_contrast(frame, contrast_limits):
+    min_val, max_val = contrast_limits
+    frame = (frame.astype('float32') - min_val) / max(float(max_val) - float(min_val), 1e-12)
+    return (np.clip(np.nan_to_num(frame), 0, 1) * 255).round().astype('uint8')
+
+
+def _label_colors(frame):
+    # pseudo-random color per label id that is the same for all frames, background is black
+    ids = frame.astype('uint64')
+    colors = np.stack([((ids * prime) >> shift) % 256
+                       for prime, shift in ((2654435761, 8), (2246822519, 12), (3266489917, 16))],
+                      axis=-1).astype('uint8')
+    colors[ids == 0] = 0
+    return colors
+
+
+def write_frame(frame, path, file_format, shape, contrast_limits=None, is_labels=False):
+    """ Render a frame and write it to file.
+
+    Raw data is mapped to uint8 using the contrast limits. Labels are written as ids to tif
+    and as random colors to png.
+    """
+    frame = _resize_nearest(np.asarray(frame), shape)
+    if is_labels:
+        frame = _label_colors(frame) if file_format == 'png' else frame
+    else:
+        frame = _apply_contrast(frame, contrast_limits)
+    if file_format == 'png':
+        imageio.imwrite(path, frame)
+    else:
+        tifffile.imwrite(path, frame)
+    return path
+
+
+def read_and_write_frame(location, bb, axis, path, file_format, shape, contrast_limits=None, is_labels=False):
+    """ Read a frame from a dataset in a file, render it and write it to file.
+
+    Arguments:
+        location [tuple[str]] - path of the file and name of the dataset
+        bb [tuple[slice]] - bounding box of the frame, with a singleton at `axis`
+        axis [int] - the axis along which the frame is taken
+        path [str] - path of the output file
+        file_format [str] - 'png' or 'tif'
+        shape [tuple[int]] - shape of the output frame
+        contrast_limits [tuple[float]] - contrast limits for raw data (default: None)
+        is_labels [bool] - whether the frame contains label ids (default: False)
+    """
+    frame = np.asarray(open_dataset(*location)[bb]).squeeze(axis)
+    return write_frame(frame, path, file_format, shape, contrast_limits, is_labels)
@@ -0,0 +1,158 @@
+import threading
+from concurrent import futures
+import numpy as np
+from elf.util import normalize_index, squeeze_singletons
+
+from .blocking import block_bounding_box, blocks_in_bounding_box, infer_chunks, read_blockwise
+from .cache import ChunkCache
+
+# number of threads for fetching cubes, if not specified otherwise
+default_n_threads = 8
+
+
+class KnossosCubeDataset:
+    """ Array-like for a knossos dataset that fetches the cubes of a request in parallel.
+
+    The cubes overlapping with a request are loaded and decoded concurrently on a thread pool
+    and kept in a bounded LRU cache. After each request, the neighbouring cubes are prefetched
+    in the background, so that navigating to adjacent regions does not wait for the file system.
+    Prefetching uses a separate, smaller thread pool, so that it does not delay requested cubes.
+    Prefetches that have not started yet are cancelled when they are no longer in the neighbourhood
+    of the last request, or moved to the main pool when their cube is requested.
+    The cache can be shared between the levels of a pyramid by passing the same `cache`
+    with different `cache_key`s.
+
+    Arguments:
+        dataset [elf.io.knossos_wrapper.KnossosDataset] - the knossos dataset
+        max_cache_size [int] - maximal size of the cube cache in bytes (default: 512MB)
+        n_threads [int] - number of threads for fetching cubes (default: 8)
+        prefetch [int] - number of neighbouring cubes along each axis that are prefetched.
+            Set to 0 to disable prefetching (default: 1)
+        cache [heimdall.cache.ChunkCache] - cache for the cubes, by default a new cache
+            of size `max_cache_size` is created (default: None)
+        cache_key [hashable] - identifier of the dataset in a shared cache (default: None)
+    """
+    def __init__(self, dataset, max_cache_size=512 * 1024**2, n_threads=default_n_threads,
+                 prefetch=1, cache=None, cache_key=None):
+        self._dataset = dataset
+        self._chunks = infer_chunks(dataset)
+        self._shape = tuple(dataset.shape)
+        self._dtype = np.dtype(dataset.dtype)
+        self._prefetch = prefetch
+        self._cache = ChunkCache(max_cache_size) if cache is None else cache
+        self._cache_key = cache_key
+
+        # elf's knossos dataset can load single cubes, which skips the index normalization
+        # and returns None for missing cubes
+        self._load_block = getattr(dataset, 'load_block', None)
+
+        self._pool = futures.ThreadPoolExecutor(n_threads)
+        self._prefetch_pool = futures.ThreadPoolExecutor(max(1, n_threads // 2))
+        self._lock = threading.Lock()
+        self._pending = {}
+        # the pending cubes that are loaded by the prefetch pool
+        self._prefetching = set()
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _load_cube(self, block_id):
+        # the cube is removed from the pending cubes also if loading fails, so that it is retried
+        try:
+            block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+            if self._load_block is None:
+                cube = np.asarray(self._dataset[block_bb])
+            else:
+                cube = self._load_block(block_id)
+                if cube is None:
+                    cube = np.zeros(self.chunks, dtype=self.dtype)
+                # cubes at the border of the dataset are cropped to its shape
+                cube = cube[tuple(slice(0, b.stop - b.start) for b in block_bb)]
+            self._cache[(self._cache_key, block_id)] = cube
+        finally:
+            with self._lock:
+                self._pending.pop(block_id, None)
+                self._prefetching.discard(block_id)
+        return cube
+
+    def _request(self, block_id, prefetch=False):
+        # returns the cube if it is cached, otherwise the future that loads it
+        cube = self._cache.get((self._cache_key, block_id))
+        if cube is not None:
+            return cube
+        with self._lock:
+            future = self._pending.get(block_id)
+            # a requested cube that is queued for prefetching is loaded by the main pool instead
+            if future is not None and not prefetch and block_id in self._prefetching and future.cancel():
+                future = None
+            if future is None:
+                pool = self._prefetch_pool if prefetch else self._pool
+                future = pool.submit(self._load_cube, block_id)
+                self._pending[block_id] = future
+                if prefetch:
+                    self._prefetching.add(block_id)
+                else:
+                    self._prefetching.discard(block_id)
+            return future
+
+    def _cancel_prefetches(self, keep):
+        with self._lock:
+            for block_id in list(self._prefetching):
+                if block_id not in keep and self._pending[block_id].cancel():
+                    del self._pending[block_id]
+                    self._prefetching.discard(block_id)
+
+    def _prefetch_neighbours(self, bb):
+        halo = tuple(self._prefetch * ch for ch in self.chunks)
+        prefetch_bb = tuple(slice(max(b.start - ha, 0), min(b.stop + ha, sh))
+                            for b, ha, sh in zip(bb, halo, self.shape))
+        requested = set(blocks_in_bounding_box(bb, self.chunks))
+        neighbours = [block_id for block_id in blocks_in_bounding_box(prefetch_bb, self.chunks)
+                      if block_id not in requested]
+        self._cancel_prefetches(set(neighbours))
+        for block_id in neighbours:
+            if (self._cache_key, block_id) not in self._cache:
+                self._request(block_id, prefetch=True)
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        # schedule all cubes before waiting for any of them
+        cubes = {block_id: self._request(block_id) for block_id in blocks_in_bounding_box(bb, self.chunks)}
+
+        def read_block(block_id):
+            cube = cubes[block_id]
+            return cube.result() if isinstance(cube, futures.Future) else cube
+
+        out = read_blockwise(bb, self.shape, self.chunks, self.dtype, read_block)
+        if self._prefetch > 0:
+            self._prefetch_neighbours(bb)
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        raise NotImplementedError("Knossos datasets are read-only")
+
+    def close(self):
+        self._cancel_prefetches(set())
+        self._prefetch_pool.shutdown(wait=False)
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,193 @@
+import os
+from concurrent import futures
+import numpy as np
+import elf.io
+
+from .blocking import block_bounding_box, infer_chunks, n_blocks
+from .chunk_index import get_chunk_index
+
+
+def default_index_path(path, key):
+    """ Default path of the label index for the dataset `key` in the file at `path`.
+    """
+    return '%s.%s.label-index.npz' % (path.rstrip(os.sep), key.strip('/').replace('/', '-'))
+
+
+def get_label_index(path, key, n_threads=1, ignore_label=0):
+    """ Load the label index for a dataset or build it and save it next to the dataset.
+    """
+    index_path = default_index_path(path, key)
+    if os.path.exists(index_path):
+        return LabelIndex.load(index_path)
+    # for n5 and zarr we can skip the missing chunks
+    chunk_index = get_chunk_index(path, key) if os.path.isdir(os.path.join(path, key)) else None
+    with elf.io.open_file(path, mode='r') as f:
+        label_index = LabelIndex.build(f[key], n_threads=n_threads, ignore_label=ignore_label,
+                                       chunk_index=chunk_index)
+    label_index.save(index_path)
+    return label_index
+
+
+def _index_block(data, block_id, chunks, shape, ignore_label):
+    block_bb = block_bounding_box(block_id, chunks, shape)
+    block = np.asarray(data[block_bb])
+    ids, inverse = np.unique(block, return_inverse=True)
+    inverse = inverse.ravel()
+
+    # compute the bounding boxes of all ids in the block at once
+    coords = np.unravel_index(np.arange(block.size), block.shape)
+    starts = np.zeros((len(ids), block.ndim), dtype='int64')
+    stops = np.zeros((len(ids), block.ndim), dtype='int64')
+    for axis, (coord, bb) in enumerate(zip(coords, block_bb)):
+        axis_start = np.full(len(ids), block.shape[axis], dtype='int64')
+        axis_stop = np.zeros(len(ids), dtype='int64')
+        np.minimum.at(axis_start, inverse, coord)
+        np.maximum.at(axis_stop, inverse, coord)
+        starts[:, axis] = axis_start + bb.start
+        stops[:, axis] = axis_stop + bb.start + 1
+
+    if ignore_label is not None:
+        keep = ids != ignore_label
+        ids, starts, stops = ids[keep], starts[keep], stops[keep]
+    return block_id, ids, starts, stops
+
+
+class LabelIndex:
+    """ Index that maps label ids to their bounding box and the chunks they occupy.
+
+    Use `LabelIndex.build` to compute the index for a label source and `save` / `load`
+    to persist it, e.g. next to the dataset with `default_index_path`.
+
+    Arguments:
+        ids [np.ndarray] - the label ids, sorted
+        bb_starts [np.ndarray] - start coordinates of the bounding boxes
+        bb_stops [np.ndarray] - stop coordinates of the bounding boxes
+        offsets [np.ndarray] - offsets of the block ids for each label in `block_ids`
+        block_ids [np.ndarray] - the block ids occupied by the labels
+        chunks [tuple[int]] - the block shape of the index
+        shape [tuple[int]] - the shape of the indexed data
+    """
+    def __init__(self, ids, bb_starts, bb_stops, offsets, block_ids, chunks, shape):
+        self._ids = ids
+        self._bb_starts = bb_starts
+        self._bb_stops = bb_stops
+        self._offsets = offsets
+        self._block_ids = block_ids
+        self._chunks = tuple(int(ch) for ch in chunks)
+        self._shape = tuple(int(sh) for sh in shape)
+
+    @classmethod
+    def build(cls, data, chunks=None, n_threads=1, ignore_label=0, chunk_index=None):
+        """ Build the index blockwise and in parallel.
+
+        Arguments:
+            data [array-like] - the label data, e.g. a source or dataset
+            chunks [tuple[int]] - block shape of the index, by default the chunks of the data are used
+                (default: None)
+            n_threads [int] - number of threads (default: 1)
+            ignore_label [int] - label id that is not indexed, e.g. background.
+                Pass None to index all ids (default: 0)
+            chunk_index [heimdall.chunk_index.ChunkIndex] - index of the existing chunks, blocks without
+                chunks are skipped if the fill value is the ignore label.
+                By default the chunk index of the source is used (default: None)
+        """
+        # use the chunks of the underlying dataset for sources
+        chunks = infer_chunks(getattr(data, 'data', data)) if chunks is None else tuple(chunks)
+        shape = tuple(data.shape)
+        block_ids = list(np.ndindex(*n_blocks(shape, chunks)))
+        chunk_index = getattr(data, 'chunk_index', None) if chunk_index is None else chunk_index
+        if chunk_index is not None and chunk_index.fill_value == ignore_label:
+            block_ids = [block_id for block_id in block_ids
+                         if not chunk_index.is_empty(block_bounding_box(block_id, chunks, shape))]
+
+        with futures.ThreadPoolExecutor(n_threads) as tp:
+            results = list(tp.map(lambda block_id: _index_block(data, block_id, chunks, shape, ignore_label),
+                                  block_ids))
+        return cls.from_block_results(results, chunks, shape)
+
+    @classmethod
+    def from_block_results(cls, results, chunks, shape):
+        """ Merge the per-block ids and bounding boxes into an index.
+        """
+        ndim = len(shape)
+        results = [res for res in results if len(res[1]) > 0]
+        if not results:
+            empty = np.zeros((0, ndim), dtype='int64')
+            return cls(np.zeros(0, dtype='uint64'), empty, empty,
+                       np.zeros(1, dtype='int64'), empty, chunks, shape)
+
+        block_ids = np.concatenate([np.array([res[0]] * len(res[1]), dtype='int64').reshape(-1, ndim)
+                                    for res in results])
+        label_ids = np.concatenate([res[1] for res in results])
+        starts = np.concatenate([res[2] for res in results])
+        stops = np.concatenate([res[3] for res in results])
+
+        # group by label id
+        order = np.argsort(label_ids, kind='stable')
+        label_ids, block_ids = label_ids[order], block_ids[order]
+        starts, stops = starts[order], stops[order]
+        ids, first, counts = np.unique(label_ids, return_index=True, return_counts=True)
+        bb_starts = np.minimum.reduceat(starts, first, axis=0)
+        bb_stops = np.maximum.reduceat(stops, first, axis=0)
+        offsets = np.concatenate([[0], np.cumsum(counts)]).astype('int64')
+        return cls(ids, bb_starts, bb_stops, offsets, block_ids, chunks, shape)
+
+    def save(self, path):
+        np.savez(path, ids=self._ids, bb_starts=self._bb_starts, bb_stops=self._bb_stops,
+                 offsets=self._offsets, block_ids=self._block_ids,
+                 chunks=np.array(self._chunks), shape=np.array(self._shape))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls(f['ids'], f['bb_starts'], f['bb_stops'], f['offsets'], f['block_ids'],
+                       tuple(f['chunks']), tuple(f['shape']))
+
+    @property
+    def ids(self):
+        return self._ids
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def shape(self):
+        return self._shape
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, label_id):
+        pos = np.searchsorted(self._ids, label_id)
+        return pos < len(self._ids) and self._ids[pos] == label_id
+
+    def _position(self, label_id):
+        if label_id not in self:
+            raise KeyError("Label id %i is not in the index" % label_id)
+        return np.searchsorted(self._ids, label_id)
+
+    def get_bounding_box(self, label_id):
+        """ Bounding box of the label as tuple of slices.
+        """
+        pos = self._position(label_id)
+        return tuple(slice(int(start), int(stop))
+                     for start, stop in zip(self._bb_starts[pos], self._bb_stops[pos]))
+
+    def get_center(self, label_id):
+        """ Center of the bounding box of the label.
+        """
+        return tuple((bb.start + bb.stop) // 2 for bb in self.get_bounding_box(label_id))
+
+    def get_block_ids(self, label_id):
+        """ Ids of the blocks that contain the label.
+        """
+        pos = self._position(label_id)
+        return [tuple(int(bid) for bid in block_id)
+                for block_id in self._block_ids[self._offsets[pos]:self._offsets[pos + 1]]]
+
+    def get_blocks(self, label_ids):
+        """ Union of the block ids of all given labels.
+        """
+        return set(block_id for label_id in label_ids if label_id in self
+                   for block_id in self.get_block_ids(label_id))
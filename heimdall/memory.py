@@ -0,0 +1,294 @@
+import threading
+import numpy as np
+
+from .cache import ChunkCache
+from .dask_array import DaskDataset
+from .knossos import KnossosCubeDataset
+from .sources import NumpySource, ProgressivePyramidSource, PyramidSource
+
+
+def read_meminfo(path='/proc/meminfo'):
+    """ Read the total and available system memory in bytes.
+
+    Returns None if the information is not available, e.g. on systems without /proc.
+    """
+    try:
+        with open(path) as f:
+            info = {line.split(':')[0]: line.split(':')[1].split() for line in f if ':' in line}
+        total, available = info['MemTotal'], info['MemAvailable']
+    except (OSError, KeyError, IndexError):
+        return None
+    # the values are given in kB
+    return int(total[0]) * 1024, int(available[0]) * 1024
+
+
+class InMemoryDataset:
+    """ Array-like that holds a dataset in memory and can fall back to reading from the dataset.
+
+    Used for `load_into_memory` and the in-memory pyramid levels, so that the memory governor
+    can release the in-memory copy. Edits are only applied to the in-memory copy;
+    an edited copy is not released.
+
+    Arguments:
+        dataset [array-like] - the dataset
+        data [np.ndarray] - the in-memory copy, if it was already loaded (default: None)
+    """
+    def __init__(self, dataset, data=None):
+        self._dataset = dataset
+        self._data = data
+        self._edited = False
+        self._lock = threading.Lock()
+        self.load()
+
+    @property
+    def dataset(self):
+        return self._dataset
+
+    @property
+    def shape(self):
+        return self._dataset.shape
+
+    @property
+    def ndim(self):
+        return self._dataset.ndim
+
+    @property
+    def dtype(self):
+        return self._dataset.dtype
+
+    @property
+    def chunks(self):
+        return getattr(self._dataset, 'chunks', None)
+
+    @property
+    def is_loaded(self):
+        return self._data is not None
+
+    @property
+    def nbytes(self):
+        data = self._data
+        return 0 if data is None else data.nbytes
+
+    def load(self):
+        with self._lock:
+            if self._data is None:
+                self._data = np.asarray(self._dataset[:])
+
+    def release(self):
+        """ Release the in-memory copy, returns whether it was released.
+        """
+        with self._lock:
+            if self._edited:
+                return False
+            self._data = None
+            return True
+
+    def __array__(self, dtype=None, copy=None):
+        # napari converts the coarsest pyramid level with np.asarray
+        out = np.asarray(self[:])
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def __getitem__(self, key):
+        data = self._data
+        return self._dataset[key] if data is None else data[key]
+
+    def update(self, key, item):
+        """ Write to the in-memory copy if it is loaded, for data that was also written to the dataset.
+
+        Unlike edits via `__setitem__`, this does not prevent releasing the copy.
+        """
+        with self._lock:
+            if self._data is not None:
+                self._data[key] = item
+
+    def __setitem__(self, key, item):
+        self.load()
+        with self._lock:
+            self._data[key] = item
+            self._edited = True
+
+
+class MemoryGovernor:
+    """ Adapt the memory used by heimdall to the available system memory.
+
+    Tracks the registered caches, in-memory datasets and in-memory pyramid levels and checks the available system memory
+    in /proc/meminfo. If it drops below `min_available`, memory is freed in this order:
+    the cached blocks of the finest pyramid levels are evicted, the cache budgets are shrunk
+    and in-memory copies are released, so that the data is read from disk again.
+    If the available memory rises above `target_available`, the cache budgets grow back
+    to their initial size.
+
+    Arguments:
+        min_available [float] - fraction of the total memory below which memory is freed (default: 0.1)
+        target_available [float] - fraction of the total memory above which caches grow again (default: 0.25)
+        shrink_factor [float] - factor by which the cache budgets are shrunk in each step (default: 0.5)
+        min_cache_size [int] - minimal budget of each cache in bytes (default: 16MB)
+        interval [float] - time between checks in seconds, when running in a thread via `start` (default: 2.)
+    """
+    def __init__(self, min_available=0.1, target_available=0.25, shrink_factor=0.5,
+                 min_cache_size=16 * 1024**2, interval=2.):
+        if not 0 <= min_available < target_available <= 1:
+            raise ValueError("Invalid memory fractions %f, %f" % (min_available, target_available))
+        self._min_available = min_available
+        self._target_available = target_available
+        self._shrink_factor = shrink_factor
+        self._min_cache_size = min_cache_size
+        self._interval = interval
+
+        self._lock = threading.Lock()
+        # the registered caches with their initial budget and function to get the level of a key
+        self._caches = []
+        self._in_memory = []
+        # sources with in-memory pyramid levels, their levels may be loaded after registration
+        self._pyramids = []
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def register_cache(self, cache, level_of=None):
+        """ Register a cache.
+
+        Arguments:
+            cache [heimdall.cache.ChunkCache] - the cache
+            level_of [callable] - returns the pyramid level of a cache key, if given,
+                the blocks of the finest levels are evicted first (default: None)
+        """
+        with self._lock:
+            if any(cache is registered for registered, _, _ in self._caches):
+                return
+            self._caches.append((cache, cache.max_cache_size, level_of))
+
+    def register_in_memory(self, dataset):
+        """ Register an in-memory dataset that can be released, see `InMemoryDataset`.
+        """
+        with self._lock:
+            if not any(dataset is registered for registered in self._in_memory):
+                self._in_memory.append(dataset)
+
+    def _in_memory_datasets(self):
+        return self._in_memory + [level for source in self._pyramids for level in source.in_memory_levels]
+
+    def register_source(self, source):
+        """ Register the caches and in-memory data of a source and the sources it wraps.
+        """
+        if isinstance(source, ProgressivePyramidSource):
+            self.register_cache(source.cache, level_of=lambda key: key[0])
+        elif isinstance(source, PyramidSource) and isinstance(source.get_level(0),
+                                                              (KnossosCubeDataset, DaskDataset)):
+            self.register_cache(source.get_level(0).cache, level_of=lambda key: key[0])
+        if isinstance(source, (NumpySource, PyramidSource)):
+            with self._lock:
+                if not any(source is registered for registered in self._pyramids):
+                    self._pyramids.append(source)
+
+        cache = getattr(source, 'cache', None)
+        if isinstance(cache, ChunkCache):
+            self.register_cache(cache)
+        data = getattr(source, 'data', None)
+        if isinstance(data, InMemoryDataset):
+            self.register_in_memory(data)
+        elif isinstance(data, (KnossosCubeDataset, DaskDataset)):
+            self.register_cache(data.cache)
+
+        # wrapped sources, expression wrappers can hold them in a dict
+        wrapped_sources = getattr(source, 'sources', [getattr(source, 'source', None)])
+        if isinstance(wrapped_sources, dict):
+            wrapped_sources = list(wrapped_sources.values())
+        for wrapped in wrapped_sources:
+            if wrapped is not None:
+                self.register_source(wrapped)
+
+    @property
+    def owned_memory(self):
+        """ Memory held by the registered caches and in-memory datasets in bytes.
+        """
+        with self._lock:
+            return sum(cache.current_cache_size for cache, _, _ in self._caches) +\
+                sum(dataset.nbytes for dataset in self._in_memory_datasets())
+
+    def _evict_fine_levels(self, need):
+        freed = 0
+        for cache, _, level_of in self._caches:
+            if level_of is None:
+                continue
+            levels = sorted(set(level_of(key) for key in cache.keys()))
+            # keep the coarsest cached level
+            for level in levels[:-1]:
+                if freed >= need:
+                    return freed
+                size = cache.current_cache_size
+                cache.invalidate_where(lambda key: level_of(key) == level)
+                freed += size - cache.current_cache_size
+        return freed
+
+    def _shrink_caches(self, need):
+        freed = 0
+        for cache, _, _ in sorted(self._caches, key=lambda entry: -entry[0].current_cache_size):
+            if freed >= need:
+                break
+            size = cache.current_cache_size
+            cache.max_cache_size = max(self._min_cache_size, int(cache.max_cache_size * self._shrink_factor))
+            freed += size - cache.current_cache_size
+        return freed
+
+    def _release_in_memory(self, need):
+        freed = 0
+        for dataset in sorted(self._in_memory_datasets(), key=lambda dataset: -dataset.nbytes):
+            if freed >= need:
+                break
+            size = dataset.nbytes
+            if size > 0 and dataset.release():
+                freed += size
+        return freed
+
+    def _grow_caches(self, spare):
+        for cache, initial_size, _ in self._caches:
+            if spare <= 0:
+                break
+            if cache.max_cache_size < initial_size:
+                new_size = min(initial_size, cache.max_cache_size + int(spare),
+                               max(int(cache.max_cache_size / self._shrink_factor), self._min_cache_size))
+                spare -= new_size - cache.max_cache_size
+                cache.max_cache_size = new_size
+
+    def step(self, meminfo=None):
+        """ Check the available memory once and free or grant memory.
+
+        Arguments:
+            meminfo [tuple[int]] - total and available memory in bytes,
+                read from /proc/meminfo by default (default: None)
+        """
+        meminfo = read_meminfo() if meminfo is None else meminfo
+        if meminfo is None:
+            return
+        total, available = meminfo
+        low, high = self._min_available * total, self._target_available * total
+        with self._lock:
+            if available < low:
+                need = low - available
+                need -= self._evict_fine_levels(need)
+                if need > 0:
+                    need -= self._shrink_caches(need)
+                if need > 0:
+                    self._release_in_memory(need)
+            elif available > high:
+                # only grant half of the spare memory, to avoid oscillating
+                self._grow_caches((available - high) / 2)
+
+    def _run(self):
+        while not self._stop.wait(self._interval):
+            self.step()
+
+    def start(self):
+        """ Check the memory periodically in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -0,0 +1,259 @@
+import hashlib
+import os
+from concurrent import futures
+
+import numpy as np
+import elf.io
+
+from .blocking import infer_chunks
+from .sources import PyramidSource, infer_pyramid_format, get_ome_zarr_multiscales
+
+# characters used to render overviews in the terminal, from dark to bright
+render_chars = ' .:-=+*#%@'
+
+
+def default_cache_dir():
+    """ Directory of the local overview cache, can be set via the environment variable HEIMDALL_CACHE_DIR.
+    """
+    return os.environ.get('HEIMDALL_CACHE_DIR',
+                          os.path.join(os.path.expanduser('~'), '.cache', 'heimdall'))
+
+
+def _cache_path(path, key, cache_dir):
+    digest = hashlib.sha1(('%s:%s' % (os.path.abspath(path), key)).encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, 'overviews', '%s.npz' % digest)
+
+
+def get_mtime(path, key):
+    """ Modification time of a dataset or group in a container.
+
+    For n5 / zarr, this is the latest modification time of the dataset directory and its direct children,
+    for all other formats the modification time of the file.
+    Note that this does not cover chunks that are rewritten in nested chunk directories,
+    e.g. for n5, so use `use_cache=False` in `get_overviews` after rewriting the data in place.
+    """
+    ds_path = os.path.join(path, key)
+    if not os.path.isdir(ds_path):
+        return os.stat(path).st_mtime_ns
+    return max([os.stat(ds_path).st_mtime_ns] + [entry.stat().st_mtime_ns for entry in os.scandir(ds_path)])
+
+
+def _sampled_ranges(size, stride, chunk_size):
+    # the ranges of the sampled coordinates along an axis that fall into the same chunk
+    ranges = {}
+    for coord in range(0, size, stride):
+        start, _ = ranges.setdefault(coord // chunk_size, (coord, coord))
+        ranges[coord // chunk_size] = (start, coord + 1)
+    return [slice(start, stop) for start, stop in ranges.values()]
+
+
+def read_strided(data, max_size=128, max_planes=16):
+    """ Read a strided sample of the data with at most `max_size` values per axis.
+
+    The first axis is sampled plane by plane, because not all backends support strided reads.
+    At most `max_planes` planes are read along it. Within a plane, only the chunks that contain
+    samples are read, one band of chunks along the second axis at a time, so that the memory
+    needed for reading is bounded by a band and not a full plane.
+    """
+    shape = data.shape
+    if len(shape) < 2:
+        return np.asarray(data[:])[::max(1, -(-shape[0] // max_size))]
+    strides = [max(1, -(-sh // max_size)) for sh in shape]
+    strides[0] = max(1, -(-shape[0] // min(max_size, max_planes)))
+    in_plane = tuple(slice(None, None, stride) for stride in strides[1:])
+    if len(shape) == 2:
+        return np.stack([np.asarray(data[z])[in_plane] for z in range(0, shape[0], strides[0])])
+
+    chunks = infer_chunks(data)
+    out_shape = tuple(len(range(0, sh, st)) for sh, st in zip(shape, strides))
+    out = np.empty(out_shape, dtype=data.dtype)
+    # the last axes are read from the first to the last sample
+    tail = tuple(slice(0, (osh - 1) * st + 1) for osh, st in zip(out_shape[2:], strides[2:]))
+    for out_z, z in enumerate(range(0, shape[0], strides[0])):
+        for band in _sampled_ranges(shape[1], strides[1], chunks[1]):
+            block = np.asarray(data[(z, band) + tail])[in_plane]
+            out[out_z, band.start // strides[1]:band.start // strides[1] + block.shape[0]] = block
+    return out
+
+
+class Overview:
+    """ Small overview of a dataset together with its shape, dtype and statistics.
+
+    The overview is a strided sample of the dataset or of the coarsest level of a pyramid.
+    Use `get_overviews` to compute the overviews for all datasets in a container,
+    they are cached in a local sidecar cache.
+
+    Arguments:
+        name [str] - name of the dataset
+        shape [tuple[int]] - shape of the dataset
+        dtype [str] - dtype of the dataset
+        data [np.ndarray] - the overview
+        n_scales [int] - number of scales for pyramids (default: 1)
+    """
+    def __init__(self, name, shape, dtype, data, n_scales=1):
+        self._name = name
+        self._shape = tuple(int(sh) for sh in shape)
+        self._dtype = str(dtype)
+        self._data = data
+        self._n_scales = int(n_scales)
+
+        # the statistics are estimated from the overview
+        self._min_val = data.min().item() if data.size else 0
+        self._max_val = data.max().item() if data.size else 0
+        self._mean = float(data.mean()) if data.size else 0.
+        self._std = float(data.std()) if data.size else 0.
+
+    @classmethod
+    def compute(cls, node, name, max_size=128, max_planes=16):
+        """ Compute the overview of a dataset or pyramid group.
+        """
+        if elf.io.is_dataset(node):
+            return cls(name, node.shape, node.dtype,
+                       read_strided(node, max_size, max_planes))
+        source = PyramidSource(node)
+        level = source.get_level(source.n_scales - 1)
+        return cls(name, source.shape, source.dtype,
+                   read_strided(level, max_size, max_planes), source.n_scales)
+
+    def save(self, path, mtime):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # write to a temporary file first, so that concurrent readers never see a partial file
+        tmp_path = '%s.%i.tmp.npz' % (path[:-len('.npz')], os.getpid())
+        np.savez(tmp_path, name=self._name, shape=np.array(self._shape), dtype=self._dtype,
+                 data=self._data, n_scales=self._n_scales, mtime=mtime)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mtime=None):
+        """ Load the overview, returns None if it was saved for a different modification time.
+        """
+        with np.load(path) as f:
+            if mtime is not None and int(f['mtime']) != mtime:
+                return None
+            return cls(str(f['name']), tuple(f['shape']), str(f['dtype']), f['data'], int(f['n_scales']))
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def n_scales(self):
+        return self._n_scales
+
+    @property
+    def min_val(self):
+        return self._min_val
+
+    @property
+    def max_val(self):
+        return self._max_val
+
+    @property
+    def mean(self):
+        return self._mean
+
+    @property
+    def std(self):
+        return self._std
+
+    @property
+    def central_slice(self):
+        """ Central 2d slice of the overview.
+        """
+        data = self._data
+        while data.ndim > 2:
+            data = data[data.shape[0] // 2]
+        return data
+
+    def summary(self):
+        pyramid = '' if self.n_scales == 1 else ', %i scales' % self.n_scales
+        return '%s: shape %s, %s%s, min %.4g, max %.4g, mean %.4g, std %.4g' % (self.name, str(self.shape),
+                                                                              self.dtype, pyramid,
+                                                                              self.min_val, self.max_val,
+                                                                              self.mean, self.std)
+
+    def render(self, width=64):
+        """ Render the central slice as text.
+        """
+        data = self.central_slice
+        if data.ndim < 2:
+            data = data[None]
+        # terminal characters are about twice as high as wide
+        step = max(1, -(-data.shape[1] // width))
+        data = data[::2 * step, ::step].astype('float64')
+        data = (data - self.min_val) / max(self.max_val - self.min_val, 1e-12)
+        indices = np.clip((data * (len(render_chars) - 1)).round(), 0, len(render_chars) - 1).astype('int')
+        return '\n'.join(''.join(render_chars[ind] for ind in row) for row in indices)
+
+
+def _list_entries(f, ndim):
+    # the root of the container is a pyramid
+    if elf.io.is_knossos(f) or get_ome_zarr_multiscales(f) is not None:
+        return [('', f)]
+
+    entries, pyramid_groups = [], []
+
+    def visitor(name, node):
+        if any(name.startswith(group + '/') for group in pyramid_groups):
+            return
+        if elf.io.is_dataset(node):
+            if ndim is None or node.ndim in (ndim, ndim + 1):
+                entries.append((name, node))
+        elif infer_pyramid_format(node) is not None:
+            pyramid_groups.append(name)
+            entries.append((name, node))
+
+    f.visititems(visitor)
+    return entries
+
+
+def get_overviews(path, ndim=None, cache_dir=None, use_cache=True,
+                  max_size=128, max_planes=16, n_threads=1):
+    """ Get the overviews for all datasets and pyramids in a container.
+
+    Overviews are stored in a local sidecar cache and only recomputed if the dataset was modified.
+
+    Arguments:
+        path [str] - path to the container
+        ndim [int] - only list datasets with this number of dimensions (or one more for channels).
+            List all datasets if None (default: None)
+        cache_dir [str] - directory of the overview cache, by default `default_cache_dir()` (default: None)
+        use_cache [bool] - whether to use cached overviews (default: True)
+        max_size [int] - maximal size of the overview along each axis (default: 128)
+        max_planes [int] - maximal number of planes read along the first axis (default: 16)
+        n_threads [int] - number of threads used to compute the overviews (default: 1)
+    """
+    cache_dir = default_cache_dir() if cache_dir is None else cache_dir
+
+    def get_overview(name, node):
+        cache_path = _cache_path(path, name, cache_dir)
+        mtime = get_mtime(path, name)
+        if use_cache and os.path.exists(cache_path):
+            overview = Overview.load(cache_path, mtime)
+            if overview is not None:
+                return overview
+        overview = Overview.compute(node, name if name else os.path.basename(path.rstrip('/')),
+                                    max_size, max_planes)
+        overview.save(cache_path, mtime)
+        return overview
+
+    with elf.io.open_file(path, mode='r') as f:
+        entries = _list_entries(f, ndim)
+        with futures.ThreadPoolExecutor(n_threads) as tp:
+            return list(tp.map(lambda entry: get_overview(*entry), entries))
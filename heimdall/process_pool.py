@@ -0,0 +1,207 @@
+import multiprocessing
+import os
+import threading
+from concurrent import futures
+from multiprocessing.shared_memory import SharedMemory
+
+import numpy as np
+import elf.io
+from elf.util import normalize_index, squeeze_singletons
+
+from .blocking import block_bounding_box, blocks_in_bounding_box, infer_chunks, overlap_bounding_boxes
+
+# the pools are shared by all datasets, so that we don't start
+# a new set of processes for each opened dataset
+_pools = {}
+# files and datasets opened by the worker processes, the datasets are stored with their modification time
+_files = {}
+_datasets = {}
+
+
+def get_process_pool(n_processes):
+    """ Get the process pool with the given number of workers.
+
+    The workers are started with 'spawn', because hdf5 does not support
+    accessing files that were opened before a fork.
+    """
+    if n_processes not in _pools:
+        ctx = multiprocessing.get_context('spawn')
+        _pools[n_processes] = futures.ProcessPoolExecutor(n_processes, mp_context=ctx)
+    return _pools[n_processes]
+
+
+def modification_time(path, key):
+    """ Modification time of the dataset metadata for n5 and zarr, otherwise of the file.
+
+    Returns None if the dataset does not exist.
+    """
+    for metadata_path in (os.path.join(path, key, 'attributes.json'),
+                          os.path.join(path, key, '.zarray'), path):
+        try:
+            return os.stat(metadata_path).st_mtime_ns
+        except (FileNotFoundError, NotADirectoryError):
+            pass
+    return None
+
+
+def _close_file(path):
+    f = _files.pop(path, None)
+    for dataset_key in [dataset_key for dataset_key in _datasets if dataset_key[0] == path]:
+        del _datasets[dataset_key]
+    if f is not None:
+        f.close()
+
+
+def open_dataset(path, key):
+    """ Open the dataset in the current process or return it if it was already opened.
+
+    The file is kept open until the process exits, so this should only be called in worker processes.
+    If the dataset was modified or removed since it was opened, its file is closed and opened again,
+    so that the workers don't read from stale handles.
+    """
+    mtime = modification_time(path, key)
+    ds, ds_mtime = _datasets.get((path, key), (None, None))
+    if ds is not None and ds_mtime == mtime:
+        return ds
+    if ds is not None:
+        _close_file(path)
+    if path not in _files:
+        _files[path] = elf.io.open_file(path, mode='r')
+    ds = _files[path][key]
+    _datasets[(path, key)] = (ds, mtime)
+    return ds
+
+
+def _read_blocks(path, key, shm_name, out_shape, dtype, tasks):
+    ds = open_dataset(path, key)
+    shm = SharedMemory(name=shm_name)
+    try:
+        out = np.ndarray(out_shape, dtype=dtype, buffer=shm.buf)
+        for in_out, in_ds in tasks:
+            out[in_out] = ds[in_ds]
+        del out
+    finally:
+        shm.close()
+
+
+class ProcessPoolDataset:
+    """ Array-like that reads and decodes chunks in parallel processes.
+
+    Decompressing chunks is cpu bound and h5py holds the GIL while doing it,
+    so reading with threads does not scale. Here, the worker processes open the
+    file themselves and write the decoded chunks directly into shared memory,
+    so the data is not pickled.
+
+    Arguments:
+        path [str] - path to the hdf5, n5 or zarr file
+        key [str] - name of the dataset in the file
+        n_processes [int] - number of worker processes (default: number of cpus)
+        min_blocks [int] - minimal number of chunks in a request to use the process pool,
+            smaller requests are read in the current process (default: 2)
+
+    The file is only kept open in the current process once a small request was read there;
+    call `close` to close it. It is opened again if the dataset was modified, see `open_dataset`.
+    """
+    def __init__(self, path, key, n_processes=None, min_blocks=2):
+        self._path = path
+        self._key = key
+        self._n_processes = multiprocessing.cpu_count() if n_processes is None else n_processes
+        self._min_blocks = min_blocks
+        # open the file only to read the metadata, so that it is not kept open in the current process
+        with elf.io.open_file(path, mode='r') as f:
+            ds = f[key]
+            self._shape = tuple(ds.shape)
+            self._dtype = np.dtype(ds.dtype)
+            self._chunks = infer_chunks(ds)
+        self._file = None
+        self._dataset = None
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    @property
+    def path(self):
+        return self._path
+
+    @property
+    def key(self):
+        return self._key
+
+    @property
+    def n_processes(self):
+        return self._n_processes
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    def _tasks(self, bb):
+        tasks = []
+        for block_id in blocks_in_bounding_box(bb, self.chunks):
+            block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+            overlap = overlap_bounding_boxes(bb, block_bb)
+            if overlap is None:
+                continue
+            in_out, in_block = overlap
+            in_ds = tuple(slice(bl.start + ib.start, bl.start + ib.stop)
+                          for bl, ib in zip(block_bb, in_block))
+            tasks.append((in_out, in_ds))
+        # distribute the chunks evenly over the workers
+        return [tasks[i::self.n_processes] for i in range(min(self.n_processes, len(tasks)))]
+
+    def read(self, bb):
+        """ Read the normalized bounding box.
+        """
+        out_shape = tuple(b.stop - b.start for b in bb)
+        tasks = self._tasks(bb)
+        n_blocks = sum(len(task) for task in tasks)
+        if self.n_processes < 2 or n_blocks < self._min_blocks:
+            with self._lock:
+                mtime = modification_time(self.path, self.key)
+                if self._dataset is not None and mtime != self._mtime:
+                    self._file.close()
+                    self._file, self._dataset = None, None
+                if self._dataset is None:
+                    self._file = elf.io.open_file(self.path, mode='r')
+                    self._dataset = self._file[self.key]
+                    self._mtime = mtime
+                ds = self._dataset
+            return ds[bb]
+
+        dtype = np.dtype(self.dtype)
+        size = int(np.prod(out_shape)) * dtype.itemsize
+        shm = SharedMemory(create=True, size=max(size, 1))
+        try:
+            pool = get_process_pool(self.n_processes)
+            jobs = [pool.submit(_read_blocks, self.path, self.key, shm.name, out_shape, dtype, task)
+                    for task in tasks]
+            for job in jobs:
+                job.result()
+            out = np.ndarray(out_shape, dtype=dtype, buffer=shm.buf).copy()
+        finally:
+            shm.close()
+            shm.unlink()
+        return out
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        return squeeze_singletons(self.read(bb), to_squeeze)
+
+    def close(self):
+        """ Close the file if it was opened in the current process.
+        """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file, self._dataset = None, None
@@ -0,0 +1,63 @@
+import itertools
+import os
+from concurrent import futures
+import elf.io
+
+from .blocking import block_bounding_box, n_blocks
+
+
+def rechunk(input_path, input_key, output_path, output_key, chunks,
+            n_threads=1, compression='gzip', block_shape=None):
+    """ Copy a dataset into a new dataset with a different chunk shape.
+
+    Use this to create copies of a dataset that are chunked for viewing along another axis,
+    e.g. (512, 512, 1) and (512, 1, 512) for a dataset with chunks (1, 512, 512),
+    and combine them with the original in a `heimdall.source_wrappers.MultiLayoutWrapper`.
+    The data is copied in parallel in blocks that are aligned with the new chunks,
+    so that each output chunk is written exactly once.
+
+    Arguments:
+        input_path [str] - path to the input container
+        input_key [str] - name of the input dataset
+        output_path [str] - path to the output container, can be the same as the input
+        output_key [str] - name of the output dataset
+        chunks [tuple[int]] - chunk shape of the output dataset
+        n_threads [int] - number of threads used for copying (default: 1)
+        compression [str] - compression of the output dataset (default: 'gzip')
+        block_shape [tuple[int]] - shape of the blocks that are copied at once. By default the
+            maximum of input and output chunks, rounded up to a multiple of the output chunks (default: None)
+    """
+    chunks = tuple(chunks)
+    # hdf5 files can't be opened twice, so we use the same file object if input and output are the same
+    same_file = os.path.abspath(input_path) == os.path.abspath(output_path)
+    f_out = elf.io.open_file(output_path, mode='a')
+    f_in = f_out if same_file else elf.io.open_file(input_path, mode='r')
+    try:
+        ds_in = f_in[input_key]
+        shape = ds_in.shape
+        if len(chunks) != len(shape):
+            raise ValueError("Invalid chunks %s for data of shape %s" % (str(chunks), str(shape)))
+        in_chunks = ds_in.chunks if ds_in.chunks is not None else chunks
+
+        if block_shape is None:
+            block_shape = tuple(-(-max(ich, ch) // ch) * ch for ich, ch in zip(in_chunks, chunks))
+        elif any(bs % ch != 0 for bs, ch in zip(block_shape, chunks)):
+            raise ValueError("Block shape %s must be a multiple of the chunks %s" % (str(block_shape),
+                                                                                     str(chunks)))
+
+        ds_out = f_out.require_dataset(output_key, shape=shape, dtype=ds_in.dtype,
+                                       chunks=chunks, compression=compression)
+        if hasattr(ds_in, 'n_threads'):
+            ds_in.n_threads = 1
+
+        def copy_block(block_id):
+            block_bb = block_bounding_box(block_id, block_shape, shape)
+            ds_out[block_bb] = ds_in[block_bb]
+
+        block_ids = itertools.product(*[range(nb) for nb in n_blocks(shape, block_shape)])
+        with futures.ThreadPoolExecutor(n_threads) as tp:
+            list(tp.map(copy_block, block_ids))
+    finally:
+        f_out.close()
+        if not same_file:
+            f_in.close()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import argparse
+import elf.io
+from ..export import export_frames, file_formats
+from ..sources import BigDataSource, PyramidSource, infer_pyramid_format
+
+
+parser = argparse.ArgumentParser(description='Export 2d frames of a dataset or pyramid in h5 or n5/zarr container.')
+parser.add_argument('path', type=str, help='path to container')
+parser.add_argument('key', type=str, help='name of the dataset or pyramid group in the container')
+parser.add_argument('output_folder', type=str, help='folder for the exported frames')
+parser.add_argument('--axis', type=int, default=0,
+                    help='axis along which the frames are exported')
+parser.add_argument('--roi_start', type=int, nargs=3, default=None,
+                    help='start of the exported region')
+parser.add_argument('--roi_stop', type=int, nargs=3, default=None,
+                    help='stop of the exported region')
+parser.add_argument('--step', type=int, default=1,
+                    help='distance between exported frames along the axis')
+parser.add_argument('--max_size', type=int, default=None,
+                    help='maximal size of the frames in pixels, full resolution by default')
+parser.add_argument('--contrast_limits', type=float, nargs=2, default=None,
+                    help='contrast limits for raw data')
+parser.add_argument('--format', type=str, default='png', choices=file_formats,
+                    help='file format of the frames')
+parser.add_argument('--n_processes', type=int, default=4,
+                    help='number of processes used to render and write the frames')
+
+
+def main():
+    args = parser.parse_args()
+    with elf.io.open_file(args.path, mode='r') as f:
+        node = f[args.key]
+        if elf.io.is_dataset(node):
+            source = BigDataSource(node, name=args.key)
+        else:
+            source = PyramidSource(node, pyramid_format=infer_pyramid_format(node), name=args.key)
+        start = 0 if args.roi_start is None else args.roi_start[args.axis]
+        stop = source.shape[args.axis] if args.roi_stop is None else args.roi_stop[args.axis]
+        paths = export_frames(source, args.output_folder, axis=args.axis,
+                              positions=range(start, stop, args.step),
+                              roi_start=args.roi_start, roi_stop=args.roi_stop,
+                              max_size=args.max_size, contrast_limits=args.contrast_limits,
+                              file_format=args.format, n_processes=args.n_processes)
+    print("Exported", len(paths), "frames to", args.output_folder)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,39 @@
+#!/usr/bin/env python
+
+import argparse
+from ..overview import get_overviews
+
+
+parser = argparse.ArgumentParser(description='List the datasets in h5 or n5/zarr containers with cached overviews.')
+parser.add_argument('paths', type=str, nargs='+', help='paths to containers')
+parser.add_argument('--ndim', type=int, default=None,
+                    help='only list datasets with this number of dimensions')
+parser.add_argument('--render', action='store_true',
+                    help='render the central slice of each overview as text')
+parser.add_argument('--width', type=int, default=64,
+                    help='width of the rendered overviews in characters')
+parser.add_argument('--max_size', type=int, default=128,
+                    help='maximal size of the overviews along each axis')
+parser.add_argument('--cache_dir', type=str, default=None,
+                    help='directory of the overview cache')
+parser.add_argument('--no_cache', action='store_true',
+                    help='recompute all overviews')
+parser.add_argument('--n_threads', type=int, default=1,
+                    help='number of threads used to compute the overviews')
+
+
+def main():
+    args = parser.parse_args()
+    for path in args.paths:
+        print(path)
+        overviews = get_overviews(path, ndim=args.ndim, cache_dir=args.cache_dir,
+                                  use_cache=not args.no_cache, max_size=args.max_size,
+                                  n_threads=args.n_threads)
+        for overview in overviews:
+            print('  ' + overview.summary())
+            if args.render:
+                print(overview.render(args.width))
+
+
+if __name__ == '__main__':
+    main()
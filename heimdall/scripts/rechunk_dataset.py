@@ -0,0 +1,27 @@
+#!/usr/bin/env python
+
+import argparse
+from ..rechunk import rechunk
+
+
+parser = argparse.ArgumentParser(description='Copy a dataset in h5 or n5/zarr container with a different chunk shape.')
+parser.add_argument('input_path', type=str, help='path to input container')
+parser.add_argument('input_key', type=str, help='name of the input dataset')
+parser.add_argument('output_path', type=str, help='path to output container')
+parser.add_argument('output_key', type=str, help='name of the output dataset')
+parser.add_argument('--chunks', type=int, nargs='+', required=True,
+                    help='chunk shape of the output dataset')
+parser.add_argument('--n_threads', type=int, default=1,
+                    help='number of threads used for copying')
+parser.add_argument('--compression', type=str, default='gzip',
+                    help='compression of the output dataset')
+
+
+def main():
+    args = parser.parse_args()
+    rechunk(args.input_path, args.input_key, args.output_path, args.output_key,
+            args.chunks, args.n_threads, args.compression)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,31 @@
+#!/usr/bin/env python
+
+import argparse
+from ..server import serve_container
+
+
+parser = argparse.ArgumentParser(description='Serve datasets in h5 or n5/zarr container to other viewer processes.')
+parser.add_argument('path', type=str, help='path to container')
+parser.add_argument('--address', type=str, default=None,
+                    help='path of the unix socket')
+parser.add_argument('--ndim', type=int, default=3,
+                    help='expected number of dimensions')
+parser.add_argument('--exclude_names', type=str, nargs='+', default=None,
+                    help='names of datasets that will not be served')
+parser.add_argument('--include_names', type=str, nargs='+', default=None,
+                    help='names of datasets that will ONLY be served')
+parser.add_argument('--max_cache_size', type=int, default=1024**3,
+                    help='size of the shared chunk cache in bytes')
+parser.add_argument('--n_threads', type=int, default=1,
+                    help='number of threads used to load chunks')
+
+
+def main():
+    args = parser.parse_args()
+    serve_container(args.path, args.address, args.ndim,
+                    args.exclude_names, args.include_names,
+                    args.max_cache_size, args.n_threads)
+
+
+if __name__ == '__main__':
+    main()
@@ -20,13 +20,18 @@ parser.add_argument('--load_into_memory', type=tobool, default='n',
                     help='whether to load all data into memory')
 parser.add_argument('--n_threads', type=int, default=1,
                     help='number of threads used by z5py')
+parser.add_argument('--n_processes', type=int, default=None,
+                    help='number of processes used to read and decode datasets')
+parser.add_argument('--adapt_memory', type=tobool, default='n',
+                    help='whether to adapt the memory used by heimdall to the available system memory')
 
 
 def main():
     args = parser.parse_args()
     view_container(args.path, args.ndim,
                    args.exclude_names, args.include_names,
-                   args.load_into_memory, args.n_threads)
+                   args.load_into_memory, args.n_threads,
+                   args.n_processes, args.adapt_memory)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,374 @@
+import getpass
+import os
+import socket
+import stat
+import tempfile
+import threading
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Listener, Client
+import numpy as np
+
+import elf.io
+from elf.util import normalize_index, squeeze_singletons
+
+from .blocking import block_bounding_box, infer_chunks, read_blockwise
+from .cache import ChunkCache
+from .sources import Source, BigDataSource, PyramidSource, get_ome_zarr_multiscales
+from .viewer import to_source, load_sources_from_file
+
+
+def _private_directory():
+    # directory that only the user can access, so that other users can't connect to the socket
+    user = os.getuid() if hasattr(os, 'getuid') else getpass.getuser()
+    path = os.path.join(tempfile.gettempdir(), 'heimdall-%s' % user)
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or (hasattr(os, 'getuid') and info.st_uid != os.getuid())\
+            or info.st_mode & 0o077:
+        raise RuntimeError("%s is not a private directory of the current user" % path)
+    return path
+
+
+def default_address():
+    """ Default socket path, it is the same for all processes of a user so that clients find the server.
+
+    The socket is placed in a directory that only the user can access.
+    """
+    return os.path.join(_private_directory(), 'server.sock')
+
+
+def key_path(address):
+    """ Path of the file with the authentication key of the server at the address.
+    """
+    return address + '.key'
+
+
+def read_authkey(address, authkey=None):
+    """ Return the authentication key or read the key written by the server at the address.
+    """
+    if authkey is None and os.path.exists(key_path(address)):
+        with open(key_path(address), 'rb') as f:
+            authkey = f.read()
+    return authkey
+
+
+def _is_listening(address):
+    with socket.socket(socket.AF_UNIX) as sock:
+        try:
+            sock.connect(address)
+        except OSError:
+            return False
+    return True
+
+
+class SourceServer:
+    """ Serve sources to viewers running in other processes.
+
+    The sources are opened once and all of them share a single chunk cache.
+    Clients connect via a unix socket and read data with `RemoteSource`.
+    Requests are served chunk-aligned, so that overlapping requests of different
+    clients are loaded only once, also if they arrive at the same time.
+    Clients need to authenticate: by default, a random key is generated and written
+    next to the socket, to a file that only the user can read, see `key_path`.
+    Clients that don't pass a key read it from this file.
+
+    Arguments:
+        sources [list or dict] - the sources to serve. If a list is passed,
+            the source names are used as keys.
+        address [str] - path of the unix socket (default: None)
+        max_cache_size [int] - size of the shared chunk cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used to load the chunks of a single request (default: 1)
+        authkey [bytes] - authentication key clients need to provide,
+            by default a random key is generated (default: None)
+    """
+    def __init__(self, sources, address=None, max_cache_size=1024**3, n_threads=1, authkey=None):
+        if not isinstance(sources, dict):
+            sources = {source.name: source for source in sources}
+        if any(name is None for name in sources):
+            raise ValueError("All served sources need a name")
+        self._sources = sources
+        self._levels = {name: self._init_levels(source) for name, source in sources.items()}
+
+        self._address = default_address() if address is None else address
+        self._authkey = authkey
+        self._key_file = None
+        self._cache = ChunkCache(max_cache_size)
+        self._n_threads = n_threads
+
+        self._listener = None
+        self._thread = None
+        self._closed = threading.Event()
+
+    @staticmethod
+    def _init_levels(source):
+        # the served datasets need to expose the channel axis,
+        # so we serve the data of sources and not the sources themselves
+        if isinstance(source, PyramidSource):
+            levels = [source.get_level(level) for level in range(source.n_scales)]
+        else:
+            levels = [source]
+        return [level.data if isinstance(level, Source) else level for level in levels]
+
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def names(self):
+        return list(self._sources.keys())
+
+    def metadata(self, name):
+        source = self._sources[name]
+        levels = self._levels[name]
+        ds = levels[0]
+        ndim = len(source.scale)
+        return {'shape': tuple(ds.shape), 'dtype': str(ds.dtype),
+                'chunks': infer_chunks(ds), 'layer_type': source.layer_type,
+                'channel_axis': source.channel_axis, 'scale': tuple(source.scale),
+                'min_val': getattr(source, 'min_val', None),
+                'max_val': getattr(source, 'max_val', None),
+                'n_scales': len(levels),
+                'scales': source.scales if isinstance(source, PyramidSource) else [(1,) * ndim],
+                'level_shapes': [tuple(level.shape) for level in levels],
+                'level_chunks': [infer_chunks(level) for level in levels]}
+
+    def read(self, name, level, bb):
+        ds = self._levels[name][level]
+        bb = tuple(slice(start, stop) for start, stop in bb)
+        chunks = infer_chunks(ds)
+
+        def read_block(block_id):
+            key = (name, level, block_id)
+            block_bb = block_bounding_box(block_id, chunks, ds.shape)
+            return self._cache.get_or_load(key, lambda: ds[block_bb])
+
+        return read_blockwise(bb, ds.shape, chunks, ds.dtype, read_block, n_threads=self._n_threads)
+
+    def _handle(self, conn):
+        handlers = {'names': lambda: self.names,
+                    'metadata': self.metadata,
+                    'read': self.read}
+        with conn:
+            while not self._closed.is_set():
+                try:
+                    request, args = conn.recv()
+                except (EOFError, OSError):
+                    return
+                try:
+                    conn.send(('ok', handlers[request](*args)))
+                except Exception as e:
+                    conn.send(('error', '%s: %s' % (type(e).__name__, str(e))))
+
+    def _listen(self):
+        if os.path.exists(self._address):
+            if _is_listening(self._address):
+                raise RuntimeError("Another server is listening at %s" % self._address)
+            # the socket of a server that was not closed properly
+            os.remove(self._address)
+        if self._authkey is None:
+            self._authkey = os.urandom(32)
+            self._write_key_file()
+        self._listener = Listener(self._address, family='AF_UNIX', authkey=self._authkey)
+        os.chmod(self._address, 0o600)
+
+    def _write_key_file(self):
+        path = key_path(self._address)
+        if os.path.exists(path):
+            os.remove(path)
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self._authkey)
+        self._key_file = path
+
+    def serve_forever(self):
+        """ Accept connections until `close` is called.
+
+        Raises a RuntimeError if another server is listening at the address.
+        """
+        if self._listener is None:
+            self._listen()
+        while not self._closed.is_set():
+            try:
+                conn = self._listener.accept()
+            # clients that fail to authenticate are rejected, but don't stop the server
+            except (AuthenticationError, EOFError, ConnectionError):
+                continue
+            except OSError:
+                break
+            if self._closed.is_set():
+                conn.close()
+                break
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def start(self):
+        """ Serve in a background thread.
+        """
+        # listen before starting the thread, so that clients can connect immediately
+        # and errors are raised in the calling thread
+        self._listen()
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        if self._listener is not None:
+            # wake up the blocking accept call
+            try:
+                Client(self._address, family='AF_UNIX', authkey=self._authkey).close()
+            except Exception:
+                pass
+            self._listener.close()
+        if self._thread is not None:
+            self._thread.join()
+        if self._key_file is not None and os.path.exists(self._key_file):
+            os.remove(self._key_file)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class RemoteDataset:
+    """ Array-like proxy for a dataset served by a `SourceServer`.
+    """
+    def __init__(self, address, name, level=0, authkey=None):
+        self._conn = Client(address, family='AF_UNIX', authkey=read_authkey(address, authkey))
+        self._lock = threading.Lock()
+        self._name = name
+        self._level = level
+        self._metadata = self.request('metadata', name)
+        if level >= self._metadata['n_scales']:
+            raise ValueError("Invalid level %i for source with %i scales" % (level,
+                                                                             self._metadata['n_scales']))
+
+    def request(self, request, *args):
+        with self._lock:
+            self._conn.send((request, args))
+            status, result = self._conn.recv()
+        if status == 'error':
+            raise RuntimeError("Request %s failed on the server: %s" % (request, result))
+        return result
+
+    @property
+    def metadata(self):
+        return self._metadata
+
+    @property
+    def level(self):
+        return self._level
+
+    @property
+    def shape(self):
+        return self._metadata['level_shapes'][self._level]
+
+    @property
+    def chunks(self):
+        return self._metadata['level_chunks'][self._level]
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def dtype(self):
+        return np.dtype(self._metadata['dtype'])
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        bb = tuple((b.start, b.stop) for b in bb)
+        return squeeze_singletons(self.request('read', self._name, self._level, bb), to_squeeze)
+
+    def close(self):
+        self._conn.close()
+
+
+class RemoteSource(BigDataSource):
+    """ Source reading from a `SourceServer`.
+
+    Layer type, channel axis, scale and contrast limits are taken from
+    the served source, unless they are given explicitly.
+
+    Arguments:
+        address [str] - path of the unix socket the server listens on
+        name [str] - name of the served source
+        level [int] - the level to read for a served pyramid source (default: 0)
+        authkey [bytes] - authentication key of the server,
+            by default the key is read from the key file of the server (default: None)
+    """
+    def __init__(self, address, name, level=0, authkey=None, **kwargs):
+        data = RemoteDataset(address, name, level, authkey)
+        metadata = data.metadata
+        level_scale = metadata['scales'][level]
+        kwargs.setdefault('name', name)
+        kwargs.setdefault('layer_type', metadata['layer_type'])
+        kwargs.setdefault('channel_axis', metadata['channel_axis'])
+        kwargs.setdefault('scale', [sc * lsc for sc, lsc in zip(metadata['scale'], level_scale)])
+        kwargs.setdefault('min_val', metadata['min_val'])
+        kwargs.setdefault('max_val', metadata['max_val'])
+        super().__init__(data, **kwargs)
+
+    @property
+    def level(self):
+        return self._data.level
+
+
+def connect(address=None, authkey=None):
+    """ Create remote sources for all sources served at the address.
+    """
+    address = default_address() if address is None else address
+    authkey = read_authkey(address, authkey)
+    conn = Client(address, family='AF_UNIX', authkey=authkey)
+    with conn:
+        conn.send(('names', ()))
+        status, names = conn.recv()
+    if status == 'error':
+        raise RuntimeError("Could not list the sources served at %s: %s" % (address, names))
+    return [RemoteSource(address, name, authkey=authkey) for name in names]
+
+
+def serve_container(path, address=None, ndim=3,
+                    exclude_names=None, include_names=None,
+                    max_cache_size=1024**3, n_threads=1):
+    """ Serve contents of hdf5, n5/zarr or knossos file.
+
+    Arguments:
+        path [str]: path to the file
+        address [str]: path of the unix socket (default: None)
+        ndim [int]: expected number of dimensions (default: 3)
+        exclude_names [listlike]: will not serve these names.
+            Not compatible with include_names (default: None)
+        include_names [listlike]: will ONLY serve these names.
+            Not compatible with exclude_names (default: None).
+        max_cache_size [int]: size of the shared chunk cache in bytes (default: 1GB)
+        n_threads [int]: number of threads used to load chunks (default: 1)
+    """
+    assert not ((exclude_names is not None) and (include_names is not None))
+    with elf.io.open_file(path, mode='r') as f:
+        if elf.io.is_knossos(f):
+            sources = [to_source(f, n_threads=n_threads, name=os.path.basename(path))]
+        elif get_ome_zarr_multiscales(f) is not None:
+            sources = [to_source(f, name=os.path.basename(path.rstrip('/')))]
+        else:
+            sources = load_sources_from_file(f, reference_ndim=ndim,
+                                             exclude_names=exclude_names,
+                                             include_names=include_names,
+                                             n_threads=n_threads)
+        server = SourceServer(sources, address=address,
+                              max_cache_size=max_cache_size, n_threads=n_threads)
+        print("Serving", len(sources), "sources at", server.address)
+        try:
+            server.serve_forever()
+        finally:
+            server.close()
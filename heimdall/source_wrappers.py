@@ -1,13 +1,24 @@
 from abc import ABC
+import itertools
+import threading
+from contextlib import contextmanager
+import numpy as np
 import elf.wrapper
 from elf.wrapper.affine_volume import AffineVolume
 from elf.util import normalize_index, squeeze_singletons
-from .sources import Source, BigDataSource, PyramidSource
+from .blocking import (block_bounding_box, blocks_in_bounding_box, infer_chunks,
+                       overlap_bounding_boxes, read_blockwise, read_cost)
+from .cache import ChunkCache, CompressedChunk, QuantizedChunk
+from .sources import Source, BigDataSource, PyramidSource, SourceMetadata
 
 
 class SourceWrapper(ABC):
     """ Source wrapper base class
     """
+    # whether the wrapper exposes the source in the same coordinates,
+    # in this case the chunks of the source are also used for the wrapper
+    preserves_coordinates = True
+
     def __init__(self, source):
         if not isinstance(source, (Source, SourceWrapper)):
             raise ValueError("SourceWrapper can only wrap a heimdall.Source or another source wrapper.")
@@ -17,6 +28,29 @@ class SourceWrapper(ABC):
         self._source = source
         self._is_big_data_source = source.is_big_data_source if isinstance(source, SourceWrapper)\
             else isinstance(source, BigDataSource)
+        self._metadata = None
+
+    def _compute_metadata(self):
+        shape = tuple(self.shape)
+        chunks = getattr(self, 'chunks', None)
+        if chunks is None and self.preserves_coordinates:
+            chunks = self.source.metadata.chunks
+        return SourceMetadata(shape, np.dtype(self.dtype), tuple(self.scale), chunks,
+                              (shape,), ((1,) * len(shape),), (chunks,))
+
+    @property
+    def metadata(self):
+        """ Metadata of the wrapper that is computed once and then cached, see `Source.metadata`.
+        """
+        if self._metadata is None:
+            self._metadata = self._compute_metadata()
+        return self._metadata
+
+    def invalidate_metadata(self):
+        """ Recompute the metadata of this wrapper and the wrapped sources on the next access.
+        """
+        self._metadata = None
+        self.source.invalidate_metadata()
 
     @property
     def is_big_data_source(self):
@@ -68,18 +102,105 @@ class SourceWrapper(ABC):
     def scale(self):
         return self.source.scale
 
+    @property
+    def mutable(self):
+        return self.source.mutable
+
     def __getitem__(self, key):
         return self.source[key]
 
-    # TODO disable setitem for immutable sources (once we have them)
     def __setitem__(self, key, item):
+        if not self.mutable:
+            raise RuntimeError("Source %s is immutable" % self.name)
         self.source[key] = item
 
 
+class ReadPlan:
+    """ Read plan that maps the coordinates of a stack of wrappers to its base source.
+
+    The plan holds an index array per axis that maps each output coordinate to the coordinate
+    in the base source. Plans of stacked roi and nearest neighbor resize wrappers are composed
+    when they are first read and composed again after a wrapper in the stack was changed
+    (see `get_read_plan`), so that reading from a deep stack issues a single read
+    of the bounding box in the base source without intermediate arrays.
+
+    Arguments:
+        base [heimdall.Source or heimdall.SourceWrapper] - the source that is read
+        indices [list[np.ndarray]] - index arrays per axis
+    """
+    def __init__(self, base, indices):
+        self._base = base
+        self._indices = [np.asarray(index, dtype='int64') for index in indices]
+
+    @property
+    def base(self):
+        return self._base
+
+    @property
+    def shape(self):
+        return tuple(len(index) for index in self._indices)
+
+    @property
+    def translation(self):
+        """ The offsets to the base source if the plan is a pure translation, otherwise None.
+        """
+        offsets = []
+        for index in self._indices:
+            if len(index) > 0 and not np.array_equal(index, np.arange(index[0], index[0] + len(index))):
+                return None
+            offsets.append(int(index[0]) if len(index) > 0 else 0)
+        return tuple(offsets)
+
+    def roi(self, roi_start, roi_stop):
+        """ Compose the plan with a roi.
+        """
+        return ReadPlan(self._base, [index[start:stop]
+                                     for index, start, stop in zip(self._indices, roi_start, roi_stop)])
+
+    def resize(self, shape):
+        """ Compose the plan with a nearest neighbor resize to the given shape.
+        """
+        indices = []
+        for index, sh in zip(self._indices, shape):
+            factor = len(index) / float(sh)
+            nearest = np.minimum(((np.arange(sh) + 0.5) * factor).astype('int64'), len(index) - 1)
+            indices.append(index[nearest])
+        return ReadPlan(self._base, indices)
+
+    def read(self, bb):
+        """ Read the bounding box, given in the coordinates of the plan.
+        """
+        indices = [index[b] for index, b in zip(self._indices, bb)]
+        if any(len(index) == 0 for index in indices):
+            return np.zeros(tuple(len(index) for index in indices), dtype=self._base.dtype)
+        base_bb = tuple(slice(int(index.min()), int(index.max()) + 1) for index in indices)
+        data = np.asarray(self._base[base_bb])
+        # the indices are monotonic, so we only need to gather if they are not contiguous
+        if all(len(index) == b.stop - b.start for index, b in zip(indices, base_bb)):
+            return data
+        return data[np.ix_(*[index - b.start for index, b in zip(indices, base_bb)])]
+
+
+def get_read_plan(source):
+    """ Get the read plan of a source or wrapper.
+
+    Returns the plan of roi and resize wrappers, for all other sources the identity plan.
+    """
+    plan = getattr(source, 'read_plan', None)
+    if plan is not None:
+        return plan
+    return ReadPlan(source, [np.arange(sh) for sh in source.shape])
+
+
 # source wrappers:
 # - roi
 # - resize on the fly
 # - data caching (WIP)
+# - label selection
+# - relabeling
+# - element-wise expressions of several sources
+# - write-back buffering of edits
+# - reading from the best of several chunk layouts
 # TODO
 # - apply affines on the fly
 
@@ -87,11 +208,14 @@ class SourceWrapper(ABC):
 class RoiWrapper(SourceWrapper):
     """ Wrapper to expose only a roi of the source.
     """
+    preserves_coordinates = False
+
     def __init__(self, source, roi_start=None, roi_stop=None):
         super().__init__(source)
         self._roi_start = self.format_roi_start(roi_start, source.shape)
         self._roi_stop = self.format_roi_stop(roi_stop, source.shape)
         self._check_roi()
+        self._plan, self._inner_plan = None, None
 
     @staticmethod
     def format_roi_start(roi_start, shape, perform_check=True):
@@ -117,8 +241,10 @@ class RoiWrapper(SourceWrapper):
 
     @roi_start.setter
     def roi_start(self, roi_start):
-        self._roi_start = self.format_roi_start(roi_start)
+        self._roi_start = self.format_roi_start(roi_start, self.source.shape)
         self._check_roi()
+        self._plan = None
+        self.invalidate_metadata()
 
     @property
     def roi_stop(self):
@@ -126,18 +252,27 @@ class RoiWrapper(SourceWrapper):
 
     @roi_stop.setter
     def roi_stop(self, roi_stop):
-        self._roi_stop = self.format_roi_stop(roi_stop)
+        self._roi_stop = self.format_roi_stop(roi_stop, self.source.shape)
         self._check_roi()
+        self._plan = None
+        self.invalidate_metadata()
 
     @property
     def shape(self):
         return tuple(sto - sta for sta, sto in zip(self.roi_start, self.roi_stop))
 
+    @property
+    def read_plan(self):
+        # compose the plan again if the plan of the wrapped source has changed
+        inner_plan = getattr(self.source, 'read_plan', None)
+        if self._plan is None or inner_plan is not self._inner_plan:
+            self._inner_plan = inner_plan
+            self._plan = get_read_plan(self.source).roi(self._roi_start, self._roi_stop)
+        return self._plan
+
     def __getitem__(self, key):
-        mapped_key, to_squeeze = normalize_index(key, self.shape)
-        mapped_key = tuple(slice(k.start + rs, k.stop + rs)
-                           for k, rs in zip(mapped_key, self.roi_start))
-        return squeeze_singletons(self.source[mapped_key], to_squeeze)
+        bb, to_squeeze = normalize_index(key, self.shape)
+        return squeeze_singletons(self.read_plan.read(bb), to_squeeze)
 
     # TODO
     def __setitem__(self, key, item):
@@ -172,42 +307,98 @@ def roi_wrapper_pyramid_factory(source, scale, roi_start, roi_stop):
 # TODO validate the napari scale functionality and decide whether to remove this class
 class ResizeWrapper(SourceWrapper):
     """ Wraper to resize the source on the fly.
+
+    Nearest neighbor resizing (order 0) is composed into the read plan of the wrapped sources,
+    for higher orders the data is interpolated by elf.wrapper.ResizedVolume.
     """
+    preserves_coordinates = False
+
     def __init__(self, source, shape, order=0):
         if source.channel_axis is not None:
             raise NotImplementedError
         super().__init__(source)
-        self._resized = elf.wrapper.ResizedVolume(source, shape, order)
+        self._shape = tuple(shape)
+        self._plan, self._inner_plan = None, None
+        self._resized = None if order == 0 else elf.wrapper.ResizedVolume(source, shape, order)
 
     @property
     def shape(self):
-        return self._resized.shape
+        return self._shape
+
+    @property
+    def read_plan(self):
+        if self._resized is not None:
+            return None
+        # compose the plan again if the plan of the wrapped source has changed
+        inner_plan = getattr(self.source, 'read_plan', None)
+        if self._plan is None or inner_plan is not self._inner_plan:
+            self._inner_plan = inner_plan
+            self._plan = get_read_plan(self.source).resize(self._shape)
+        return self._plan
 
     def __getitem__(self, key):
-        return self._resized[key]
+        if self._resized is not None:
+            return self._resized[key]
+        bb, to_squeeze = normalize_index(key, self.shape)
+        return squeeze_singletons(self.read_plan.read(bb), to_squeeze)
 
-    # TODO disable setitem for immutable sources (once we have them)
     def __setitem__(self, key, item):
         raise NotImplementedError
 
 
 # TODO implement proper API to update the affine matrix
 class AffineWrapper(SourceWrapper):
+    preserves_coordinates = False
+
     def __init__(self, source, matrix, shape=None, order=0, sigma=None):
         if source.channel_axis is not None:
             raise NotImplementedError
         super().__init__(source)
-        self._affine = AffineVolume(source, affine_matrix=matrix,
-                                    shape=shape, order=order, sigma=sigma)
+        self._matrix = np.array(matrix, dtype='float64')
+        self._shape = tuple(source.shape if shape is None else shape)
+        self._order = order
+        self._sigma = sigma
+        self._affine, self._inner_plan = None, None
+
+    def _is_inside(self, shape):
+        # the affine maps output to input coordinates, so the image of the output box
+        # is the convex hull of its mapped corners
+        ndim = len(self._shape)
+        corners = np.array(list(itertools.product(*[(0, sh - 1) for sh in self._shape])), dtype='float64')
+        mapped = corners @ self._matrix[:ndim, :ndim].T + self._matrix[:ndim, -1]
+        return bool(np.all(mapped >= 0) and np.all(mapped <= np.array(shape) - 1))
+
+    def _init_affine(self, plan):
+        source, matrix = self.source, self._matrix
+        # if the wrapped sources only translate the base source (e.g. stacked rois),
+        # the translation is composed into the matrix and the base source is transformed directly.
+        # This is only done if all transformed coordinates are inside of the wrapped source,
+        # otherwise they would be read from the base source instead of being filled.
+        if plan is not None and plan.base is not source and self._sigma is None and self._is_inside(plan.shape):
+            translation = plan.translation
+            if translation is not None:
+                matrix = matrix.copy()
+                matrix[:len(translation), -1] += translation
+                source = plan.base
+        return AffineVolume(source, affine_matrix=matrix, shape=self._shape,
+                            order=self._order, sigma=self._sigma)
+
+    @property
+    def affine(self):
+        # the affine is created again if the plan of the wrapped sources has changed
+        plan = getattr(self.source, 'read_plan', None)
+        if self._affine is None or plan is not self._inner_plan:
+            self._inner_plan = plan
+            self._affine = self._init_affine(plan)
+        return self._affine
 
     @property
     def shape(self):
-        return self._affine.shape
+        return self._shape
 
     def __getitem__(self, key):
-        return self._affine[key]
+        return self.affine[key]
 
-    # TODO disable setitem for immutable sources (once we have them)
     def __setitem__(self, key, item):
         raise NotImplementedError
 
@@ -216,32 +407,177 @@ class CacheWrapper(SourceWrapper):
     """ Wrapper to cache the underlying data source.
 
     To speed up visualisation of out-of-core sources based
-    on hd5f, zarr, n5 etc. Work in progress.
+    on hd5f, zarr, n5 etc. The data is cached blockwise.
+
+    Arguments:
+        source [heimdall.Source] - source to be cached
+        max_cache_size [int] - maximal size of the cache in bytes
+        chunks [tuple[int]] - shape of the cached blocks, by default the chunks
+            of the source data are used (default: None)
+        cache_replacement_strategy [str] - strategy for evicting blocks from the cache,
+            'FIFO' or 'LRU' (default: 'FIFO')
+        compression [str] - compression of the cached blocks, None or 'gzip' (default: None)
+        n_threads [int] - number of threads used to load blocks (default: 1)
+        quantize [str] - quantize the cached blocks of float data to the display precision,
+            None, 'uint8' or 'uint16'. The blocks are quantized against the contrast limits,
+            see `contrast_limits` (default: None)
+        contrast_limits [tuple[float]] - the contrast limits for quantizing, by default the min and max value
+            of the source are used; they are computed from the data for in-memory sources (default: None)
+        dequantize [bool] - whether to return the quantized blocks as float data. Otherwise the quantized
+            data is returned, with contrast limits covering the range of the quantized dtype (default: True)
     """
-    cache_replacement_strategies = ('FIFO',)
+    cache_replacement_strategies = ('FIFO', 'LRU')
+    compression_options = (None, 'gzip')
+    quantize_options = (None, 'uint8', 'uint16')
 
     def __init__(self, source, max_cache_size, chunks=None,
-                 cache_replacement_strategy='FIFO', compression=None):
+                 cache_replacement_strategy='FIFO', compression=None, n_threads=1,
+                 quantize=None, dequantize=True, contrast_limits=None):
         if cache_replacement_strategy not in self.cache_replacement_strategies:
             raise ValueError("Invalid cache replacement strategy %s" % cache_replacement_strategy)
+        if compression not in self.compression_options:
+            raise ValueError("Invalid compression %s" % compression)
+        if quantize not in self.quantize_options:
+            raise ValueError("Invalid quantization %s" % quantize)
+        if quantize is not None and compression is not None:
+            raise ValueError("Cannot combine compression and quantization of the cached blocks")
+        if quantize is not None and not np.issubdtype(source.dtype, np.floating):
+            raise ValueError("Can only quantize float data, got %s" % str(source.dtype))
+        if source.channel_axis is not None:
+            raise NotImplementedError
         super().__init__(source)
-        # select cache based on cache_replacement_strategy once we have moe options
-        internal_cache = elf.wrapper.FIFOCache(max_cache_size, compression)
-        self._cache = elf.wrapper.CachedVolume(source, internal_cache, chunks)
+        self._cache = ChunkCache(max_cache_size,
+                                 update_on_access=cache_replacement_strategy == 'LRU')
+        self._chunks = infer_chunks(source.metadata) if chunks is None else tuple(chunks)
+        self._compression = compression
+        self._n_threads = n_threads
+        self._quantize = quantize
+        self._dequantize = dequantize
+        self._contrast_limits = None
+        if contrast_limits is not None:
+            self.contrast_limits = contrast_limits
+        # blocks without existing chunks are not read or cached if the source has a chunk index
+        self._chunk_index = getattr(source, 'chunk_index', None) if source.channel_axis is None else None
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def quantize(self):
+        return self._quantize
+
+    @property
+    def returns_quantized(self):
+        return self._quantize is not None and not self._dequantize
+
+    @property
+    def contrast_limits(self):
+        """ Contrast limits for quantizing the cached blocks, by default the min and max value of the source.
+        """
+        if self._contrast_limits is None:
+            if self.is_big_data_source:
+                return (self.source.min_val, self.source.max_val)
+            # in-memory sources have no contrast limits, so they are computed from the data once
+            data = np.asarray(self.source[:])
+            self._contrast_limits = (float(np.nanmin(data)), float(np.nanmax(data)))
+        return self._contrast_limits
+
+    @contrast_limits.setter
+    def contrast_limits(self, contrast_limits):
+        min_val, max_val = contrast_limits
+        if min_val >= max_val:
+            raise ValueError("Invalid contrast limits %s" % str(contrast_limits))
+        # cached blocks are quantized again when they are read the next time
+        self._contrast_limits = (min_val, max_val)
+
+    @property
+    def dtype(self):
+        return np.dtype(self._quantize) if self.returns_quantized else self.source.dtype
+
+    @property
+    def min_val(self):
+        if self.returns_quantized:
+            return 0
+        return self.contrast_limits[0] if self._quantize is not None else super().min_val
+
+    @property
+    def max_val(self):
+        if self.returns_quantized:
+            return np.iinfo(self._quantize).max
+        return self.contrast_limits[1] if self._quantize is not None else super().max_val
+
+    def _load_block(self, block_id):
+        block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+        data = self.source[block_bb]
+        if self._quantize is not None:
+            return QuantizedChunk(data, *self.contrast_limits, dtype=self._quantize)
+        return data if self._compression is None else CompressedChunk(data)
+
+    def _fill(self, shape):
+        fill = self._chunk_index.fill((1,), self.source.dtype)
+        if self.returns_quantized:
+            fill = QuantizedChunk(fill, *self.contrast_limits, dtype=self._quantize).data
+        return np.broadcast_to(fill.reshape(()), shape)
+
+    def read_block(self, block_id):
+        """ Read a block through the cache.
+        """
+        if self._chunk_index is not None:
+            block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+            if self._chunk_index.is_empty(block_bb):
+                return self._fill(tuple(b.stop - b.start for b in block_bb))
+        data = self._cache.get_or_load(block_id, lambda: self._load_block(block_id))
+        if self._quantize is not None:
+            # the block was quantized for different contrast limits
+            if data.contrast_limits != tuple(self.contrast_limits):
+                data = self._load_block(block_id)
+                self._cache[block_id] = data
+            return data.dequantize() if self._dequantize else data.data
+        return data if self._compression is None else data.decompress()
+
+    def invalidate(self, block_ids=None):
+        """ Remove the given blocks or all blocks from the cache.
+        """
+        if block_ids is None:
+            self._cache.clear()
+            return
+        for block_id in block_ids:
+            self._cache.invalidate(tuple(block_id))
+
+    def invalidate_bounding_box(self, bb):
+        """ Remove all blocks overlapping with the bounding box from the cache.
+        """
+        self.invalidate(blocks_in_bounding_box(bb, self.chunks))
+
+    def __setitem__(self, key, item):
+        super().__setitem__(key, item)
+        self.invalidate_bounding_box(normalize_index(key, self.shape)[0])
 
     def __getitem__(self, key):
-        return self._cache[key]
+        bb, to_squeeze = normalize_index(key, self.shape)
+        if self._chunk_index is not None and self._chunk_index.is_empty(bb):
+            out = self._fill(tuple(b.stop - b.start for b in bb))
+        else:
+            out = read_blockwise(bb, self.shape, self.chunks, self.dtype, self.read_block,
+                                 n_threads=self._n_threads)
+        return squeeze_singletons(out, to_squeeze)
 
 
 # TODO allow specifying different values and disabling the
 # cache for different levels in the pyramid
 def cache_wrapper_pyramid_factory(source, scale, max_cache_size, chunks=None,
-                                  cache_replacement_strategy='FIFO', compression=None):
+                                  cache_replacement_strategy='FIFO', compression=None,
+                                  quantize=None, dequantize=True):
     """ Pyramid factory for the CacheWrapper.
 
     Use this by binding `max_cache_size` and other optional arguments with partial:
     ```
-    max_cache_size = 100
+    max_cache_size = 1024**3  # 1GB per level
     factory = partial(cache_wrapper_pyramid_factory, max_cache_size=max_cache_size)
     pyramid_source = PyramidSource(..., wrapper_factory=factory)
     ```
@@ -249,10 +585,565 @@ def cache_wrapper_pyramid_factory(source, scale, max_cache_size, chunks=None,
     Arguments:
         source [heimdall.Source] - source to be wraped
         scale [tuple[int]] - scale factor w.r.t. level 0
-        max_cache_size [int] -
-        chunks [tuple] -
-        cache_replacement_strategy [str] -
-        compression [str] -
+        max_cache_size [int] - maximal size of the cache in bytes
+        chunks [tuple] - shape of the cached blocks (default: None)
+        cache_replacement_strategy [str] - 'FIFO' or 'LRU' (default: 'FIFO')
+        compression [str] - compression of the cached blocks (default: None)
+        quantize [str] - quantize the cached blocks of float data, None, 'uint8' or 'uint16' (default: None)
+        dequantize [bool] - whether to return the quantized blocks as float data (default: True)
     """
     return CacheWrapper(source, max_cache_size, chunks,
-                        cache_replacement_strategy, compression)
+                        cache_replacement_strategy, compression,
+                        quantize=quantize, dequantize=dequantize)
+
+
+class MultiLayoutWrapper(SourceWrapper):
+    """ Wrapper that serves each request from the data layout that needs the fewest chunk reads.
+
+    Data chunked in thin slices, e.g. (1, 512, 512), is fast to view along the first axis,
+    but a plane along one of the other axes touches hundreds of chunks. This wrapper reads
+    from the layout that requires reading the least data for the requested region:
+    the source itself, copies of the data with a different chunk shape (see `heimdall.rechunk.rechunk`)
+    or caches of the source with a different block shape that are filled on demand.
+    The wrapper is read-only, because the layouts would not be kept in sync.
+
+    Arguments:
+        source [heimdall.Source] - the source
+        layouts [list] - the alternative layouts: array-likes with the same shape as the source,
+            e.g. rechunked datasets, or block shapes for on-demand caches
+        max_cache_size [int] - maximal size of each on-demand cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used to fill the on-demand caches (default: 1)
+    """
+    def __init__(self, source, layouts, max_cache_size=1024**3, n_threads=1):
+        if source.channel_axis is not None:
+            raise NotImplementedError
+        super().__init__(source)
+        self._layouts = [self.source]
+        for layout in layouts:
+            if isinstance(layout, (tuple, list)):
+                layout = CacheWrapper(source, max_cache_size, chunks=layout,
+                                      cache_replacement_strategy='LRU', n_threads=n_threads)
+            elif tuple(layout.shape) != tuple(self.shape):
+                raise ValueError("Shape of layout %s does not match the source shape %s" % (str(layout.shape),
+                                                                                           str(self.shape)))
+            self._layouts.append(layout)
+        self._layout_chunks = [infer_chunks(source.metadata)] + [infer_chunks(layout)
+                                                                 for layout in self._layouts[1:]]
+
+    @property
+    def layouts(self):
+        return self._layouts
+
+    @property
+    def mutable(self):
+        return False
+
+    def select_layout(self, bb):
+        """ Index of the layout with the lowest read cost for the bounding box.
+        """
+        costs = [read_cost(bb, chunks) for chunks in self._layout_chunks]
+        return costs.index(min(costs))
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        layout = self._layouts[self.select_layout(bb)]
+        return squeeze_singletons(np.asarray(layout[bb]), to_squeeze)
+
+
+class LabelSelectionWrapper(SourceWrapper):
+    """ Wrapper to show only selected ids of a label source.
+
+    Uses a label index to only read the chunks that contain the selected ids,
+    all other values are set to the background label.
+
+    Arguments:
+        source [heimdall.Source] - the label source
+        label_index [heimdall.label_index.LabelIndex] - the label index,
+            by default the index of the source is used (default: None)
+        label_ids [listlike] - the ids to show, all ids are shown if None (default: None)
+        background [int] - value for the ids that are not selected (default: 0)
+    """
+    def __init__(self, source, label_index=None, label_ids=None, background=0):
+        if source.layer_type != 'labels':
+            raise ValueError("LabelSelectionWrapper can only wrap label sources")
+        if source.channel_axis is not None:
+            raise NotImplementedError
+        super().__init__(source)
+        self._label_index = getattr(source, 'label_index', None) if label_index is None else label_index
+        if self._label_index is None:
+            raise ValueError("LabelSelectionWrapper needs a label index")
+        if tuple(self._label_index.shape) != tuple(source.shape):
+            raise ValueError("Shape of label index does not match the source shape")
+        self._background = background
+        self.label_ids = label_ids
+
+    @property
+    def label_index(self):
+        return self._label_index
+
+    @property
+    def label_ids(self):
+        return self._label_ids
+
+    @label_ids.setter
+    def label_ids(self, label_ids):
+        if label_ids is None:
+            self._label_ids = None
+            self._blocks = None
+        else:
+            self._label_ids = np.unique(np.array(label_ids, dtype=self.dtype))
+            self._blocks = self._label_index.get_blocks(self._label_ids)
+
+    def __getitem__(self, key):
+        if self._label_ids is None:
+            return self.source[key]
+
+        bb, to_squeeze = normalize_index(key, self.shape)
+        out = np.full(tuple(b.stop - b.start for b in bb), self._background, dtype=self.dtype)
+        chunks = self._label_index.chunks
+        for block_id in blocks_in_bounding_box(bb, chunks):
+            if block_id not in self._blocks:
+                continue
+            block_bb = block_bounding_box(block_id, chunks, self.shape)
+            in_bb, in_block = overlap_bounding_boxes(bb, block_bb)
+            read_bb = tuple(slice(bl.start + ib.start, bl.start + ib.stop)
+                            for bl, ib in zip(block_bb, in_block))
+            data = self.source[read_bb]
+            out[in_bb] = np.where(np.isin(data, self._label_ids), data, self._background)
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        raise NotImplementedError
+
+
+class RelabelWrapper(SourceWrapper):
+    """ Wrapper to apply a mapping of label ids on the fly, e.g. a merge table.
+
+    The mapping is applied to each requested block with a vectorized lookup and
+    the relabeled blocks are cached. Ids that are not in the mapping keep their value.
+    The mapping can be updated incrementally with `update_mapping`, which only invalidates
+    the cached blocks that contain ids whose mapping has changed.
+
+    Arguments:
+        source [heimdall.Source] - the label source
+        mapping [dict or np.ndarray] - the mapping of ids, either as dict or as
+            array of shape (n_ids, 2) with old and new ids
+        max_cache_size [int] - size of the cache for relabeled blocks in bytes (default: 1GB)
+        chunks [tuple[int]] - shape of the relabeled blocks, by default the chunks
+            of the source data are used (default: None)
+        n_threads [int] - number of threads used to relabel blocks (default: 1)
+        max_lut_size [int] - maximal size in bytes of the dense lookup table that is used
+            instead of the sorted mapping if all mapped ids are non-negative (default: 16MB)
+    """
+    def __init__(self, source, mapping, max_cache_size=1024**3, chunks=None,
+                 n_threads=1, max_lut_size=16 * 1024**2):
+        if source.layer_type != 'labels':
+            raise ValueError("RelabelWrapper can only wrap label sources")
+        if source.channel_axis is not None:
+            raise NotImplementedError
+        super().__init__(source)
+        self._chunks = infer_chunks(source.metadata) if chunks is None else tuple(chunks)
+        self._cache = ChunkCache(max_cache_size)
+        self._n_threads = n_threads
+        self._max_lut_size = max_lut_size
+        self.mapping = mapping
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _to_arrays(self, mapping):
+        if isinstance(mapping, dict):
+            keys = np.fromiter(mapping.keys(), dtype=self.dtype, count=len(mapping))
+            values = np.fromiter(mapping.values(), dtype=self.dtype, count=len(mapping))
+        else:
+            mapping = np.asarray(mapping)
+            if mapping.ndim != 2 or mapping.shape[1] != 2:
+                raise ValueError("Expected mapping of shape (n_ids, 2), got %s" % str(mapping.shape))
+            keys, values = mapping[:, 0].astype(self.dtype), mapping[:, 1].astype(self.dtype)
+        return keys, values
+
+    def _set_arrays(self, keys, values):
+        # keep the last value for duplicate keys
+        keys, values = keys[::-1], values[::-1]
+        keys, first = np.unique(keys, return_index=True)
+        self._keys, self._values = keys, values[first]
+        # use a dense lookup table if the ids are non-negative and small enough
+        if len(keys) > 0 and keys[0] >= 0 and\
+                (int(keys[-1]) + 1) * np.dtype(self.dtype).itemsize <= self._max_lut_size:
+            self._lut = np.arange(int(keys[-1]) + 1, dtype=self.dtype)
+            self._lut[keys] = self._values
+        else:
+            self._lut = None
+
+    @property
+    def mapping(self):
+        return dict(zip(self._keys.tolist(), self._values.tolist()))
+
+    @mapping.setter
+    def mapping(self, mapping):
+        self._set_arrays(*self._to_arrays(mapping))
+        self._cache.clear()
+
+    def update_mapping(self, mapping):
+        """ Update the mapping for some ids and invalidate the affected cached blocks.
+        """
+        keys, values = self._to_arrays(mapping)
+        changed = self.apply_mapping(keys) != values
+        if not changed.any():
+            return
+        # the cached blocks that contain a changed id contain its previous mapped value
+        previous_values = np.unique(self.apply_mapping(keys[changed]))
+        self._set_arrays(np.concatenate([self._keys, keys]), np.concatenate([self._values, values]))
+        for key in self._cache.keys():
+            block = self._cache.peek(key)
+            if block is not None and np.isin(block, previous_values).any():
+                self._cache.invalidate(key)
+
+    def apply_mapping(self, data):
+        """ Apply the mapping to an array of ids.
+        """
+        data = np.asarray(data)
+        if self._lut is not None:
+            in_lut = data < len(self._lut)
+            # negative ids of signed dtypes are not mapped
+            if np.issubdtype(data.dtype, np.signedinteger):
+                in_lut &= data >= 0
+            if in_lut.all():
+                return self._lut[data]
+            out = data.copy()
+            out[in_lut] = self._lut[data[in_lut]]
+            return out
+
+        out = data.copy()
+        if len(self._keys) == 0:
+            return out
+        pos = np.searchsorted(self._keys, data).clip(0, len(self._keys) - 1)
+        found = self._keys[pos] == data
+        out[found] = self._values[pos[found]]
+        return out
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+
+        def read_block(block_id):
+            block_bb = block_bounding_box(block_id, self._chunks, self.shape)
+            return self._cache.get_or_load(block_id, lambda: self.apply_mapping(self.source[block_bb]))
+
+        out = read_blockwise(bb, self.shape, self._chunks, self.dtype, read_block, n_threads=self._n_threads)
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        raise NotImplementedError
+
+
+class ExpressionWrapper(SourceWrapper):
+    """ Wrapper to evaluate an element-wise expression of one or more sources on the fly.
+
+    The expression is evaluated blockwise for the requested region only;
+    the results are cached per block. All sources must have the same shape and scale.
+
+    ```
+    # difference of two predictions
+    diff = ExpressionWrapper([pred1, pred2], lambda a, b: np.abs(a - b))
+    # thresholded prediction, with the expression given as string
+    mask = ExpressionWrapper({'pred': pred1}, 'pred > 0.5')
+    ```
+
+    Arguments:
+        sources [list or dict] - the input sources. Must be a dict mapping the
+            variable names to the sources if the expression is given as string
+        expression [callable or str] - function that is called with the data of the
+            sources or string expression evaluated with numpy available as `np`
+        name [str] - name of the layer (default: None)
+        dtype [str] - dtype of the result, will be inferred if not given (default: None)
+        layer_type [str] - layer type of the result, will be inferred from the dtype if not given (default: None)
+        min_val [float] - min value of the result for contrast limits (default: None)
+        max_val [float] - max value of the result for contrast limits (default: None)
+        max_cache_size [int] - size of the cache for evaluated blocks in bytes (default: 1GB)
+        chunks [tuple[int]] - shape of the evaluated blocks, by default the chunks
+            of the first source are used (default: None)
+        n_threads [int] - number of threads used to evaluate blocks (default: 1)
+    """
+    def __init__(self, sources, expression, name=None, dtype=None, layer_type=None,
+                 min_val=None, max_val=None, max_cache_size=1024**3, chunks=None, n_threads=1):
+        names = None
+        if isinstance(sources, dict):
+            names, sources = list(sources.keys()), list(sources.values())
+        else:
+            sources = list(sources)
+        if len(sources) == 0:
+            raise ValueError("ExpressionWrapper needs at least one source")
+
+        if isinstance(expression, str):
+            if names is None:
+                raise ValueError("Sources must be passed as dict to evaluate a string expression")
+            code = compile(expression, '<expression>', 'eval')
+            self._function = lambda *args: eval(code, {'np': np}, dict(zip(names, args)))
+        elif callable(expression):
+            self._function = expression
+        else:
+            raise ValueError("Invalid expression of type %s" % type(expression))
+
+        super().__init__(sources[0])
+        for source in sources:
+            if not isinstance(source, (Source, SourceWrapper)) or isinstance(source, PyramidSource):
+                raise ValueError("ExpressionWrapper can only wrap a heimdall.Source or source wrapper.")
+            if source.channel_axis is not None:
+                raise NotImplementedError
+            if tuple(source.shape) != tuple(self.source.shape) or tuple(source.scale) != tuple(self.source.scale):
+                raise ValueError("Shapes and scales of all sources in an expression must agree")
+        self._sources = sources
+
+        # infer the dtype by evaluating the expression for a single element
+        if dtype is None:
+            dtype = np.asarray(self._function(*[np.zeros((1,) * source.ndim, dtype=source.dtype)
+                                                for source in sources])).dtype
+        # napari does not display boolean images
+        is_bool = np.dtype(dtype) == np.dtype('bool')
+        self._dtype = np.dtype('uint8') if is_bool else np.dtype(dtype)
+
+        if layer_type is None:
+            layer_type = Source.default_layer_types[str(self._dtype)]
+        elif layer_type not in Source.layer_types:
+            raise ValueError("Layer type %s is not supported" % layer_type)
+        self._layer_type = layer_type
+        self._name = name
+        self._min_val = BigDataSource.infer_min(self._dtype) if min_val is None else min_val
+        if max_val is None:
+            max_val = 1 if is_bool else BigDataSource.infer_max(self._dtype)
+        self._max_val = max_val
+
+        self._chunks = infer_chunks(self.source.metadata) if chunks is None\
+            else tuple(chunks)
+        self._cache = ChunkCache(max_cache_size)
+        self._n_threads = n_threads
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @property
+    def sources(self):
+        return self._sources
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def layer_type(self):
+        return self._layer_type
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    @property
+    def min_val(self):
+        return self._min_val
+
+    @property
+    def max_val(self):
+        return self._max_val
+
+    def evaluate(self, bb):
+        """ Evaluate the expression for a normalized bounding box.
+        """
+        out = self._function(*[source[bb] for source in self._sources])
+        return np.asarray(out).astype(self._dtype, copy=False)
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+
+        def read_block(block_id):
+            block_bb = block_bounding_box(block_id, self._chunks, self.shape)
+            return self._cache.get_or_load(block_id, lambda: self.evaluate(block_bb))
+
+        out = read_blockwise(bb, self.shape, self._chunks, self.dtype, read_block, n_threads=self._n_threads)
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        raise NotImplementedError
+
+
+class WriteBackWrapper(SourceWrapper):
+    """ Wrapper that buffers edits of a source in memory and writes them back in batches.
+
+    Writing to a compressed dataset for every paint stroke requires reading, decompressing
+    and recompressing the affected chunks each time. This wrapper instead holds the edited
+    chunks in memory and writes them to the source chunk-aligned when `flush` is called,
+    periodically in a background thread or when the buffered chunks exceed `max_buffer_size`.
+    Edits can be undone with `undo`; use `stroke` to group several edits into one undo step.
+
+    Arguments:
+        source [heimdall.Source] - the mutable source, usually a label source
+        chunks [tuple[int]] - shape of the buffered blocks, by default the chunks
+            of the source data are used (default: None)
+        flush_interval [float] - interval for flushing in a background thread in seconds.
+            If None, the buffer is only flushed explicitly (default: 5.)
+        max_buffer_size [int] - maximal size of the buffered blocks in bytes (default: 512MB)
+        max_undo_steps [int] - maximal number of edits that can be undone (default: 100)
+        on_flush [callable] - called with the bounding boxes of the written blocks after flushing,
+            e.g. `PyramidUpdater.mark_dirty` (default: None)
+    """
+    def __init__(self, source, chunks=None, flush_interval=5., max_buffer_size=512 * 1024**2,
+                 max_undo_steps=100, on_flush=None):
+        if not source.mutable:
+            raise ValueError("WriteBackWrapper needs a mutable source")
+        if source.channel_axis is not None:
+            raise NotImplementedError
+        super().__init__(source)
+        self._chunks = infer_chunks(source.metadata) if chunks is None else tuple(chunks)
+        self._max_buffer_size = max_buffer_size
+        self._max_undo_steps = max_undo_steps
+        self._on_flush = on_flush
+
+        self._lock = threading.RLock()
+        self._flush_lock = threading.Lock()
+        self._dirty = {}
+        # blocks that are currently written to the source, they are still served from memory
+        self._flushing = {}
+        self._undo_steps = []
+        self._current_step = None
+
+        self._stop = threading.Event()
+        self._thread = None
+        if flush_interval is not None:
+            self._thread = threading.Thread(target=self._flush_periodically, args=(flush_interval,),
+                                            daemon=True)
+            self._thread.start()
+
+    @property
+    def chunks(self):
+        return self._chunks
+
+    @property
+    def dirty_blocks(self):
+        with self._lock:
+            return list(set(self._dirty.keys()) | set(self._flushing.keys()))
+
+    @property
+    def buffer_size(self):
+        return sum(block.nbytes for block in self._dirty.values())
+
+    def _flush_periodically(self, interval):
+        while not self._stop.wait(interval):
+            self.flush()
+
+    def flush(self):
+        """ Write all buffered blocks to the source.
+
+        The blocks are served from memory until they are written. Edits during the flush
+        are buffered for the next flush. Blocks that could not be written are kept in the buffer.
+        """
+        with self._flush_lock:
+            with self._lock:
+                self._flushing, self._dirty = self._dirty, {}
+            block_bbs = []
+            try:
+                for block_id, block in list(self._flushing.items()):
+                    block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+                    self.source[block_bb] = block
+                    with self._lock:
+                        del self._flushing[block_id]
+                    block_bbs.append(block_bb)
+            finally:
+                with self._lock:
+                    # blocks that were edited again during the flush are newer than the failed ones
+                    for block_id, block in self._flushing.items():
+                        self._dirty.setdefault(block_id, block)
+                    self._flushing = {}
+                if block_bbs and self._on_flush is not None:
+                    self._on_flush(block_bbs)
+
+    def close(self):
+        """ Stop the background thread and write all buffered blocks.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _get_dirty_block(self, block_id):
+        if block_id not in self._dirty:
+            if block_id in self._flushing:
+                # the block may not be written yet, so we copy it instead of reading the source
+                self._dirty[block_id] = self._flushing[block_id].copy()
+            else:
+                block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+                self._dirty[block_id] = np.array(self.source[block_bb])
+        return self._dirty[block_id]
+
+    @contextmanager
+    def stroke(self):
+        """ Group all edits in the context into a single undo step.
+        """
+        with self._lock:
+            self._current_step = []
+        try:
+            yield self
+        finally:
+            with self._lock:
+                step, self._current_step = self._current_step, None
+                self._add_undo_step(step)
+
+    def _add_undo_step(self, step):
+        if step:
+            self._undo_steps.append(step)
+            self._undo_steps = self._undo_steps[-self._max_undo_steps:]
+
+    def undo(self):
+        """ Undo the last edit. Returns False if there is nothing to undo.
+        """
+        with self._lock:
+            if not self._undo_steps:
+                return False
+            step = self._undo_steps.pop()
+            for block_id, in_block, previous in reversed(step):
+                self._get_dirty_block(block_id)[in_block] = previous
+        return True
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        # collect the buffered blocks before reading the source, so that blocks
+        # written in the meantime are still overlaid with their buffered data
+        with self._lock:
+            buffered = {}
+            for block_id in blocks_in_bounding_box(bb, self.chunks):
+                block = self._dirty.get(block_id, self._flushing.get(block_id))
+                if block is not None:
+                    buffered[block_id] = block
+        out = np.array(self.source[bb])
+        with self._lock:
+            for block_id, block in buffered.items():
+                block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+                in_bb, in_block = overlap_bounding_boxes(bb, block_bb)
+                out[in_bb] = block[in_block]
+        return squeeze_singletons(out, to_squeeze)
+
+    def __setitem__(self, key, item):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        item = np.asarray(item)
+        if item.ndim > 0:
+            item = np.broadcast_to(np.expand_dims(item, to_squeeze) if to_squeeze else item,
+                                   tuple(b.stop - b.start for b in bb))
+
+        with self._lock:
+            step = []
+            for block_id in blocks_in_bounding_box(bb, self.chunks):
+                block_bb = block_bounding_box(block_id, self.chunks, self.shape)
+                in_bb, in_block = overlap_bounding_boxes(bb, block_bb)
+                block = self._get_dirty_block(block_id)
+                step.append((block_id, in_block, block[in_block].copy()))
+                block[in_block] = item if item.ndim == 0 else item[in_bb]
+
+            if self._current_step is None:
+                self._add_undo_step(step)
+            else:
+                self._current_step.extend(step)
+            buffer_size = self.buffer_size
+
+        if buffer_size > self._max_buffer_size:
+            self.flush()
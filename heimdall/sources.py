@@ -1,11 +1,21 @@
+import threading
 from abc import ABC
+from collections import namedtuple
+from concurrent import futures
 import numpy as np
 import elf.io
+from elf.util import normalize_index, squeeze_singletons
 try:
     import torch
 except ImportError:
     torch = None
 
+from .blocking import block_bounding_box, blocks_in_bounding_box, infer_chunks, n_blocks, read_blockwise
+from .cache import ChunkCache
+from .dask_array import DaskDataset
+from .downsampling import DownsampledDataset, build_pyramid, default_modes
+from .knossos import KnossosCubeDataset, default_n_threads as default_knossos_threads
+
 
 def check_consecutive(scales, expected_start_id=0):
     scales = sorted(scales)
@@ -32,12 +42,81 @@ def is_imaris(keys):
         return False
 
 
+def get_ome_zarr_multiscales(group):
+    """ Get the multiscales metadata of an ome-zarr group or None if it is not an ome-zarr pyramid.
+    """
+    try:
+        multiscales = group.attrs['multiscales'][0]
+        if len(multiscales['datasets']) == 0:
+            return None
+        return multiscales
+    except Exception:
+        return None
+
+
+def get_ome_zarr_scales(multiscales):
+    """ Get the scale factors w.r.t. level 0 from ome-zarr metadata.
+
+    Returns None if the metadata does not contain scale transformations.
+    """
+    def get_scale(dataset):
+        transforms = dataset.get('coordinateTransformations', [])
+        scale = [trafo['scale'] for trafo in transforms if trafo['type'] == 'scale']
+        return scale[0] if scale else None
+
+    level_scales = [get_scale(dataset) for dataset in multiscales['datasets']]
+    if any(scale is None for scale in level_scales):
+        return None
+    ref_scale = level_scales[0]
+    return [tuple(int(round(sc / rsc)) for sc, rsc in zip(scale, ref_scale))
+            for scale in level_scales]
+
+
+class ArrayPyramid:
+    """ Group-like container for a pyramid given as a list of array-likes, from the finest to the coarsest level.
+
+    Arguments:
+        levels [list] - the pyramid levels
+    """
+    def __init__(self, levels):
+        if len(levels) == 0:
+            raise ValueError("ArrayPyramid needs at least one level")
+        if any(level.ndim != levels[0].ndim for level in levels):
+            raise ValueError("All levels of an ArrayPyramid must have the same number of dimensions")
+        self._levels = list(levels)
+
+    @property
+    def levels(self):
+        return self._levels
+
+    def __len__(self):
+        return len(self._levels)
+
+    def __getitem__(self, level):
+        return self._levels[level]
+
+    def keys(self):
+        return ['s%i' % level for level in range(len(self._levels))]
+
+
 def infer_pyramid_format(group):
     """ Infer pyramid format from group object.
 
-    Checks for bdv / imaris multiscale format (hdf5) or format used by paintera (n5).
+    Checks for bdv / imaris multiscale format (hdf5), ome-zarr (multiscales metadata),
+    format used by paintera (n5) or a list of arrays (heimdall.sources.ArrayPyramid).
     Returns None if no format could be inferred.
     """
+    if isinstance(group, ArrayPyramid):
+        return 'arrays'
+
+    if not elf.io.is_group(group):
+        return None
+
+    # check for ome-zarr multiscale format,
+    # this needs to be checked first because it is only defined via metadata
+    if get_ome_zarr_multiscales(group) is not None:
+        return 'ome-zarr'
+
     keys = list(group.keys())
 
     # check for n5 multiscale format
@@ -78,6 +157,42 @@ def infer_pyramid_format(group):
     return None
 
 
+class SourceMetadata(namedtuple('SourceMetadata', ['shape', 'dtype', 'scale', 'chunks',
+                                                 'level_shapes', 'level_scales', 'level_chunks'])):
+    """ Metadata of a source, see `Source.metadata`.
+
+    Arguments:
+        shape [tuple[int]] - shape of the source (without channel axis)
+        dtype [np.dtype] - dtype of the source
+        scale [tuple[int]] - scale of the source in the viewer
+        chunks [tuple[int]] - chunks of the source data, None if the data is not chunked
+        level_shapes [tuple[tuple[int]]] - shapes of the pyramid levels, only the shape for other sources
+        level_scales [tuple[tuple[int]]] - scale factors of the pyramid levels relative to level 0
+        level_chunks [tuple[tuple[int]]] - chunks of the pyramid levels
+    """
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def n_scales(self):
+        return len(self.level_shapes)
+
+    @property
+    def normalized_shape(self):
+        """ The shape multiplied with the scale.
+        """
+        return tuple(sh * sc for sh, sc in zip(self.shape, self.scale))
+
+
+def _get_chunks(data, channel_axis=None):
+    chunks = getattr(data, 'chunks', None)
+    if chunks is None:
+        return None
+    chunks = tuple(int(ch) for ch in chunks)
+    return chunks[1:] if channel_axis is not None else chunks
+
+
 # TODO add 'rgb' attribute
 # TODO support non-zero channel axis
 class Source(ABC):
@@ -117,8 +232,9 @@ class Source(ABC):
         raise ValueError("Invald type of scale, expected one of (int, tuple, list), got %s" % type(scale))
 
     def __init__(self, data, layer_type=None, name=None,
-                 channel_axis=None, scale=None, split_channels=False):
+                 channel_axis=None, scale=None, split_channels=False, mutable=True):
         self._data = data
+        self._mutable = mutable
         self._layer_type = self.to_layer_type(layer_type, data.dtype)
         self._name = name
         self._channel_axis = channel_axis
@@ -126,22 +242,54 @@ class Source(ABC):
             raise NotImplementedError("Only support channel axis 0")
         self._split_channels = split_channels
         self._scale = self.to_scale(scale)
+        self._metadata = None
+
+    def _compute_metadata(self):
+        shape = tuple(self.shape)
+        chunks = _get_chunks(self._data, self.channel_axis)
+        return SourceMetadata(shape, np.dtype(self.dtype), tuple(self.scale), chunks,
+                              (shape,), ((1,) * len(shape),), (chunks,))
+
+    @property
+    def metadata(self):
+        """ Metadata of the source that is computed once and then cached.
+
+        Use this instead of querying the data for its shape, chunks, etc.
+        to avoid repeated metadata requests to the storage backend.
+        """
+        if self._metadata is None:
+            self._metadata = self._compute_metadata()
+        return self._metadata
+
+    def invalidate_metadata(self):
+        """ Recompute the metadata on the next access, e.g. after the data was changed.
+        """
+        self._metadata = None
 
     def __getitem__(self, key):
         return self.data[key]
 
-    # TODO we should have an option to declare a source as mutable / immutable
-    # and disable setitem if appropriate
     def __setitem__(self, key, item):
+        if not self.mutable:
+            raise RuntimeError("Source %s is immutable" % self.name)
         self.data[key] = item
 
+    @property
+    def mutable(self):
+        return self._mutable
+
+    @mutable.setter
+    def mutable(self, mutable):
+        self._mutable = mutable
+
     @property
     def scale(self):
         return self._scale
 
     @scale.setter
     def scale(self, scale):
-        self.scale = self.to_scale(scale)
+        self._scale = self.to_scale(scale)
+        self.invalidate_metadata()
 
     @property
     def data(self):
@@ -189,11 +337,71 @@ class Source(ABC):
 
 class NumpySource(Source):
     """ Source from numpy array.
+
+    For large arrays, an in-memory pyramid can be built, so that the viewer
+    does not need to stride over the full array for zoomed-out views.
+    The levels are downsampled blockwise and in parallel, with mean for raw data
+    and mode for labels, see heimdall.downsampling.build_pyramid.
+    The in-memory copies of the downsampled levels can be released by the memory governor,
+    afterwards they are downsampled on the fly from the next finer level.
+
+    Arguments:
+        data [np.ndarray] - the array
+        pyramid [bool] - whether to build an in-memory pyramid (default: False)
+        n_scales [int] - maximal number of pyramid levels, by default levels are added
+            until all axes are not larger than 64 (default: None)
+        n_threads [int] - number of threads for building the pyramid (default: 1)
+        kwargs - additional arguments for `Source`
     """
-    def __init__(self, data, **kwargs):
+    def __init__(self, data, pyramid=False, n_scales=None, n_threads=1, **kwargs):
         if not isinstance(data, np.ndarray):
             raise ValueError("NumpySource expecsts a numpy array, not %s" % type(data))
         super().__init__(data, **kwargs)
+        self._pyramid, self._scales = None, None
+        if pyramid:
+            if self.channel_axis is not None:
+                raise NotImplementedError("In-memory pyramids are not supported for data with channels")
+            from .memory import InMemoryDataset
+            mode = default_modes[self.layer_type]
+            levels, self._scales = build_pyramid(data, mode, n_scales=n_scales, n_threads=n_threads)
+            self._pyramid = [data]
+            for level, scale, prev_scale in zip(levels[1:], self._scales[1:], self._scales[:-1]):
+                factor = tuple(sc // psc for sc, psc in zip(scale, prev_scale))
+                self._pyramid.append(InMemoryDataset(DownsampledDataset(self._pyramid[-1], factor, mode),
+                                                     data=level))
+
+    def _compute_metadata(self):
+        if self._pyramid is None:
+            return super()._compute_metadata()
+        level_shapes = tuple(tuple(level.shape) for level in self._pyramid)
+        return SourceMetadata(level_shapes[0], np.dtype(self.dtype), tuple(self.scale), None,
+                              level_shapes, tuple(self._scales), (None,) * len(level_shapes))
+
+    @property
+    def is_pyramid(self):
+        return self._pyramid is not None
+
+    @property
+    def scales(self):
+        return [(1,) * self.ndim] if self._scales is None else self._scales
+
+    def get_pyramid(self):
+        """ Get the pyramid levels in the format expected by napari.add_image(is_pyramid=True).
+        """
+        if self._pyramid is None:
+            raise RuntimeError("NumpySource %s was created without a pyramid" % self.name)
+        return self._pyramid
+
+    @property
+    def in_memory_levels(self):
+        """ The downsampled levels of the in-memory pyramid, see `heimdall.memory.InMemoryDataset`.
+        """
+        return [] if self._pyramid is None else self._pyramid[1:]
+
+    def __setitem__(self, key, item):
+        if self._pyramid is not None:
+            raise NotImplementedError("Editing a NumpySource with in-memory pyramid is not supported")
+        super().__setitem__(key, item)
 
 
 class TorchSource(Source):
@@ -237,10 +445,58 @@ class BigDataSource(Source):
         else:
             return None
 
-    def __init__(self, data, min_val=None, max_val=None, **kwargs):
+    def __init__(self, data, min_val=None, max_val=None, label_index=None, chunk_index=None, **kwargs):
         super().__init__(data, **kwargs)
         self._min_val = self.infer_min(data.dtype) if min_val is None else min_val
         self._max_val = self.infer_max(data.dtype) if max_val is None else max_val
+        self.label_index = label_index
+        self.chunk_index = chunk_index
+
+    def __getitem__(self, key):
+        # regions without any existing chunks are returned as fill value views without reading
+        if self._chunk_index is not None:
+            bb, to_squeeze = normalize_index(key, self._data.shape)
+            if self._chunk_index.is_empty(bb):
+                fill = self._chunk_index.fill(tuple(b.stop - b.start for b in bb), self.dtype)
+                return squeeze_singletons(fill, to_squeeze)
+        return self._data[key]
+
+    def __setitem__(self, key, item):
+        super().__setitem__(key, item)
+        # chunks that did not exist before are created by the write
+        if self._chunk_index is not None:
+            self._chunk_index.mark_written(normalize_index(key, self._data.shape)[0])
+
+    def compute_min_max(self, chunks=None, n_threads=1):
+        """ Compute the min and max value of the data blockwise.
+
+        Missing chunks are skipped if the source has a chunk index.
+
+        Arguments:
+            chunks [tuple[int]] - the block shape, by default the chunks of the data are used (default: None)
+            n_threads [int] - number of threads (default: 1)
+        """
+        shape = self._data.shape
+        chunks = infer_chunks(self._data) if chunks is None else tuple(chunks)
+        block_ids = list(np.ndindex(*n_blocks(shape, chunks)))
+        values = []
+        if self._chunk_index is not None:
+            block_ids = [block_id for block_id in block_ids
+                         if not self._chunk_index.is_empty(block_bounding_box(block_id, chunks, shape))]
+            # the missing chunks contain the fill value
+            if self._chunk_index.n_chunks > len(self._chunk_index):
+                values.append(self._chunk_index.fill_value)
+
+        def min_max(block_id):
+            block = np.asarray(self._data[block_bounding_box(block_id, chunks, shape)])
+            return block.min(), block.max()
+
+        with futures.ThreadPoolExecutor(n_threads) as tp:
+            for block_min, block_max in tp.map(min_max, block_ids):
+                values.extend([block_min, block_max])
+        if not values:
+            return None, None
+        return min(values), max(values)
 
     @property
     def min_val(self):
@@ -262,6 +518,44 @@ class BigDataSource(Source):
             raise ValueError("Invalid max value")
         self._max_val = max_val
 
+    def update_data(self, data):
+        """ Replace the underlying dataset, e.g. after it was reopened with a larger shape.
+        """
+        if data.ndim != self._data.ndim or np.dtype(data.dtype) != np.dtype(self.dtype):
+            raise ValueError("Updated data must have the same number of dimensions and dtype")
+        self._data = data
+        if self._chunk_index is not None:
+            self._chunk_index.refresh()
+        self.invalidate_metadata()
+
+    # optional index to look up the bounding boxes and chunks of label ids,
+    # see heimdall.label_index.LabelIndex
+    @property
+    def label_index(self):
+        return self._label_index
+
+    @label_index.setter
+    def label_index(self, label_index):
+        if label_index is not None:
+            if self.layer_type != 'labels':
+                raise ValueError("A label index can only be set for label sources")
+            if tuple(label_index.shape) != tuple(self.data.shape):
+                raise ValueError("Shape of label index %s does not match the data shape %s" % (str(label_index.shape),
+                                                                                             str(self.data.shape)))
+        self._label_index = label_index
+
+    # optional index of the chunks that exist on disk, see heimdall.chunk_index.ChunkIndex
+    @property
+    def chunk_index(self):
+        return self._chunk_index
+
+    @chunk_index.setter
+    def chunk_index(self, chunk_index):
+        if chunk_index is not None and tuple(chunk_index.shape) != tuple(self.data.shape):
+            raise ValueError("Shape of chunk index %s does not match the data shape %s" % (str(chunk_index.shape),
+                                                                                         str(self.data.shape)))
+        self._chunk_index = chunk_index
+
 
 class ZarrSource(BigDataSource):
     """ Source from zarr dataset.
@@ -283,13 +577,56 @@ class HDF5Source(BigDataSource):
 
 class KnossosSource(BigDataSource):
     """ Source from Knossos dataset.
+
+    The cubes are fetched in parallel and cached, see heimdall.knossos.KnossosCubeDataset.
+
+    Arguments:
+        data [] - the knossos dataset
+        max_cache_size [int] - maximal size of the cube cache in bytes (default: 512MB)
+        n_threads [int] - number of threads for fetching cubes (default: 8)
+        kwargs - additional arguments for `BigDataSource`
     """
-    def __init__(self, data, **kwargs):
+    def __init__(self, data, max_cache_size=512 * 1024**2, n_threads=default_knossos_threads, **kwargs):
         if not elf.io.is_knossos(data) and elf.io.is_dataset(data):
             raise ValueError("KnossosSource expects a knossos dataset, not %s" % type(data))
+        if not isinstance(data, KnossosCubeDataset):
+            data = KnossosCubeDataset(data, max_cache_size=max_cache_size, n_threads=n_threads)
+        super().__init__(data, **kwargs)
+
+
+class DaskSource(BigDataSource):
+    """ Source from dask array.
+
+    Only the blocks covering a request are computed and they are cached,
+    see heimdall.dask_array.DaskDataset.
+
+    Arguments:
+        data [dask.array.Array] - the dask array
+        max_cache_size [int] - maximal size of the block cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used by the dask scheduler (default: 4)
+        kwargs - additional arguments for `BigDataSource`
+    """
+    def __init__(self, data, max_cache_size=1024**3, n_threads=4, **kwargs):
+        if not isinstance(data, DaskDataset):
+            data = DaskDataset(data, max_cache_size=max_cache_size, n_threads=n_threads)
         super().__init__(data, **kwargs)
 
 
+def dask_pyramid(arrays, max_cache_size=1024**3, n_threads=4):
+    """ Create an ArrayPyramid from a list of dask arrays, from the finest to the coarsest level.
+
+    The computed blocks of all levels share one cache. Pass the result to `PyramidSource`.
+
+    Arguments:
+        arrays [list[dask.array.Array]] - the dask arrays of the pyramid levels
+        max_cache_size [int] - maximal size of the block cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used by the dask scheduler (default: 4)
+    """
+    cache = ChunkCache(max_cache_size)
+    return ArrayPyramid([DaskDataset(array, n_threads=n_threads, cache=cache, cache_key=level)
+                         for level, array in enumerate(arrays)])
+
+
 class PyramidSource(BigDataSource):
     """ Source for pyramid dataset.
 
@@ -298,6 +635,8 @@ class PyramidSource(BigDataSource):
         - imaris format (stored as h5)
         - n5 mipmap format used by paintera
         - pyknossos file
+        - ome-zarr multiscales (stored as zarr or n5)
+        - list of array-likes (heimdall.sources.ArrayPyramid), e.g. dask arrays
 
     Arguments:
         group [] - the root group of the pyramid store
@@ -305,14 +644,25 @@ class PyramidSource(BigDataSource):
             will be infered fron `group` by default (default: None)
         n_scales [int] - the number of available scale levels.
             Set to the max number of scales by default (default: None)
-        n_threads [int] - number of threads used in z5py backends (default: 1)
+        n_threads [int] - number of threads used in z5py backends and for fetching knossos cubes.
+            Knossos cubes are fetched with 8 threads by default (default: 1)
         wrapper_factory [callable] - factory for a wrapper function applied to each scale
             (default: None)
+        timepoint [int] - the timepoint to display for bdv and imaris.
+            For bdv the timepoint of `group` is used by default (default: None)
+        channel [int] - the channel (setup for bdv) to display for bdv and imaris.
+            For bdv the setup of `group` is used by default (default: None)
+        lazy_axes [bool] - whether to expose time and channel as additional leading axes
+            to the viewer. Only the displayed timepoint and channel are read (default: False)
+
+    `on_change` is called after the timepoint or channel was changed. For sources in the viewer
+    it updates the layer, so the timepoint and channel must then be changed in the gui thread.
     """
-    supported_formats = ('n5', 'knossos', 'bdv', 'imaris')
+    supported_formats = ('n5', 'knossos', 'bdv', 'imaris', 'ome-zarr', 'arrays')
 
     def __init__(self, group, pyramid_format=None,
                  n_scales=None, n_threads=1, wrapper_factory=None,
+                 timepoint=None, channel=None, lazy_axes=False,
                  **kwargs):
         expected_format = infer_pyramid_format(group)
         if pyramid_format is None:
@@ -325,8 +675,23 @@ class PyramidSource(BigDataSource):
         self._format = expected_format
         self._group = group
         self._n_threads = n_threads
+
+        # the datasets are opened once per level, timepoint and channel,
+        # so that switching between timepoints or channels is cheap
+        self._datasets = {}
+        self._in_memory_levels = {}
+        # the levels wrapped with the wrapper factory, so that each wrapper is only created once
+        self._wrapped_levels = {}
+        self._knossos_cache = None
+        self.on_change = None
+        self._init_time_and_channels(timepoint, channel)
+        self._lazy_axes = lazy_axes
+
+        # for ome-zarr the levels and their scales are given by the metadata
+        self._multiscales = get_ome_zarr_multiscales(group) if self._format == 'ome-zarr' else None
+
         # number of scales can be inferred from data or given
-        self.max_n_scales = len(group)
+        self.max_n_scales = len(group) if self._multiscales is None else len(self._multiscales['datasets'])
         if n_scales is None:
             self._n_scales = self.max_n_scales
         else:
@@ -345,10 +710,51 @@ class PyramidSource(BigDataSource):
             if not callable(wrapper_factory):
                 raise ValueError("Invalid wrapper factory")
             self._wrapper_factory = wrapper_factory
+            self._wrapped_levels = {}
             # we need to override the init
             super().__init__(self.get_level(0), **kwargs)
 
+    def _init_time_and_channels(self, timepoint, channel):
+        def count(keys, prefix):
+            return len([key for key in keys if key.startswith(prefix) and key[len(prefix):].isdigit()])
+
+        if self.format == 'bdv':
+            # the group is the setup group 't<timepoint>/s<setup>'
+            try:
+                setup_name, tp_name = self.group.name.split('/')[-2:][::-1]
+                self._base_timepoint, self._base_channel = int(tp_name[1:]), int(setup_name[1:])
+                self._n_timepoints = count(self.group.file.keys(), 't')
+                self._n_channels = count(self.group.parent.keys(), 's')
+            except (AttributeError, ValueError):
+                self._base_timepoint, self._base_channel = 0, 0
+                self._n_timepoints, self._n_channels = 1, 1
+        elif self.format == 'imaris':
+            level = self.group['ResolutionLevel 0']
+            self._base_timepoint, self._base_channel = 0, 0
+            self._n_timepoints = len(level)
+            self._n_channels = len(level['TimePoint 0'])
+        else:
+            self._base_timepoint, self._base_channel = 0, 0
+            self._n_timepoints, self._n_channels = 1, 1
+
+        self._timepoint = self._base_timepoint if timepoint is None else self._check_index(timepoint,
+                                                                                          self._n_timepoints)
+        self._channel = self._base_channel if channel is None else self._check_index(channel,
+                                                                                    self._n_channels)
+
+    @staticmethod
+    def _check_index(index, n_indices):
+        if not 0 <= index < n_indices:
+            raise ValueError("Invalid index %i, expected value in [0, %i)" % (index, n_indices))
+        return index
+
     def _init_scales(self):
+        # read the scales from the metadata if possible, so that we don't open all levels
+        if self._multiscales is not None:
+            scales = get_ome_zarr_scales(self._multiscales)
+            if scales is not None:
+                return scales[:self.n_scales]
+
         ref_shape = self.get_level(0).shape
         ndim = len(ref_shape)
         scales = [ndim * (1,)]
@@ -358,6 +764,13 @@ class PyramidSource(BigDataSource):
             scales.append(scale)
         return scales
 
+    def _compute_metadata(self):
+        levels = [self.get_level(level) for level in range(self.n_scales)]
+        level_shapes = tuple(tuple(level.shape) for level in levels)
+        level_chunks = tuple(_get_chunks(level) for level in levels)
+        return SourceMetadata(level_shapes[0], np.dtype(self.dtype), tuple(self.scale), level_chunks[0],
+                              level_shapes, tuple(tuple(scale) for scale in self.scales), level_chunks)
+
     @property
     def scales(self):
         return self._scales
@@ -379,11 +792,49 @@ class PyramidSource(BigDataSource):
         if n_scales > self.max_n_scales:
             raise ValueError("Invalid number of scales")
         self._n_scales = n_scales
+        self._scales = self._init_scales()
+        self.invalidate_metadata()
 
     @property
     def n_threads(self):
         return self._n_threads
 
+    @property
+    def n_timepoints(self):
+        return self._n_timepoints
+
+    @property
+    def n_channels(self):
+        return self._n_channels
+
+    @property
+    def lazy_axes(self):
+        return self._lazy_axes
+
+    @property
+    def timepoint(self):
+        return self._timepoint
+
+    @timepoint.setter
+    def timepoint(self, timepoint):
+        self._timepoint = self._check_index(timepoint, self.n_timepoints)
+        self._data = self.get_level(0)
+        self.invalidate_metadata()
+        if self.on_change is not None:
+            self.on_change()
+
+    @property
+    def channel(self):
+        return self._channel
+
+    @channel.setter
+    def channel(self, channel):
+        self._channel = self._check_index(channel, self.n_channels)
+        self._data = self.get_level(0)
+        self.invalidate_metadata()
+        if self.on_change is not None:
+            self.on_change()
+
     @n_threads.setter
     def n_threads(self, n_threads):
         self._n_threads = n_threads
@@ -423,28 +874,310 @@ class PyramidSource(BigDataSource):
         source = factory(source)
         return source
 
-    def get_level(self, level):
-        """ Load the dataset at given level
-        """
+    def _open_level(self, level, timepoint, channel):
+        key = (level, timepoint, channel)
+        if key in self._datasets:
+            return self._datasets[key]
+
         if self.format == 'n5':
             source = self.group['s%i' % level]
         elif self.format == 'bdv':
-            source = self.group['%i/cells' % level]
+            if (timepoint, channel) == (self._base_timepoint, self._base_channel):
+                group = self.group
+            else:
+                group = self.group.file['t%05i/s%02i' % (timepoint, channel)]
+            source = group['%i/cells' % level]
         elif self.format == 'knossos':
-            source = self.group['mag%i' % (level + 1)]
+            # the cubes of all levels are fetched in parallel and share one cache
+            if self._knossos_cache is None:
+                self._knossos_cache = ChunkCache(512 * 1024**2)
+            n_threads = self.n_threads if self.n_threads > 1 else default_knossos_threads
+            source = KnossosCubeDataset(self.group['mag%i' % (level + 1)], n_threads=n_threads,
+                                        cache=self._knossos_cache, cache_key=level)
         elif self.format == 'imaris':
-            # We don't support multi-channel / multi-time point
-            # but should expose it somehow
-            source = self.group['ResolutionLevel %i/TimePoint 0/Channel 0/Data' % level]
-        source = self.wrap(source, level)
+            source = self.group['ResolutionLevel %i/TimePoint %i/Channel %i/Data' % (level, timepoint, channel)]
+        elif self.format == 'ome-zarr':
+            source = self.group[self._multiscales['datasets'][level]['path']]
+        elif self.format == 'arrays':
+            source = self.group[level]
+        self._datasets[key] = source
         return source
 
+    def get_level(self, level, timepoint=None, channel=None):
+        """ Load the dataset at given level
+
+        Timepoint and channel only have an effect for bdv and imaris;
+        the current timepoint and channel are used by default.
+        """
+        timepoint = self.timepoint if timepoint is None else timepoint
+        channel = self.channel if channel is None else channel
+        if self._wrapper_factory is None:
+            return self._open_level(level, timepoint, channel)
+        key = (level, timepoint, channel)
+        if key not in self._wrapped_levels:
+            self._wrapped_levels[key] = self.wrap(self._open_level(level, timepoint, channel), level)
+        return self._wrapped_levels[key]
+
+    def get_in_memory_level(self, level, timepoint=None, channel=None):
+        """ Load the dataset at given level into memory and cache it.
+
+        The level is held in a `heimdall.memory.InMemoryDataset`, so that the memory governor can release it.
+        """
+        from .memory import InMemoryDataset
+        timepoint = self.timepoint if timepoint is None else timepoint
+        channel = self.channel if channel is None else channel
+        key = (level, timepoint, channel)
+        if key not in self._in_memory_levels:
+            self._in_memory_levels[key] = InMemoryDataset(self.get_level(level, timepoint, channel))
+        return self._in_memory_levels[key]
+
+    @property
+    def in_memory_levels(self):
+        """ The levels that were loaded into memory with `get_in_memory_level`.
+        """
+        return list(self._in_memory_levels.values())
+
+    def update_in_memory_level(self, level, bb, data, timepoint=None, channel=None):
+        """ Write data to the in-memory copy of a level, if it was loaded.
+
+        The copy is updated in place, so that arrays passed to the viewer stay valid.
+        """
+        timepoint = self.timepoint if timepoint is None else timepoint
+        channel = self.channel if channel is None else channel
+        in_memory_level = self._in_memory_levels.get((level, timepoint, channel))
+        if in_memory_level is not None:
+            in_memory_level.update(bb, data)
+
     def get_pyramid(self):
         """ Load the pyramid in format expected by napari.add_image(is_pyramid=True)
+
+        If `lazy_axes` is set, the levels have time and channel as leading axes.
         """
-        pyramid = [self.get_level(scale) for scale in range(self.n_scales)]
+        if self.lazy_axes:
+            return [TimeChannelLevel(self, level, in_memory=level == self.n_scales - 1)
+                    for level in range(self.n_scales)]
+        pyramid = [self.get_level(scale) for scale in range(self.n_scales - 1)]
         # we load the last pyramid level into memory,
         # because it cannot be passed to np.asarray for z5py and knossos
         # (which is done by napar)
-        pyramid[-1] = pyramid[-1][:]
+        pyramid.append(self.get_in_memory_level(self.n_scales - 1))
+        return pyramid
+
+
+class TimeChannelLevel:
+    """ Array-like for a pyramid level with time and channel as leading axes.
+
+    Only the timepoints and channels that are requested are read.
+    """
+    def __init__(self, source, level, in_memory=False):
+        self._source = source
+        self._level = level
+        self._in_memory = in_memory
+        level_shape = source.metadata.level_shapes[level]
+        self._shape = (source.n_timepoints, source.n_channels) + tuple(level_shape)
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._source.dtype
+
+    def __array__(self, dtype=None, copy=None):
+        # napari converts the coarsest level with np.asarray
+        out = self[:]
+        return out if dtype is None else out.astype(dtype, copy=False)
+
+    def _read(self, timepoint, channel, bb):
+        if self._in_memory:
+            return self._source.get_in_memory_level(self._level, timepoint, channel)[bb]
+        return self._source.get_level(self._level, timepoint, channel)[bb]
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        t_bb, c_bb, bb = bb[0], bb[1], bb[2:]
+        out = np.stack([np.stack([self._read(t, c, bb)
+                                  for c in range(c_bb.start, c_bb.stop)])
+                        for t in range(t_bb.start, t_bb.stop)])
+        return squeeze_singletons(out, to_squeeze)
+
+
+class ProgressiveLevel:
+    """ Array-like for a level of a progressive pyramid source, see `ProgressivePyramidSource`.
+    """
+    def __init__(self, source, level):
+        self._source = source
+        self._level = level
+        self._shape = source.metadata.level_shapes[level]
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    @property
+    def dtype(self):
+        return self._source.dtype
+
+    def __getitem__(self, key):
+        bb, to_squeeze = normalize_index(key, self.shape)
+        return squeeze_singletons(self._source.request(bb, self._level), to_squeeze)
+
+
+class ProgressivePyramidSource(PyramidSource):
+    """ Pyramid source that serves requests coarse-first and refines them in the background.
+
+    A request for a region is answered immediately with the data from the finest level
+    for which the region is already cached (or the coarsest level, which is held in memory),
+    upsampled to the requested level. The finer levels are then read in the background, one
+    after the other from coarse to fine, so that each region is refined step by step;
+    `on_refined(level)` is called whenever a level has been loaded, so that the viewer can update.
+    Refinements are tracked per requested region, so the regions of all visible tiles are refined.
+    Pending refinements are cancelled when a different level is requested, and the oldest
+    ones are cancelled if more than `max_pending` regions are being refined.
+
+    Arguments:
+        group [] - the root group of the pyramid store
+        max_cache_size [int] - size of the chunk cache in bytes (default: 1GB)
+        n_threads [int] - number of threads used for refinement reads (default: 4)
+        on_refined [callable] - called with the level after a refinement read finished (default: None)
+        max_pending [int] - maximal number of regions that are refined at the same time (default: 64)
+        kwargs - additional arguments for `PyramidSource`
+    """
+    def __init__(self, group, max_cache_size=1024**3, n_threads=4, on_refined=None, max_pending=64, **kwargs):
+        super().__init__(group, **kwargs)
+        self._cache = ChunkCache(max_cache_size)
+        self._pool = futures.ThreadPoolExecutor(n_threads)
+        self._levels = [self.get_level(level) for level in range(self.n_scales)]
+        self._level_chunks = [infer_chunks(level) for level in self._levels]
+        # the coarsest level is always held in memory, so that we can serve any request
+        self._levels[-1] = self._levels[-1][:]
+        self.on_refined = on_refined
+
+        self._lock = threading.Lock()
+        self._max_pending = max_pending
+        # the pending refinements per requested region, with a token that identifies
+        # the refinement and the future of its current read
+        self._pending = {}
+
+    @property
+    def cache(self):
+        return self._cache
+
+    def _factor(self, level, target):
+        return tuple(max(int(round(sl / st)), 1)
+                     for sl, st in zip(self.scales[level], self.scales[target]))
+
+    def _map_bounding_box(self, bb, level, target):
+        factor = self._factor(level, target)
+        shape = self._levels[level].shape
+        return tuple(slice(min(b.start // f, sh - 1), min((b.stop + f - 1) // f, sh))
+                     for b, f, sh in zip(bb, factor, shape))
+
+    def _is_cached(self, level, bb):
+        if level == self.n_scales - 1:
+            return True
+        return all((level, block_id) in self._cache
+                   for block_id in blocks_in_bounding_box(bb, self._level_chunks[level]))
+
+    def _read(self, level, bb):
+        ds = self._levels[level]
+        if level == self.n_scales - 1:
+            return ds[bb]
+        chunks = self._level_chunks[level]
+
+        def read_block(block_id):
+            block_bb = block_bounding_box(block_id, chunks, ds.shape)
+            return self._cache.get_or_load((level, block_id), lambda: ds[block_bb])
+
+        return read_blockwise(bb, ds.shape, chunks, self.dtype, read_block)
+
+    def _upsample(self, data, level_bb, bb, factor):
+        for axis, f in enumerate(factor):
+            if f > 1:
+                data = np.repeat(data, f, axis=axis)
+        offsets = [b.start - lb.start * f for b, lb, f in zip(bb, level_bb, factor)]
+        # the coarse levels may be smaller than the upsampled region at the border
+        pad_width = [(0, max(off + b.stop - b.start - sh, 0))
+                     for off, b, sh in zip(offsets, bb, data.shape)]
+        if any(pw[1] > 0 for pw in pad_width):
+            data = np.pad(data, pad_width, mode='edge')
+        return data[tuple(slice(off, off + b.stop - b.start) for off, b in zip(offsets, bb))]
+
+    def _is_pending(self, region, token):
+        pending = self._pending.get(region)
+        return pending is not None and pending[0] is token
+
+    def _refine(self, region, token, bb, level):
+        # bb is the requested bounding box at the level of the region
+        target_level = region[0]
+        with self._lock:
+            if not self._is_pending(region, token):
+                return
+        self._read(level, self._map_bounding_box(bb, level, target_level))
+        with self._lock:
+            if not self._is_pending(region, token):
+                return
+            # the next finer level is only read after this one has finished
+            if level > target_level:
+                self._pending[region] = (token, self._pool.submit(self._refine, region, token, bb, level - 1))
+            else:
+                del self._pending[region]
+        if self.on_refined is not None:
+            self.on_refined(level)
+
+    def _cancel(self, region):
+        _, job = self._pending.pop(region)
+        job.cancel()
+
+    def cancel(self):
+        """ Cancel all pending refinement reads.
+        """
+        with self._lock:
+            for region in list(self._pending):
+                self._cancel(region)
+
+    def request(self, bb, level):
+        """ Request the normalized bounding box at the given level.
+
+        Returns the data of the finest cached level upsampled to `level`
+        and schedules the refinement reads.
+        """
+        best_level = next(lvl for lvl in range(level, self.n_scales)
+                          if self._is_cached(lvl, self._map_bounding_box(bb, lvl, level)))
+        level_bb = self._map_bounding_box(bb, best_level, level)
+        data = self._upsample(self._read(best_level, level_bb), level_bb, bb,
+                              self._factor(best_level, level))
+
+        region = (level, tuple((b.start, b.stop) for b in bb))
+        with self._lock:
+            # the regions of other levels are not displayed anymore
+            for other in [other for other in self._pending if other[0] != level]:
+                self._cancel(other)
+            # the region is refined already if it is requested again
+            if best_level > level and region not in self._pending:
+                while len(self._pending) >= self._max_pending:
+                    self._cancel(next(iter(self._pending)))
+                token = object()
+                self._pending[region] = (token, self._pool.submit(self._refine, region, token,
+                                                                  bb, best_level - 1))
+        return data
+
+    def get_pyramid(self):
+        """ Load the pyramid in format expected by napari.add_image(is_pyramid=True)
+        """
+        pyramid = [ProgressiveLevel(self, level) for level in range(self.n_scales - 1)]
+        pyramid.append(self._levels[-1])
         return pyramid
+
+    def close(self):
+        self.cancel()
+        self._pool.shutdown(wait=False)
@@ -0,0 +1,201 @@
+import json
+import os
+import threading
+import time
+
+import elf.io
+
+from .blocking import block_bounding_box, blocks_in_bounding_box, infer_chunks
+from .sources import BigDataSource, PyramidSource
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def get_chunk_paths(path, key):
+    """ Get the function mapping chunk ids to chunk files and the path of the metadata file.
+
+    For n5 and zarr, the chunks are stored in individual files. For other formats, e.g. hdf5,
+    there are no chunk files and the file itself is returned as metadata file.
+    """
+    ds_path = os.path.join(path, key)
+    attributes = os.path.join(ds_path, 'attributes.json')
+    if os.path.exists(attributes):
+        # n5 stores the chunks in reversed axis order
+        return (lambda chunk_id: os.path.join(ds_path, *[str(cid) for cid in chunk_id[::-1]])), attributes
+
+    zarray = os.path.join(ds_path, '.zarray')
+    if os.path.exists(zarray):
+        with open(zarray) as f:
+            separator = json.load(f).get('dimension_separator', '.')
+        return (lambda chunk_id: os.path.join(ds_path, separator.join(str(cid) for cid in chunk_id))), zarray
+
+    return None, path
+
+
+class DatasetFollower:
+    """ Follow a dataset that is written to while it is viewed.
+
+    Each call to `poll` checks the modification time of the dataset metadata and,
+    for n5 and zarr, of the chunk files that are held by the caches. If the shape of
+    the dataset has grown, the dataset is reopened and the source is updated.
+    Only the cached blocks whose chunks were modified are invalidated.
+    The chunks of the most recently used blocks, which are likely in view, are checked first
+    and at most `max_chunk_checks` chunk files are checked per poll.
+    For formats without chunk files (hdf5) the dataset is reopened and all cached blocks
+    are invalidated when the file is modified.
+
+    The file of a replaced dataset is closed when the dataset is replaced again, so that
+    layers can still read from it until they have switched to the new dataset.
+
+    Arguments:
+        source [heimdall.BigDataSource] - the source to follow
+        path [str] - path to the container
+        key [str] - name of the dataset in the container
+        caches [list[heimdall.source_wrappers.CacheWrapper]] - cache wrappers for the source.
+            They must wrap the source without changing its coordinates (default: None)
+        on_change [callable] - called with `data_replaced` if a change was detected,
+            `data_replaced` is True if the dataset of the source was replaced (default: None)
+        interval [float] - time between polls in seconds, when polling in a thread via `start` (default: 1.)
+        max_chunk_checks [int] - maximal number of chunk files that are checked per poll (default: 1000)
+    """
+    def __init__(self, source, path, key, caches=None, on_change=None, interval=1., max_chunk_checks=1000):
+        if not isinstance(source, BigDataSource) or isinstance(source, PyramidSource):
+            raise ValueError("Can only follow a BigDataSource that is not a pyramid")
+        self._source = source
+        self._path = path
+        self._key = key
+        self._caches = [] if caches is None else list(caches)
+        self._on_change = on_change
+        self._interval = interval
+        self._max_chunk_checks = max_chunk_checks
+
+        self._chunk_path, self._metadata_path = get_chunk_paths(path, key)
+        self._metadata_mtime = _mtime(self._metadata_path)
+        self._chunk_mtimes = {}
+        # start of the last poll that checked all chunks of the cached blocks
+        self._checked_since = time.time_ns()
+        # the files of the current and the previous dataset
+        self._files = []
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def source(self):
+        return self._source
+
+    @property
+    def caches(self):
+        return self._caches
+
+    def _reopen(self):
+        f = elf.io.open_file(self._path, mode='r')
+        ds = f[self._key]
+        ds.n_threads = getattr(self.source.data, 'n_threads', 1)
+        return f, ds
+
+    def _update_data(self, f, ds):
+        self.source.update_data(ds)
+        # layers may still read from the previous dataset until they were updated,
+        # so we only close the file before it (files opened outside of the follower are not closed)
+        self._files.append(f)
+        while len(self._files) > 2:
+            self._files.pop(0).close()
+
+    def _update_shape(self, f, ds):
+        old_shape = tuple(self.source.data.shape)
+        self._update_data(f, ds)
+        # blocks at the old border were cached with a smaller shape
+        for cache in self.caches:
+            for block_id in cache.cache.keys():
+                old_bb = block_bounding_box(block_id, cache.chunks, old_shape)
+                if old_bb != block_bounding_box(block_id, cache.chunks, ds.shape):
+                    cache.invalidate([block_id])
+
+    def _chunk_changed(self, chunk_id):
+        mtime = _mtime(self._chunk_path(chunk_id))
+        if chunk_id in self._chunk_mtimes:
+            chunk_changed = mtime != self._chunk_mtimes[chunk_id]
+        # a chunk we have not seen yet was cached after all chunks were checked the last time,
+        # so it may have changed if it was written after that
+        else:
+            chunk_changed = mtime is not None and mtime >= self._checked_since
+        self._chunk_mtimes[chunk_id] = mtime
+        return chunk_changed
+
+    def _check_chunks(self):
+        # returns whether a chunk has changed and whether all chunks were checked
+        changed = False
+        chunks = infer_chunks(self.source.data)
+        # the chunks checked in this poll, they may be shared by the blocks of several caches
+        checked = {}
+        for cache in self.caches:
+            # the most recently used blocks come last
+            for block_id in reversed(cache.cache.keys()):
+                block_bb = block_bounding_box(block_id, cache.chunks, cache.shape)
+                block_chunks = list(blocks_in_bounding_box(block_bb, chunks))
+                new_chunks = [chunk_id for chunk_id in block_chunks if chunk_id not in checked]
+                if len(checked) + len(new_chunks) > self._max_chunk_checks:
+                    return changed, False
+                checked.update({chunk_id: self._chunk_changed(chunk_id) for chunk_id in new_chunks})
+                if any(checked[chunk_id] for chunk_id in block_chunks):
+                    cache.invalidate([block_id])
+                    changed = True
+        return changed, True
+
+    def poll(self):
+        """ Check the dataset for changes and invalidate the changed blocks.
+
+        Returns whether a change was detected.
+        """
+        poll_start = time.time_ns()
+        changed, data_replaced = False, False
+
+        metadata_mtime = _mtime(self._metadata_path)
+        if metadata_mtime != self._metadata_mtime:
+            self._metadata_mtime = metadata_mtime
+            f, ds = self._reopen()
+            # without chunk files we can't tell which chunks have changed
+            if self._chunk_path is None:
+                self._update_data(f, ds)
+                for cache in self.caches:
+                    cache.invalidate()
+                changed, data_replaced = True, True
+            elif tuple(ds.shape) != tuple(self.source.data.shape):
+                self._update_shape(f, ds)
+                changed, data_replaced = True, True
+            else:
+                f.close()
+
+        if self._chunk_path is not None:
+            chunks_changed, checked_all = self._check_chunks()
+            changed = changed or chunks_changed
+            if checked_all:
+                self._checked_since = poll_start
+
+        if changed and self._on_change is not None:
+            self._on_change(data_replaced)
+        return changed
+
+    def _poll_forever(self):
+        while not self._stop.wait(self._interval):
+            self.poll()
+
+    def start(self):
+        """ Poll in a background thread.
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._poll_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
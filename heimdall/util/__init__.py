@@ -1,2 +1,3 @@
-from .functionality import add_source_to_viewer, normalize_shape
+from .functionality import (add_source_to_viewer, normalize_shape, center_on_label,
+                            follow_source, gui_thread_refresh, SourceLoader)
 from .keybindings import add_keybindings
@@ -1,5 +1,17 @@
-from ..sources import NumpySource, BigDataSource, PyramidSource, TorchSource
-from ..source_wrappers import SourceWrapper
+import threading
+from concurrent import futures
+from qtpy.QtCore import QTimer
+
+from ..sources import NumpySource, BigDataSource, PyramidSource, ProgressivePyramidSource, TorchSource
+from ..source_wrappers import SourceWrapper, CacheWrapper
+
+
+def _layer_data(source):
+    # sources with a chunk index are passed directly, so that regions without chunks are not read;
+    # this is not possible with a channel axis, because the shape of the source does not include it
+    if getattr(source, 'chunk_index', None) is not None and source.channel_axis is None:
+        return source
+    return source.data
 
 
 # TODO more layer customizations
@@ -19,14 +31,25 @@ def add_source(viewer, source, is_pyramid):
 
     contrast_limits = None if isinstance(source, (NumpySource, TorchSource))\
         else [source.min_val, source.max_val]
+    data = source.get_pyramid() if is_pyramid else _layer_data(source)
+
+    # pyramids with lazy time and channel axes have two additional leading axes
+    scale = source.metadata.scale
+    if is_pyramid and getattr(source, 'lazy_axes', False):
+        scale = (1, 1) + tuple(scale)
+        channel_axis = None
 
     if layer_type == 'raw':
-        viewer.add_image(source.data, name=source.name, scale=source.scale,
-                         channel_axis=channel_axis, contrast_limits=contrast_limits,
-                         is_pyramid=is_pyramid)
+        layer = viewer.add_image(data, name=source.name, scale=scale,
+                                 channel_axis=channel_axis, contrast_limits=contrast_limits,
+                                 is_pyramid=is_pyramid)
+        # the levels of pyramids can be quantizing cache wrappers
+        if is_pyramid and not isinstance(layer, list):
+            connect_contrast_limits(layer, data)
     elif layer_type == 'labels':
-        viewer.add_labels(source.data, name=source.name,
-                          scale=source.scale, is_pyramid=is_pyramid)
+        layer = viewer.add_labels(data, name=source.name,
+                                  scale=scale, is_pyramid=is_pyramid)
+    return layer
 
 
 # TODO we can unify this with add_source as well
@@ -38,18 +61,40 @@ def add_source_wrapper(viewer, source):
         raise NotImplementedError
 
     if layer_type == 'raw':
-        viewer.add_image(source, name=source.name,
-                         channel_axis=channel_axis, scale=source.scale,
-                         contrast_limits=[source.min_val, source.max_val],
-                         is_pyramid=False)
+        layer = viewer.add_image(source, name=source.name,
+                                 channel_axis=channel_axis, scale=source.metadata.scale,
+                                 contrast_limits=[source.min_val, source.max_val],
+                                 is_pyramid=False)
+        connect_contrast_limits(layer, [source])
     elif layer_type == 'labels':
         viewer.add_labels(source, name=source.name, is_pyramid=False,
-                          scale=source.scale)
+                          scale=source.metadata.scale)
+
+
+def connect_contrast_limits(layer, sources):
+    """ Quantize the cached blocks of the sources again when the contrast limits of the layer change.
+
+    Only cache wrappers that quantize and return float data are updated,
+    the other sources are ignored.
+    """
+    wrappers = [source for source in sources
+                if isinstance(source, CacheWrapper) and source.quantize is not None and not source.returns_quantized]
+    if not wrappers:
+        return
+
+    def update_contrast_limits(event=None):
+        min_val, max_val = layer.contrast_limits
+        if min_val >= max_val:
+            return
+        for wrapper in wrappers:
+            wrapper.contrast_limits = (min_val, max_val)
+        layer.refresh()
+
+    layer.events.contrast_limits.connect(update_contrast_limits)
 
 
 def normalize_shape(source):
-    shape = source.shape
-    return tuple(sh * sc for sh, sc in zip(shape, source.scale))
+    return source.metadata.normalized_shape
 
 
 def check_shapes(source, reference_shape):
@@ -59,6 +104,30 @@ def check_shapes(source, reference_shape):
                                                                                          str(reference_shape)))
 
 
+# timers that refresh layers in the gui thread, they need to be kept alive
+_refresh_timers = []
+
+
+def gui_thread_refresh(layer, interval=0.05):
+    """ Get a function that requests a refresh of the layer and can be called from any thread.
+
+    Qt and vispy objects may only be changed in the gui thread, which checks for requested
+    refreshes every `interval` seconds. This function must be called in the gui thread.
+    """
+    requested = threading.Event()
+
+    def refresh():
+        if requested.is_set():
+            requested.clear()
+            layer.refresh()
+
+    timer = QTimer()
+    timer.timeout.connect(refresh)
+    timer.start(int(1000 * interval))
+    _refresh_timers.append(timer)
+    return lambda *args: requested.set()
+
+
 # TODO layer specific key-bindings
 def add_source_to_viewer(viewer, source, reference_shape):
     check_shapes(source, reference_shape)
@@ -66,6 +135,18 @@ def add_source_to_viewer(viewer, source, reference_shape):
     # pyramid needs to be checked before BigDataSource,
     # because the former inherits from the latter
     if isinstance(source, PyramidSource):
+        layer = add_source(viewer, source, is_pyramid=True)
+        # re-render the layer when a refinement read of a progressive pyramid has finished
+        if isinstance(source, ProgressivePyramidSource) and source.on_refined is None:
+            source.on_refined = gui_thread_refresh(layer)
+        # show the new pyramid when the timepoint or channel of the source is changed
+        if not source.lazy_axes and source.on_change is None:
+            def update_layer():
+                layer.data = source.get_pyramid()
+            source.on_change = update_layer
+
+    # numpy source with in-memory pyramid
+    elif isinstance(source, NumpySource) and source.is_pyramid:
         add_source(viewer, source, is_pyramid=True)
 
     # default in-memory or big-data sources
@@ -80,3 +161,151 @@ def add_source_to_viewer(viewer, source, reference_shape):
         raise ValueError("Unsupported source %s" % type(source))
 
     # layer specific key-bindings
+
+
+# loaders that are still running, they need to be kept alive until all sources were added
+_active_loaders = set()
+
+
+class SourceLoader:
+    """ Load sources in background threads and add them to the viewer once they are ready.
+
+    The sources are added in the gui thread, which checks for loaded sources every `interval` seconds.
+    They are added in the order they were passed, so that the layer order does not depend on the load times.
+    Sources that fail to load or don't match the reference shape are reported and skipped.
+    If no reference shape is given, the shape of the first source is used.
+    Call `wait` to block until all sources were added.
+
+    Arguments:
+        viewer [napari.Viewer] - the viewer
+        sources [list] - the inputs for `load_source`
+        load_source [callable] - loads a source from its input, called in a background thread
+        reference_shape [tuple[int]] - the reference shape (default: None)
+        n_threads [int] - number of threads for loading the sources (default: 8)
+        interval [float] - time between checks for loaded sources in seconds (default: 0.05)
+    """
+    def __init__(self, viewer, sources, load_source, reference_shape=None, n_threads=8, interval=0.05):
+        self._viewer = viewer
+        self._reference_shape = reference_shape
+        self._errors = []
+
+        self._pool = futures.ThreadPoolExecutor(n_threads)
+        self._futures = [(self._pool.submit(load_source, source), self._get_name(source, i))
+                         for i, source in enumerate(sources)]
+
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._add_ready_sources)
+        self._timer.start(int(1000 * interval))
+        _active_loaders.add(self)
+
+    @staticmethod
+    def _get_name(source, i):
+        name = getattr(source, 'name', None)
+        # sources that are constructed lazily with partial
+        if name is None:
+            name = getattr(source, 'keywords', {}).get('name')
+        return 'source %i' % i if name is None else name
+
+    @property
+    def errors(self):
+        """ List of the names and exceptions of the sources that could not be added.
+        """
+        return self._errors
+
+    @property
+    def done(self):
+        return not self._futures
+
+    def _report(self, name, error):
+        self._errors.append((name, error))
+        self._viewer.status = "Could not add source %s: %s" % (name, str(error))
+
+    def wait(self):
+        """ Wait until all sources are loaded and add them to the viewer.
+        """
+        futures.wait([future for future, _ in self._futures])
+        self._add_ready_sources()
+
+    def _add_ready_sources(self):
+        # add the sources in the order they were passed, a source is only
+        # added once all sources before it were added or failed
+        while self._futures and self._futures[0][0].done():
+            future, name = self._futures.pop(0)
+            try:
+                source = future.result()
+                if self._reference_shape is None:
+                    self._reference_shape = normalize_shape(source)
+                add_source_to_viewer(self._viewer, source, self._reference_shape)
+            except Exception as e:
+                self._report(name, e)
+
+        if self.done:
+            self._timer.stop()
+            self._pool.shutdown(wait=False)
+            _active_loaders.discard(self)
+
+
+def center_on_label(viewer, source, label_id, label_index=None):
+    """ Move the viewer to the center of the bounding box of a label id.
+
+    Arguments:
+        viewer [napari.Viewer] - the viewer
+        source [heimdall.Source] - the label source
+        label_id [int] - the label id
+        label_index [heimdall.label_index.LabelIndex] - the label index,
+            by default the index of the source is used (default: None)
+    """
+    label_index = source.label_index if label_index is None else label_index
+    if label_index is None:
+        raise ValueError("Need a label index to look up label ids")
+    center = label_index.get_center(label_id)
+    # the index may contain the channel axis
+    scale = source.metadata.scale
+    center = center[-len(scale):]
+    for axis, (coord, scale) in enumerate(zip(center, scale)):
+        viewer.dims.set_point(axis, coord * scale)
+
+
+def follow_source(viewer, source, path, key, caches=None, interval=1.):
+    """ Update the viewer while the dataset of a source is being written.
+
+    The dataset is polled in a background thread, see heimdall.streaming.DatasetFollower for details,
+    and the layers are updated in the gui thread. The returned follower and timer must be kept alive
+    while following; call `follower.stop()` to stop following.
+
+    Arguments:
+        viewer [napari.Viewer] - the viewer
+        source [heimdall.BigDataSource] - the source to follow
+        path [str] - path to the container
+        key [str] - name of the dataset in the container
+        caches [list[heimdall.source_wrappers.CacheWrapper]] - cache wrappers for the source (default: None)
+        interval [float] - time between polls in seconds (default: 1.)
+    """
+    from ..streaming import DatasetFollower
+    layers = [layer for layer in viewer.layers if layer.name == source.name]
+    changed, data_replaced = threading.Event(), threading.Event()
+
+    # called in the polling thread
+    def on_change(has_new_data):
+        if has_new_data:
+            data_replaced.set()
+        changed.set()
+
+    def update_layers():
+        if not changed.is_set():
+            return
+        changed.clear()
+        new_data = data_replaced.is_set()
+        data_replaced.clear()
+        for layer in layers:
+            # the layers need to read from the reopened dataset, this also updates their extent
+            if new_data:
+                layer.data = _layer_data(source)
+            layer.refresh()
+
+    follower = DatasetFollower(source, path, key, caches=caches, on_change=on_change, interval=interval)
+    timer = QTimer()
+    timer.timeout.connect(update_layers)
+    timer.start(50)
+    follower.start()
+    return follower, timer
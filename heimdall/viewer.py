@@ -1,4 +1,5 @@
 import os
+from functools import partial
 import numpy as np
 import napari
 import elf.io
@@ -7,10 +8,13 @@ try:
 except ImportError:
     torch = None
 
-from .sources import Source, NumpySource, BigDataSource, PyramidSource, TorchSource
-from .sources import infer_pyramid_format
+from .sources import Source, NumpySource, BigDataSource, PyramidSource, TorchSource, DaskSource
+from .sources import ArrayPyramid, dask_pyramid, infer_pyramid_format, get_ome_zarr_multiscales
+from .dask_array import is_dask_array
 from .source_wrappers import SourceWrapper
-from .util import add_source_to_viewer, add_keybindings, normalize_shape
+from .process_pool import ProcessPoolDataset
+from .memory import InMemoryDataset, MemoryGovernor
+from .util import add_keybindings, normalize_shape, SourceLoader
 
 
 def to_source(data, **kwargs):
@@ -27,11 +31,18 @@ def to_source(data, **kwargs):
         return NumpySource(data, **kwargs)
     elif torch is not None and torch.is_tensor(data):
         return TorchSource(data, **kwargs)
+    # source from lazy dask array, or a pyramid from a list of dask arrays
+    elif is_dask_array(data):
+        return DaskSource(data, **kwargs)
+    elif isinstance(data, (list, tuple)) and len(data) > 0 and all(is_dask_array(level) for level in data):
+        # the cache size and number of threads are arguments of the dask datasets, not of the source
+        dask_kwargs = {name: kwargs.pop(name) for name in ('max_cache_size', 'n_threads') if name in kwargs}
+        return PyramidSource(dask_pyramid(data, **dask_kwargs), pyramid_format='arrays', **kwargs)
     # source from dataset
-    elif elf.io.is_dataset(data):
+    elif elf.io.is_dataset(data) or isinstance(data, (ProcessPoolDataset, InMemoryDataset)):
         return BigDataSource(data, **kwargs)
-    # sources from n5/zarr or hdf5 (bdv) image pyramid
-    elif elf.io.is_group(data):
+    # sources from n5/zarr or hdf5 (bdv) image pyramid or a list of arrays
+    elif elf.io.is_group(data) or isinstance(data, ArrayPyramid):
         pyramid_format = infer_pyramid_format(data)
         if pyramid_format is None:
             raise ValueError("Group does not have one of the supported pyramid formats")
@@ -40,11 +51,35 @@ def to_source(data, **kwargs):
         raise ValueError("No source for %s available" % type(data))
 
 
-def view(*sources, return_viewer=False):
+def load_source(data, memory_governor=None):
+    """ Convert the input data to a heimdall.Source and load its metadata.
+
+    The input can also be a function without arguments that returns the data,
+    so that opening the data is deferred until the source is loaded.
+    If a memory governor is given, the caches and in-memory data of the source are registered with it.
+    """
+    if callable(data):
+        data = data()
+    source = to_source(data)
+    source.metadata
+    if isinstance(source, PyramidSource):
+        source.get_pyramid()
+    if memory_governor is not None:
+        memory_governor.register_source(source)
+    return source
+
+
+def view(*sources, return_viewer=False, n_threads=8, memory_governor=None):
     """ Open viewer for multiple sources.
 
+    The viewer is opened immediately and the sources are loaded in background threads.
+    They are added to the viewer in the given order once they are ready; sources that can't be loaded
+    or don't match the shape of the first source are reported and skipped.
+    If the viewer is returned, this function waits until all sources were added.
+
     Arguments:
-        sources [args]: sources to view, must be instances of heimdall.sources.Source
+        sources [args]: sources to view, must be instances of heimdall.sources.Source,
+            data that can be converted with `to_source` or functions that return such data
         return_viewer [bool]: whether to return the napari viewer object.
             If True, this function must be wrapped into napari.gui_qt like so:
             ```
@@ -53,25 +88,25 @@ def view(*sources, return_viewer=False):
                 ...
             ```
             (default: False)
+        n_threads [int]: number of threads used to load the sources (default: 8)
+        memory_governor [heimdall.memory.MemoryGovernor]: governor that adapts the memory
+            of the sources to the available system memory (default: None)
     """
-    viewer_sources = [to_source(source) for source in sources]
-    reference_shape = normalize_shape(viewer_sources[0])
-
+    load = partial(load_source, memory_governor=memory_governor)
     if return_viewer:
         viewer = napari.Viewer(title='Heimdall')
-        for source in viewer_sources:
-            add_source_to_viewer(viewer, source, reference_shape)
         add_keybindings(viewer)
+        # the sources are added before returning, so that the caller can add further layers on top
+        SourceLoader(viewer, sources, load, n_threads=n_threads).wait()
         return viewer
     else:
         with napari.gui_qt():
             viewer = napari.Viewer(title='Heimdall')
-            for source in viewer_sources:
-                add_source_to_viewer(viewer, source, reference_shape)
             add_keybindings(viewer)
+            SourceLoader(viewer, sources, load, n_threads=n_threads)
 
 
-def view_arrays(data, labels=None, layer_types=None):
+def view_arrays(data, labels=None, layer_types=None, pyramid=False, n_threads=1):
     """ Simple viewer for in-memory data.
 
     This is a legacy function compatible with
@@ -82,6 +117,9 @@ def view_arrays(data, labels=None, layer_types=None):
         data [list[np.ndarray]]: list of arrays to display
         labels [list[str]]: list of layer names (default: None)
         layer_types [list[str]]: list of layer types, by default this is inferred from dtypes (default: None)
+        pyramid [bool]: whether to build in-memory pyramids for the arrays,
+            which speeds up zoomed-out views of large arrays (default: False)
+        n_threads [int]: number of threads for building the pyramids (default: 1)
     """
 
     # dictionaries to translate legacy arguments / dtypes to layer types
@@ -106,7 +144,8 @@ def view_arrays(data, labels=None, layer_types=None):
     for i, d in enumerate(data):
         name = 'layer_%i' % i if labels is None else labels[i]
         layer_type = None if layer_types is None else name_to_layer[layer_types[i]]
-        source = NumpySource(d, name=name, layer_type=layer_type)
+        source = NumpySource(d, name=name, layer_type=layer_type,
+                             pyramid=pyramid, n_threads=n_threads)
         sources.append(source)
 
     # start the viewer
@@ -115,7 +154,8 @@ def view_arrays(data, labels=None, layer_types=None):
 
 def view_container(path, ndim=3,
                    exclude_names=None, include_names=None,
-                   load_into_memory=False, n_threads=1):
+                   load_into_memory=False, n_threads=1, n_processes=None,
+                   adapt_memory=False):
     """ Display contents of hdf5, n5/zarr or knossos file.
 
     Arguments:
@@ -127,18 +167,31 @@ def view_container(path, ndim=3,
             Not compatible with exclude_names (default: None).
         load_into_memory [bool]: whether to load data into memory (default: False).
         n_threads [n_threads]: number of threads used by z5py (default: 1)
+        n_processes [int]: number of processes used to read and decode datasets.
+            Reads in the viewer process if None (default: None)
+        adapt_memory [bool]: whether to adapt the memory used for in-memory data and caches
+            to the available system memory, see heimdall.memory.MemoryGovernor (default: False)
     """
     assert not ((exclude_names is not None) and (include_names is not None))
+    memory_governor = MemoryGovernor().start() if adapt_memory else None
     with elf.io.open_file(path, mode='r') as f:
         if elf.io.is_knossos(f):
             sources = [to_source(f, n_threads=n_threads)]
+        # the root of the container is an ome-zarr pyramid
+        elif get_ome_zarr_multiscales(f) is not None:
+            sources = [to_source(f, name=os.path.basename(path.rstrip('/')))]
         else:
             sources = load_sources_from_file(f, reference_ndim=ndim,
                                              exclude_names=exclude_names,
                                              include_names=include_names,
                                              load_into_memory=load_into_memory,
-                                             n_threads=n_threads)
-        view(*sources)
+                                             n_threads=n_threads,
+                                             n_processes=n_processes,
+                                             path=path, lazy=True,
+                                             release_memory=adapt_memory)
+        view(*sources, memory_governor=memory_governor)
+    if memory_governor is not None:
+        memory_governor.stop()
 
 
 def is_pyramid_ds(name, node):
@@ -160,8 +213,21 @@ def is_pyramid_ds(name, node):
 
 def load_sources_from_file(f, reference_ndim,
                            exclude_names=None, include_names=None,
-                           load_into_memory=False, n_threads=1):
+                           load_into_memory=False, n_threads=1,
+                           n_processes=None, path=None, lazy=False, release_memory=False):
+    """ Load sources for the datasets and pyramids in a file.
+
+    If `lazy` is True, functions that construct the sources are returned instead,
+    see `load_source`. If `release_memory` is True, data loaded into memory is wrapped
+    in a `heimdall.memory.InMemoryDataset`, so that a memory governor can release it.
+    """
     sources = []
+    make_source = (lambda *args, **kwargs: partial(to_source, *args, **kwargs)) if lazy else to_source
+    if n_processes is not None and path is None:
+        raise ValueError("Need the file path to read with multiple processes")
+
+    # the groups that hold pyramids, their datasets are not loaded individually
+    pyramid_groups = []
 
     def visitor(name, node):
 
@@ -178,14 +244,16 @@ def load_sources_from_file(f, reference_ndim,
             # but I am not quite sure how to do this with the h5py(like) visitor pattern
             # check if this is a dataset of a pyramid group
             # and don't load if it is
-            if is_pyramid_ds(name, node):
+            if is_pyramid_ds(name, node) or any(name.startswith(group + '/') for group in pyramid_groups):
                 return
 
             # set the number of threads (only has an effect for z5py datasets)
             # and load into memory if specified
             node.n_threads = n_threads
             if load_into_memory:
-                node = node[:]
+                node = InMemoryDataset(node) if release_memory else node[:]
+            elif n_processes is not None:
+                node = ProcessPoolDataset(path, name, n_processes)
 
             # check the number of dimensions against the reference dimensionality
             ndim = node.ndim
@@ -197,13 +265,14 @@ def load_sources_from_file(f, reference_ndim,
                 return
 
             print("Appending dataset source")
-            sources.append(to_source(node, channel_axis=channel_axis, name=name))
+            sources.append(make_source(node, channel_axis=channel_axis, name=name))
 
         elif elf.io.is_group(node):
             pyramid_format = infer_pyramid_format(node)
             if pyramid_format is not None:
+                pyramid_groups.append(name)
                 # TODO infer the channel axis
-                sources.append(to_source(node, name=name, pyramid_format=pyramid_format))
+                sources.append(make_source(node, name=name, pyramid_format=pyramid_format))
 
     f.visititems(visitor)
     return sources
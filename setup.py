@@ -11,6 +11,7 @@ requires = [
 
 extras = {
     "hdf5": ["h5py"],
+    "export": ["imageio", "tifffile"],
 }
 
 extras["all"] = list(itertools.chain.from_iterable(extras.values()))
@@ -25,6 +26,10 @@ setup(
     url='https://github.com/constantinpape/heimdall',
     license='MIT',
     entry_points={
-        "console_scripts": ["view_container = heimdall.scripts.view_container:main"]
+        "console_scripts": ["view_container = heimdall.scripts.view_container:main",
+                            "serve_container = heimdall.scripts.serve_container:main",
+                            "overview_container = heimdall.scripts.overview_container:main",
+                            "rechunk_dataset = heimdall.scripts.rechunk_dataset:main",
+                            "export_container = heimdall.scripts.export_container:main"]
     },
 )
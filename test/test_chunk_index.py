@@ -0,0 +1,113 @@
+import json
+import os
+import tempfile
+import unittest
+import numpy as np
+
+
+class TestChunkIndex(unittest.TestCase):
+    shape = (64, 64, 64)
+    chunks = (16, 16, 16)
+
+    def setUp(self):
+        self.tmp_folder = tempfile.TemporaryDirectory()
+        self.path = self.tmp_folder.name
+
+    def tearDown(self):
+        self.tmp_folder.cleanup()
+
+    def _write_n5(self, key, chunk_ids):
+        ds_path = os.path.join(self.path, key)
+        os.makedirs(ds_path)
+        with open(os.path.join(ds_path, 'attributes.json'), 'w') as f:
+            json.dump({'dimensions': self.shape[::-1], 'blockSize': self.chunks[::-1],
+                       'dataType': 'uint8', 'compression': {'type': 'raw'}}, f)
+        # n5 stores the chunks in nested directories in reversed axis order
+        for chunk_id in chunk_ids:
+            chunk_dir = os.path.join(ds_path, *[str(cid) for cid in chunk_id[::-1][:-1]])
+            os.makedirs(chunk_dir, exist_ok=True)
+            open(os.path.join(chunk_dir, str(chunk_id[0])), 'wb').close()
+
+    def _write_zarr(self, key, chunk_ids, separator='.', fill_value=0):
+        ds_path = os.path.join(self.path, key)
+        os.makedirs(ds_path)
+        with open(os.path.join(ds_path, '.zarray'), 'w') as f:
+            json.dump({'shape': self.shape, 'chunks': self.chunks, 'dtype': '|u1',
+                       'fill_value': fill_value, 'dimension_separator': separator}, f)
+        for chunk_id in chunk_ids:
+            chunk_path = os.path.join(ds_path, *separator.join(str(cid) for cid in chunk_id).split('/'))
+            os.makedirs(os.path.dirname(chunk_path), exist_ok=True)
+            open(chunk_path, 'wb').close()
+
+    def _check_index(self, index, chunk_ids):
+        self.assertEqual(index.chunk_ids, frozenset(chunk_ids))
+        self.assertEqual(len(index), len(chunk_ids))
+        self.assertEqual(index.n_chunks, 64)
+        for chunk_id in chunk_ids:
+            self.assertTrue(index.exists(chunk_id))
+        self.assertFalse(index.exists((3, 3, 3)))
+
+        # bounding boxes that are small and large relative to the number of existing chunks
+        bbs = [np.s_[0:20, 0:16, 0:16], np.s_[8:40, 0:64, 30:50],
+               np.s_[0:64, 0:64, 0:64], np.s_[48:64, 48:64, 0:16]]
+        for bb in bbs:
+            expected = sorted(chunk_id for chunk_id in chunk_ids
+                              if all(b.start // ch <= cid < -(-b.stop // ch)
+                                     for cid, b, ch in zip(chunk_id, bb, self.chunks)))
+            self.assertEqual(sorted(index.existing_chunks(bb)), expected)
+            self.assertEqual(index.is_empty(bb), len(expected) == 0)
+
+    def test_n5(self):
+        from heimdall.chunk_index import ChunkIndex
+        chunk_ids = [(0, 0, 0), (1, 0, 2), (2, 3, 1)]
+        self._write_n5('data', chunk_ids)
+        self._check_index(ChunkIndex(self.path, 'data'), chunk_ids)
+
+    def test_zarr(self):
+        from heimdall.chunk_index import ChunkIndex
+        chunk_ids = [(0, 1, 0), (2, 2, 2), (3, 0, 1)]
+        for separator in ('.', '/'):
+            key = 'data%s' % ('_nested' if separator == '/' else '')
+            self._write_zarr(key, chunk_ids, separator)
+            self._check_index(ChunkIndex(self.path, key), chunk_ids)
+
+    def test_fill(self):
+        from heimdall.chunk_index import ChunkIndex
+        self._write_zarr('data', [], fill_value=7)
+        index = ChunkIndex(self.path, 'data')
+        self.assertEqual(index.fill_value, 7)
+        fill = index.fill((4, 5), 'uint8')
+        self.assertEqual(fill.shape, (4, 5))
+        self.assertEqual(fill.dtype, np.dtype('uint8'))
+        self.assertTrue((fill == 7).all())
+
+    def test_refresh_and_mark_written(self):
+        from heimdall.chunk_index import ChunkIndex
+        self._write_n5('data', [(0, 0, 0)])
+        index = ChunkIndex(self.path, 'data')
+        bb = np.s_[16:32, 16:32, 16:48]
+        self.assertTrue(index.is_empty(bb))
+
+        index.mark_written(np.s_[16:20, 16:20, 16:20])
+        self.assertEqual(index.existing_chunks(bb), [(1, 1, 1)])
+
+        # chunks written by other processes are only found after a refresh
+        os.makedirs(os.path.join(self.path, 'data', '2', '1'))
+        open(os.path.join(self.path, 'data', '2', '1', '1'), 'wb').close()
+        index.refresh()
+        self.assertEqual(sorted(index.existing_chunks(bb)), [(1, 1, 2)])
+
+    def test_get_chunk_index(self):
+        from heimdall.chunk_index import get_chunk_index
+        self._write_n5('data', [(0, 0, 0)])
+        self.assertIs(get_chunk_index(self.path, 'data'), get_chunk_index(self.path, 'data'))
+
+    def test_invalid_dataset(self):
+        from heimdall.chunk_index import ChunkIndex
+        os.makedirs(os.path.join(self.path, 'data'))
+        with self.assertRaises(ValueError):
+            ChunkIndex(self.path, 'data')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+import numpy as np
+
+
+class TestDownsampling(unittest.TestCase):
+    def _expected_mode(self, data, factor):
+        pad_width = [(0, (-sh) % f) for sh, f in zip(data.shape, factor)]
+        data = np.pad(data, pad_width, mode='edge')
+        out_shape = tuple(sh // f for sh, f in zip(data.shape, factor))
+        expected = np.zeros(out_shape, dtype=data.dtype)
+        for out_id in np.ndindex(*out_shape):
+            window = data[tuple(slice(oid * f, (oid + 1) * f) for oid, f in zip(out_id, factor))]
+            values, counts = np.unique(window, return_counts=True)
+            # ties are resolved to the smallest value
+            expected[out_id] = values[counts.argmax()]
+        return expected
+
+    def test_mode(self):
+        from heimdall.downsampling import downsample
+        rng = np.random.default_rng(0)
+        for factor in [(2, 2, 2), (3, 1, 2), (1, 4, 3)]:
+            data = rng.integers(0, 5, size=(11, 12, 9)).astype('uint32')
+            out = downsample(data, factor, mode='mode')
+            self.assertEqual(out.dtype, data.dtype)
+            self.assertTrue(np.array_equal(out, self._expected_mode(data, factor)))
+
+    def test_mean(self):
+        from heimdall.downsampling import downsample
+        data = np.random.rand(16, 20)
+        out = downsample(data, (4, 2), mode='mean')
+        expected = data.reshape(4, 4, 10, 2).mean(axis=(1, 3))
+        self.assertTrue(np.allclose(out, expected))
+
+    def test_integer_mean(self):
+        from heimdall.downsampling import downsample
+        data = np.array([[0, 1], [1, 1]], dtype='uint8')
+        out = downsample(data, (2, 2), mode='mean')
+        self.assertEqual(out.dtype, data.dtype)
+        self.assertEqual(out[0, 0], 1)
+
+    def test_nearest(self):
+        from heimdall.downsampling import downsample
+        data = np.random.rand(15, 9)
+        self.assertTrue(np.array_equal(downsample(data, (2, 3), mode='nearest'), data[::2, ::3]))
+
+    def test_invalid_mode(self):
+        from heimdall.downsampling import downsample
+        with self.assertRaises(ValueError):
+            downsample(np.zeros((4, 4)), (2, 2), mode='max')
+
+    def test_downsample_blockwise(self):
+        from heimdall.downsampling import downsample, downsample_blockwise
+        data = np.random.randint(0, 10, size=(37, 45, 29)).astype('uint16')
+        for mode in ('mean', 'mode', 'nearest'):
+            expected = downsample(data, (2, 3, 2), mode)
+            out = downsample_blockwise(data, (2, 3, 2), mode, block_shape=(8, 8, 8), n_threads=4)
+            self.assertTrue(np.array_equal(out, expected))
+
+    def test_downsampled_dataset(self):
+        from heimdall.downsampling import DownsampledDataset, downsample
+        data = np.random.randint(0, 10, size=(37, 45)).astype('uint16')
+        expected = downsample(data, (3, 2), 'mode')
+        ds = DownsampledDataset(data, (3, 2), 'mode')
+        self.assertEqual(ds.shape, expected.shape)
+        self.assertTrue(np.array_equal(ds[:], expected))
+        self.assertTrue(np.array_equal(ds[4:9, 10:], expected[4:9, 10:]))
+        self.assertTrue(np.array_equal(ds[5], expected[5]))
+
+
+if __name__ == '__main__':
+    unittest.main()
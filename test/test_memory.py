@@ -0,0 +1,140 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+
+
+class TestMemoryGovernor(unittest.TestCase):
+    # 1MB of total memory, memory is freed below 100kB and caches grow above 250kB of available memory
+    total = 1024**2
+
+    def _governor(self, **kwargs):
+        from heimdall.memory import MemoryGovernor
+        return MemoryGovernor(min_available=0.1, target_available=0.25, shrink_factor=0.5,
+                              min_cache_size=1024, **kwargs)
+
+    def _fill(self, cache, n_blocks, level=None):
+        # blocks of 8kB
+        for block_id in range(n_blocks):
+            key = block_id if level is None else (level, block_id)
+            cache[key] = np.zeros(1024, dtype='float64')
+
+    def test_no_pressure(self):
+        from heimdall.cache import ChunkCache
+        governor = self._governor()
+        cache = ChunkCache(64 * 1024)
+        governor.register_cache(cache)
+        self._fill(cache, 4)
+        governor.step((self.total, self.total // 5))
+        self.assertEqual(cache.max_cache_size, 64 * 1024)
+        self.assertEqual(len(cache), 4)
+
+    def test_evict_fine_levels(self):
+        from heimdall.cache import ChunkCache
+        governor = self._governor()
+        cache = ChunkCache(256 * 1024)
+        governor.register_cache(cache, level_of=lambda key: key[0])
+        for level in range(3):
+            self._fill(cache, 4, level)
+        self.assertEqual(governor.owned_memory, 12 * 8 * 1024)
+
+        # need 16kB, the finest level is evicted first and the budget is kept
+        governor.step((self.total, self.total // 10 - 16 * 1024))
+        self.assertEqual(sorted(set(key[0] for key in cache.keys())), [1, 2])
+        self.assertEqual(cache.max_cache_size, 256 * 1024)
+
+        # the coarsest cached level is kept, afterwards the budget is shrunk
+        governor.step((self.total, self.total // 10 - 64 * 1024))
+        self.assertEqual(sorted(set(key[0] for key in cache.keys())), [2])
+        self.assertEqual(cache.max_cache_size, 128 * 1024)
+
+    def test_shrink_and_grow(self):
+        from heimdall.cache import ChunkCache
+        governor = self._governor()
+        cache = ChunkCache(64 * 1024)
+        governor.register_cache(cache)
+        self._fill(cache, 8)
+        self.assertEqual(cache.current_cache_size, 64 * 1024)
+
+        governor.step((self.total, 0))
+        self.assertEqual(cache.max_cache_size, 32 * 1024)
+        self.assertLessEqual(cache.current_cache_size, 32 * 1024)
+        governor.step((self.total, 0))
+        self.assertEqual(cache.max_cache_size, 16 * 1024)
+
+        # the budget grows back to the initial size, but not beyond it
+        for _ in range(4):
+            governor.step((self.total, self.total))
+        self.assertEqual(cache.max_cache_size, 64 * 1024)
+
+    def test_min_cache_size(self):
+        from heimdall.cache import ChunkCache
+        governor = self._governor()
+        cache = ChunkCache(4 * 1024)
+        governor.register_cache(cache)
+        for _ in range(4):
+            governor.step((self.total, 0))
+        self.assertEqual(cache.max_cache_size, 1024)
+
+    def test_release_in_memory(self):
+        from heimdall.memory import InMemoryDataset
+        governor = self._governor()
+        data = np.random.rand(64, 64)
+        dataset = InMemoryDataset(data)
+        edited = InMemoryDataset(np.zeros((64, 64)))
+        edited[0, 0] = 1
+        governor.register_in_memory(dataset)
+        governor.register_in_memory(edited)
+        self.assertEqual(governor.owned_memory, 2 * data.nbytes)
+
+        governor.step((self.total, 0))
+        self.assertFalse(dataset.is_loaded)
+        # edited datasets are not released
+        self.assertTrue(edited.is_loaded)
+        self.assertEqual(governor.owned_memory, data.nbytes)
+        # the released dataset is read from the data
+        self.assertTrue(np.array_equal(dataset[:], data))
+        self.assertTrue(np.array_equal(np.asarray(dataset), data))
+
+    def test_release_numpy_pyramid(self):
+        from heimdall.downsampling import build_pyramid
+        from heimdall.sources import NumpySource
+        governor = self._governor()
+        data = np.random.randint(0, 10, size=(256, 256)).astype('uint32')
+        source = NumpySource(data, pyramid=True, layer_type='labels')
+        expected, _ = build_pyramid(data, 'mode')
+        governor.register_source(source)
+        self.assertEqual(governor.owned_memory, sum(level.nbytes for level in expected[1:]))
+
+        governor.step((self.total, 0))
+        self.assertEqual(governor.owned_memory, 0)
+        # the released levels are downsampled on the fly
+        for level, expected_level in zip(source.get_pyramid()[1:], expected[1:]):
+            self.assertFalse(level.is_loaded)
+            self.assertTrue(np.array_equal(level[:], expected_level))
+
+    def test_register_source(self):
+        from heimdall.sources import NumpySource
+        from heimdall.source_wrappers import CacheWrapper
+        governor = self._governor()
+        source = NumpySource(np.random.rand(32, 32))
+        wrapper = CacheWrapper(source, max_cache_size=16 * 1024)
+        governor.register_source(wrapper)
+        # registering again does not track the cache twice
+        governor.register_source(wrapper)
+        wrapper[:]
+        self.assertEqual(governor.owned_memory, wrapper.cache.current_cache_size)
+        self.assertGreater(governor.owned_memory, 0)
+
+    def test_read_meminfo(self):
+        from heimdall.memory import read_meminfo
+        with tempfile.TemporaryDirectory() as tmp_folder:
+            path = os.path.join(tmp_folder, 'meminfo')
+            with open(path, 'w') as f:
+                f.write("MemTotal:       16384 kB\nMemFree:         1024 kB\nMemAvailable:    4096 kB\n")
+            self.assertEqual(read_meminfo(path), (16384 * 1024, 4096 * 1024))
+            self.assertIsNone(read_meminfo(os.path.join(tmp_folder, 'missing')))
+
+
+if __name__ == '__main__':
+    unittest.main()
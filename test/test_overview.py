@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+
+
+class RecordingDataset:
+    """ Array-like that records the size of all reads.
+    """
+    def __init__(self, data, chunks):
+        self._data = data
+        self.chunks = chunks
+        self.read_sizes = []
+
+    @property
+    def shape(self):
+        return self._data.shape
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def __getitem__(self, key):
+        out = self._data[key]
+        self.read_sizes.append(np.asarray(out).size)
+        return out
+
+
+class TestReadStrided(unittest.TestCase):
+    def _expected(self, data, max_size, max_planes):
+        strides = [max(1, -(-sh // max_size)) for sh in data.shape]
+        if data.ndim > 1:
+            strides[0] = max(1, -(-data.shape[0] // min(max_size, max_planes)))
+        return data[tuple(slice(None, None, stride) for stride in strides)]
+
+    def test_read_strided(self):
+        from heimdall.overview import read_strided
+        shapes = [(1000,), (300, 257), (40, 300, 257), (7, 129, 64), (5, 6, 70, 33)]
+        for shape in shapes:
+            data = np.random.rand(*shape)
+            for max_size, max_planes in [(128, 16), (32, 8), (1000, 1000)]:
+                out = read_strided(data, max_size=max_size, max_planes=max_planes)
+                expected = self._expected(data, max_size, max_planes)
+                self.assertEqual(out.shape, expected.shape)
+                self.assertTrue(np.array_equal(out, expected))
+
+    def test_read_sizes(self):
+        from heimdall.overview import read_strided
+        shape, chunks = (64, 1024, 1024), (16, 64, 64)
+        data = RecordingDataset(np.zeros(shape, dtype='uint8'), chunks)
+        out = read_strided(data, max_size=128, max_planes=16)
+        self.assertEqual(out.shape, (16, 128, 128))
+        # the planes are read band by band, one band of chunks along the second axis at a time
+        self.assertEqual(len(data.read_sizes), 16 * 1024 // 64)
+        self.assertLessEqual(max(data.read_sizes), 64 * 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+import unittest
+import numpy as np
+
+
+class TestRelabelWrapper(unittest.TestCase):
+    def _wrapper(self, data, mapping, **kwargs):
+        from heimdall.sources import NumpySource
+        from heimdall.source_wrappers import RelabelWrapper
+        source = NumpySource(data, layer_type='labels')
+        return RelabelWrapper(source, mapping, chunks=(8, 8), **kwargs)
+
+    def _expected(self, data, mapping):
+        return np.vectorize(lambda x: mapping.get(x, x), otypes=[data.dtype])(data)
+
+    def test_apply_mapping(self):
+        data = np.random.randint(0, 20, size=(32, 32)).astype('uint64')
+        mapping = {1: 5, 3: 5, 7: 0, 19: 100}
+        # with dense lookup table and with the sorted mapping
+        for max_lut_size in (16 * 1024**2, 0):
+            wrapper = self._wrapper(data, mapping, max_lut_size=max_lut_size)
+            self.assertTrue(np.array_equal(wrapper.apply_mapping(data), self._expected(data, mapping)))
+            self.assertTrue(np.array_equal(wrapper[:], self._expected(data, mapping)))
+
+    def test_ids_outside_of_mapping(self):
+        data = np.array([[0, 2, 1000], [5, 2, 3]], dtype='uint32')
+        wrapper = self._wrapper(data, {2: 3, 3: 2})
+        expected = np.array([[0, 3, 1000], [5, 3, 2]], dtype='uint32')
+        self.assertTrue(np.array_equal(wrapper.apply_mapping(data), expected))
+
+    def test_negative_ids(self):
+        data = np.array([[-5, -1, 0], [1, 2, 3]], dtype='int64')
+        # negative ids in the data are not mapped by the lookup table
+        wrapper = self._wrapper(data, {1: 10, 3: -2})
+        expected = np.array([[-5, -1, 0], [10, 2, -2]], dtype='int64')
+        self.assertTrue(np.array_equal(wrapper.apply_mapping(data), expected))
+
+        # negative ids in the mapping use the sorted mapping
+        mapping = {-1: 7, 2: -5}
+        wrapper = self._wrapper(data, mapping)
+        self.assertTrue(np.array_equal(wrapper.apply_mapping(data), self._expected(data, mapping)))
+
+    def test_mapping_array(self):
+        data = np.random.randint(0, 10, size=(16, 16)).astype('uint32')
+        mapping = np.array([[1, 2], [4, 8], [9, 0]])
+        wrapper = self._wrapper(data, mapping)
+        self.assertTrue(np.array_equal(wrapper[:], self._expected(data, {1: 2, 4: 8, 9: 0})))
+        with self.assertRaises(ValueError):
+            self._wrapper(data, np.array([1, 2, 3]))
+
+    def test_update_mapping(self):
+        data = np.zeros((16, 16), dtype='uint32')
+        data[:8] = 1
+        data[8:] = 2
+        wrapper = self._wrapper(data, {1: 3})
+        self.assertTrue(np.array_equal(wrapper[:], self._expected(data, {1: 3})))
+        self.assertEqual(len(wrapper.cache.keys()), 4)
+
+        # only the blocks that contain id 2 are invalidated
+        wrapper.update_mapping({2: 4})
+        self.assertEqual(sorted(wrapper.cache.keys()), [(0, 0), (0, 1)])
+        self.assertTrue(np.array_equal(wrapper[:], self._expected(data, {1: 3, 2: 4})))
+        self.assertEqual(wrapper.mapping, {1: 3, 2: 4})
+
+
+if __name__ == '__main__':
+    unittest.main()
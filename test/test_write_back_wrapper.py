@@ -0,0 +1,106 @@
+import unittest
+import numpy as np
+
+
+class TestWriteBackWrapper(unittest.TestCase):
+    def _wrapper(self, data, **kwargs):
+        from heimdall.sources import NumpySource
+        from heimdall.source_wrappers import WriteBackWrapper
+        source = NumpySource(data, layer_type='labels')
+        kwargs.setdefault('flush_interval', None)
+        return WriteBackWrapper(source, chunks=(8, 8), **kwargs)
+
+    def test_flush(self):
+        data = np.zeros((32, 32), dtype='uint32')
+        flushed = []
+        wrapper = self._wrapper(data, on_flush=flushed.extend)
+        wrapper[2:10, 3:5] = 1
+        wrapper[20, 20] = 2
+
+        # the edits are buffered and not written to the data yet
+        self.assertEqual(data.sum(), 0)
+        self.assertEqual(sorted(wrapper.dirty_blocks), [(0, 0), (1, 0), (2, 2)])
+        expected = np.zeros_like(data)
+        expected[2:10, 3:5] = 1
+        expected[20, 20] = 2
+        self.assertTrue(np.array_equal(wrapper[:], expected))
+        self.assertEqual(wrapper[20, 20], 2)
+
+        wrapper.flush()
+        self.assertTrue(np.array_equal(data, expected))
+        self.assertEqual(wrapper.dirty_blocks, [])
+        self.assertEqual(len(flushed), 3)
+        self.assertTrue(np.array_equal(wrapper[:], expected))
+
+    def test_flush_on_buffer_size(self):
+        data = np.zeros((32, 32), dtype='uint32')
+        # a single block exceeds the buffer
+        wrapper = self._wrapper(data, max_buffer_size=8 * 8 * 4 - 1)
+        wrapper[0, 0] = 1
+        self.assertEqual(data[0, 0], 1)
+        self.assertEqual(wrapper.dirty_blocks, [])
+
+    def test_undo(self):
+        data = np.zeros((16, 16), dtype='uint32')
+        wrapper = self._wrapper(data)
+        wrapper[0:4, 0:4] = 1
+        wrapper[2:10, 2:10] = 2
+        self.assertTrue(wrapper.undo())
+        expected = np.zeros_like(data)
+        expected[0:4, 0:4] = 1
+        self.assertTrue(np.array_equal(wrapper[:], expected))
+        self.assertTrue(wrapper.undo())
+        self.assertEqual(wrapper[:].sum(), 0)
+        self.assertFalse(wrapper.undo())
+
+    def test_undo_after_flush(self):
+        data = np.zeros((16, 16), dtype='uint32')
+        wrapper = self._wrapper(data)
+        wrapper[5:12, 5:12] = 3
+        wrapper.flush()
+        self.assertEqual(data.sum(), 3 * 49)
+        self.assertTrue(wrapper.undo())
+        self.assertEqual(wrapper[:].sum(), 0)
+        wrapper.flush()
+        self.assertEqual(data.sum(), 0)
+
+    def test_stroke(self):
+        data = np.zeros((16, 16), dtype='uint32')
+        wrapper = self._wrapper(data, max_undo_steps=2)
+        wrapper[0, 0] = 1
+        with wrapper.stroke():
+            wrapper[1, 1] = 2
+            wrapper[9, 9] = 2
+        # the stroke is undone in a single step
+        self.assertTrue(wrapper.undo())
+        self.assertEqual(wrapper[1, 1], 0)
+        self.assertEqual(wrapper[9, 9], 0)
+        self.assertEqual(wrapper[0, 0], 1)
+
+    def test_max_undo_steps(self):
+        data = np.zeros((8, 8), dtype='uint32')
+        wrapper = self._wrapper(data, max_undo_steps=2)
+        for value in (1, 2, 3):
+            wrapper[0, 0] = value
+        self.assertTrue(wrapper.undo())
+        self.assertTrue(wrapper.undo())
+        self.assertFalse(wrapper.undo())
+        self.assertEqual(wrapper[0, 0], 1)
+
+    def test_close(self):
+        data = np.zeros((16, 16), dtype='uint32')
+        wrapper = self._wrapper(data, flush_interval=60.)
+        wrapper[3, 3] = 4
+        wrapper.close()
+        self.assertEqual(data[3, 3], 4)
+
+    def test_immutable_source(self):
+        from heimdall.sources import NumpySource
+        from heimdall.source_wrappers import WriteBackWrapper
+        source = NumpySource(np.zeros((8, 8), dtype='uint32'), layer_type='labels', mutable=False)
+        with self.assertRaises(ValueError):
+            WriteBackWrapper(source, flush_interval=None)
+
+
+if __name__ == '__main__':
+    unittest.main()